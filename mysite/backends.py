@@ -0,0 +1,40 @@
+"""Authentication backend that hashes passwords off the request worker."""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import PermissionDenied
+
+from .passwords import HashingUnavailable, offload, verify
+
+
+class OffloadedModelBackend(ModelBackend):
+    """ModelBackend that hashes through offload() and saves rehashes."""
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        """:return the user if the credentials are valid, else None."""
+        user_model = get_user_model()
+        if username is None:
+            username = kwargs.get(user_model.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = user_model._default_manager.get_by_natural_key(username)
+        except user_model.DoesNotExist:
+            # Hash anyway so unknown usernames take as long as known ones.
+            self._offload(make_password, password)
+            return None
+        valid, rehashed = self._offload(verify, password, user.password)
+        if not valid:
+            return None
+        if rehashed:
+            user.password = rehashed
+            user.save(update_fields=['password'])
+        return user if self.user_can_authenticate(user) else None
+
+    @staticmethod
+    def _offload(function, *args):
+        try:
+            return offload(function, *args)
+        except HashingUnavailable:
+            # Stop trying other backends; the login simply fails for now.
+            raise PermissionDenied("Too many logins in progress.")
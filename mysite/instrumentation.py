@@ -0,0 +1,238 @@
+"""Per-request latency, SQL and template instrumentation.
+
+``InstrumentationMiddleware`` samples a fraction of the requests
+(``METRICS_SAMPLE_RATE``). For each sampled request it records the wall
+time, the number and total time of database queries, and the time spent
+rendering templates; async requests leave the queries out. The samples
+are aggregated per view into in-memory histograms, and ``metrics``
+serves them as JSON. Unsampled requests only pay for one random number.
+"""
+import bisect
+import contextvars
+import random
+import threading
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.http import Http404, JsonResponse
+from django.template.backends import django as django_backend
+
+# Upper bounds of the histogram buckets; the last bucket is unbounded.
+MS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_current_sample = contextvars.ContextVar('metrics_sample', default=None)
+
+
+class Histogram:
+    """Bucketed distribution with a running count and sum."""
+
+    def __init__(self, bounds):
+        """Initialize an empty histogram with the given upper `bounds`."""
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        """Add one observation."""
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def as_dict(self):
+        """:return the histogram as JSON-ready data."""
+        labels = [f'<={bound}' for bound in self.bounds]
+        labels.append(f'>{self.bounds[-1]}')
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count, 3) if self.count else 0,
+            'buckets': dict(zip(labels, self.buckets)),
+        }
+
+
+class Registry:
+    """Thread-safe store of per-view histograms and named counters."""
+
+    def __init__(self):
+        """Initialize an empty registry."""
+        self._lock = threading.Lock()
+        self._views = {}
+        self._counters = {}
+
+    def record(self, view, sample):
+        """Add one sampled request of `view`, skipping unmeasured values."""
+        with self._lock:
+            histograms = self._views.get(view)
+            if histograms is None:
+                histograms = self._views[view] = {
+                    'wall_ms': Histogram(MS_BUCKETS),
+                    'db_queries': Histogram(QUERY_BUCKETS),
+                    'db_ms': Histogram(MS_BUCKETS),
+                    'template_ms': Histogram(MS_BUCKETS),
+                }
+            for name, histogram in histograms.items():
+                value = getattr(sample, name)
+                if value is not None:
+                    histogram.observe(value)
+
+    def increment(self, name, amount=1):
+        """Add `amount` to the counter `name`."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def snapshot(self):
+        """:return every histogram and counter as JSON-ready data."""
+        with self._lock:
+            return {
+                'sample_rate': settings.METRICS_SAMPLE_RATE,
+                'views': {
+                    view: {name: histogram.as_dict()
+                           for name, histogram in histograms.items()}
+                    for view, histograms in sorted(self._views.items())
+                },
+                'counters': dict(sorted(self._counters.items())),
+            }
+
+    def reset(self):
+        """Forget everything recorded so far."""
+        with self._lock:
+            self._views.clear()
+            self._counters.clear()
+
+
+registry = Registry()
+
+
+class Sample:
+    """Measurements of one sampled request."""
+
+    def __init__(self):
+        """Initialize the sample with zero time spent."""
+        self.wall_ms = 0.0
+        self.db_queries = 0
+        self.db_ms = 0.0
+        self.template_ms = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        """Time one database query; installed as an execute wrapper."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_queries += 1
+            self.db_ms += (time.perf_counter() - started) * 1000
+
+
+def view_name(request):
+    """:return the URL name of the view that served `request`."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name or match._func_path
+
+
+class InstrumentationMiddleware:
+    """Record timings of a sample of the requests into the registry."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        """Wrap `get_response`, keeping it async if it is async."""
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        """Serve `request`, measuring it if it is sampled."""
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+        sample = Sample()
+        token = _current_sample.set(sample)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(sample))
+                response = self.get_response(request)
+        finally:
+            _current_sample.reset(token)
+        sample.wall_ms = (time.perf_counter() - started) * 1000
+        registry.record(view_name(request), sample)
+        return response
+
+    async def __acall__(self, request):
+        """Serve an async request, measuring wall and template time.
+
+        Its queries run on the connections of other threads, which this
+        cannot wrap, so they are left out of the histograms.
+        """
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return await self.get_response(request)
+        sample = Sample()
+        sample.db_queries = sample.db_ms = None
+        token = _current_sample.set(sample)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_sample.reset(token)
+        sample.wall_ms = (time.perf_counter() - started) * 1000
+        registry.record(view_name(request), sample)
+        return response
+
+
+class Template:
+    """Template wrapper that adds its render time to the current sample."""
+
+    def __init__(self, template):
+        """Wrap a template of the Django template backend."""
+        self.template = template
+
+    def __getattr__(self, name):
+        """Delegate everything else to the wrapped template."""
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        """Render the template, timing it when the request is sampled."""
+        sample = _current_sample.get()
+        if sample is None:
+            return self.template.render(context, request)
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            sample.template_ms += (time.perf_counter() - started) * 1000
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """Django template backend whose templates report their render time."""
+
+    def from_string(self, template_code):
+        """:return the compiled template, wrapped for timing."""
+        return Template(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        """:return the named template, wrapped for timing."""
+        return Template(super().get_template(template_name))
+
+
+def metrics(request):
+    """Serve the collected metrics to staff and internal addresses.
+
+    The address is the client's as the rate limits see it, so a local
+    reverse proxy listed in ``RATE_LIMIT_TRUSTED_PROXIES`` does not make
+    every visitor internal.
+    """
+    # ratelimit imports the registry from this module.
+    from .ratelimit import client_ip
+    if not (request.user.is_staff
+            or client_ip(request) in settings.INTERNAL_IPS):
+        raise Http404
+    return JsonResponse(registry.snapshot())
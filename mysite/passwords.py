@@ -0,0 +1,151 @@
+"""Tunable password hashers and verification off the request worker.
+
+The settings' ``PASSWORD_HASHER_PROFILE`` puts one of the tuned hashers
+first; the other hashers stay listed so existing hashes keep working and
+are upgraded on the next successful login. With
+``PASSWORD_VERIFICATION['MODE'] = 'pool'`` hashing runs in a bounded pool
+of worker processes, so a burst of logins queues for CPU there instead of
+stalling every request worker.
+
+The pool processes import this module before Django is set up, so it
+must not import any models.
+"""
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.contrib.auth.hashers import (Argon2PasswordHasher,
+                                         ScryptPasswordHasher,
+                                         check_password, make_password)
+
+
+class TunedScryptPasswordHasher(ScryptPasswordHasher):
+    """Scrypt with the cost taken from ``PASSWORD_HASHER_PARAMS``."""
+
+    @property
+    def work_factor(self):
+        """:return the scrypt N parameter."""
+        return settings.PASSWORD_HASHER_PARAMS['SCRYPT_WORK_FACTOR']
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    """Argon2 with the cost taken from ``PASSWORD_HASHER_PARAMS``."""
+
+    @property
+    def time_cost(self):
+        """:return the number of Argon2 passes."""
+        return settings.PASSWORD_HASHER_PARAMS['ARGON2_TIME_COST']
+
+    @property
+    def memory_cost(self):
+        """:return the Argon2 memory in KiB."""
+        return settings.PASSWORD_HASHER_PARAMS['ARGON2_MEMORY_COST']
+
+
+class HashingUnavailable(Exception):
+    """The hashing pool is saturated, too slow or broken."""
+
+
+def verify(password, encoded):
+    """Check `password` against `encoded`, rehashing it if outdated.
+
+    :return (valid, new encoded password or None).
+    """
+    rehashed = []
+    valid = check_password(password, encoded,
+                           setter=lambda raw: rehashed.append(
+                               make_password(raw)))
+    return valid, (rehashed[0] if rehashed else None)
+
+
+def _setup_worker(settings_module):
+    """Configure Django in a freshly spawned pool process."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+
+class HashingPool:
+    """Bounded pool of processes that run the password hashers."""
+
+    def __init__(self, workers=None, max_pending=64):
+        """Initialize a pool; the processes start on first use."""
+        self.workers = workers or os.cpu_count() or 1
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = set()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=get_context('spawn'),
+                    initializer=_setup_worker,
+                    initargs=(os.environ['DJANGO_SETTINGS_MODULE'],))
+            return self._executor
+
+    def run(self, function, *args, timeout=None):
+        """:return function(*args) computed in a pool process.
+
+        :raise HashingUnavailable: if no slot frees up or the result does
+                                   not arrive within `timeout` seconds.
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise HashingUnavailable("Every password hashing slot is busy.")
+        try:
+            future = self._get_executor().submit(function, *args)
+            self._pending.add(future)
+            try:
+                return future.result(timeout)
+            except FutureTimeout:
+                future.cancel()
+                raise HashingUnavailable("Password hashing timed out.")
+            except BrokenProcessPool:
+                # Start fresh processes for the next login.
+                self.shutdown()
+                raise HashingUnavailable("A hashing process died.")
+            finally:
+                self._pending.discard(future)
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        """Cancel the queued hashes and stop the worker processes."""
+        with self._lock:
+            if self._executor is not None:
+                # Executor.shutdown(cancel_futures=True) needs Python 3.9.
+                for future in list(self._pending):
+                    future.cancel()
+                self._executor.shutdown()
+                self._executor = None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_hashing_pool():
+    """:return the process-wide hashing pool, created from the settings."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            options = settings.PASSWORD_VERIFICATION
+            _pool = HashingPool(workers=options['WORKERS'],
+                                max_pending=options['MAX_PENDING'])
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+def offload(function, *args):
+    """:return function(*args), run as PASSWORD_VERIFICATION says."""
+    options = settings.PASSWORD_VERIFICATION
+    if options['MODE'] != 'pool':
+        return function(*args)
+    return get_hashing_pool().run(function, *args,
+                                  timeout=options['TIMEOUT_MS'] / 1000)
@@ -0,0 +1,150 @@
+"""Token bucket rate limits on the writing views.
+
+Each limit in ``RATE_LIMITS`` reads ``"<burst>/<seconds>"``: a client
+may send `burst` requests at once and then one every `seconds / burst`
+seconds. A bucket is a single ``(tokens, timestamp)`` pair in the
+``RATE_LIMIT_CACHE`` cache, set to expire once it would be full again,
+so idle clients cost nothing. It is read and written under a
+``cache.add`` lock, so concurrent requests cannot spend one token twice.
+Without a shared cache backend, or while it is unreachable, the buckets
+live in this process's local memory behind a thread lock.
+
+The address of a client is ``REMOTE_ADDR``. Behind a reverse proxy, list
+the proxy in ``RATE_LIMIT_TRUSTED_PROXIES`` so the address it appends to
+``X-Forwarded-For`` is used instead; otherwise every client shares the
+proxy's bucket.
+"""
+import math
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponse
+
+from .instrumentation import registry
+
+_local = LocMemCache('rate-limits', {'OPTIONS': {'MAX_ENTRIES': 100000}})
+_local_lock = threading.Lock()
+
+# How long a request waits for a bucket's lock, how often it retries, and
+# when a lock left by a dead worker expires.
+LOCK_WAIT = 0.05
+LOCK_POLL = 0.001
+LOCK_TIMEOUT = 1
+
+
+def parse_limit(limit):
+    """:return (burst, seconds) of a ``"<burst>/<seconds>"`` limit."""
+    burst, seconds = limit.split('/')
+    return int(burst), float(seconds)
+
+
+def client_ip(request):
+    """:return the address of the client.
+
+    That is ``REMOTE_ADDR``, or when it is a trusted proxy, the last
+    ``X-Forwarded-For`` address that is not.
+    """
+    address = request.META.get('REMOTE_ADDR', '')
+    trusted = settings.RATE_LIMIT_TRUSTED_PROXIES
+    if address not in trusted:
+        return address
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+    for hop in reversed([hop.strip() for hop in forwarded.split(',')]):
+        if hop and hop not in trusted:
+            return hop
+    return address
+
+
+def _take(store, key, burst, seconds, now):
+    """Take a token from the bucket under `key` in `store`, unlocked."""
+    now = time.time() if now is None else now
+    rate = burst / seconds
+    tokens, stamp = store.get(key) or (burst, now)
+    tokens = min(burst, tokens + (now - stamp) * rate)
+    wait = 0
+    if tokens >= 1:
+        tokens -= 1
+    else:
+        wait = (1 - tokens) / rate
+    # The bucket expires when it would be full again.
+    store.set(key, (tokens, now), math.ceil((burst - tokens) / rate) + 1)
+    return wait
+
+
+def take_token(key, burst, seconds, now=None):
+    """Take a token from the bucket stored under `key`.
+
+    A client whose bucket stays locked for ``LOCK_WAIT`` seconds is
+    refused, as it is already sending requests in parallel.
+
+    :return 0 if a token was taken, or the seconds until one is refilled.
+    """
+    try:
+        store = caches[settings.RATE_LIMIT_CACHE]
+        lock = f'{key}:lock'
+        deadline = time.monotonic() + LOCK_WAIT
+        while not store.add(lock, True, LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                return seconds / burst
+            time.sleep(LOCK_POLL)
+        try:
+            return _take(store, key, burst, seconds, now)
+        finally:
+            store.delete(lock)
+    except Exception:
+        # A shared cache that is down must not take the site with it.
+        registry.increment('rate_limit.fallback')
+    with _local_lock:
+        return _take(_local, key, burst, seconds, now)
+
+
+def retry_after(request, scope):
+    """Take a token from every bucket of the client for `scope`.
+
+    The user's bucket is ``RATE_LIMITS['<scope>:user']`` and the
+    address's is ``RATE_LIMITS['<scope>:ip']``; a missing limit is not
+    enforced.
+
+    :return 0 if the request may proceed, or the seconds to wait.
+    """
+    buckets = []
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        buckets.append(('user', user.pk))
+    buckets.append(('ip', client_ip(request)))
+    wait = 0
+    for kind, identity in buckets:
+        limit = settings.RATE_LIMITS.get(f'{scope}:{kind}')
+        if limit:
+            wait = max(wait, take_token(f'rate:{scope}:{kind}:{identity}',
+                                        *parse_limit(limit)))
+    if wait:
+        registry.increment(f'rate_limit.{scope}')
+    return wait
+
+
+def too_many_requests(wait, response=None):
+    """:return `response`, or a new one, as a 429 with a Retry-After."""
+    if response is None:
+        response = HttpResponse("Too many requests.")
+    response.status_code = 429
+    response['Retry-After'] = str(math.ceil(wait))
+    return response
+
+
+def rate_limit(scope):
+    """Answer POSTs over the `scope` limits with a 429 before the view."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method == 'POST':
+                wait = retry_after(request, scope)
+                if wait:
+                    return too_many_requests(wait)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
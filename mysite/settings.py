@@ -11,7 +11,8 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
+from django.core.exceptions import ImproperlyConfigured
 import os.path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "mysite.instrumentation.InstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -50,15 +52,35 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    'django.contrib.sessions.middleware.SessionMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
 ]
 
+# SESSION_PROFILE=signed_cookies or cache keeps sessions out of the
+# database, and either one stores messages in a cookie, so the detail ->
+# vote -> results cycle never reads or writes the session table. The cache
+# profile needs a shared CACHE_BACKEND (see SHARED_CACHE below).
+SESSION_PROFILE = config("SESSION_PROFILE", cast=str, default="database")
+
+if SESSION_PROFILE == "signed_cookies":
+    SESSION_ENGINE = "django.contrib.sessions.backends.signed_cookies"
+    SESSION_COOKIE_HTTPONLY = True
+elif SESSION_PROFILE == "cache":
+    SESSION_ENGINE = "django.contrib.sessions.backends.cache"
+
+if SESSION_PROFILE != "database":
+    MESSAGE_STORAGE = "django.contrib.messages.storage.cookie.CookieStorage"
+
 ROOT_URLCONF = "mysite.urls"
 
+# Fraction of requests whose timings and queries are recorded for /metrics/.
+METRICS_SAMPLE_RATE = config("METRICS_SAMPLE_RATE", cast=float, default=0.1)
+
+# Addresses allowed to read /metrics/ without a staff login. None by
+# default: behind a local reverse proxy every request comes from 127.0.0.1.
+INTERNAL_IPS = config("INTERNAL_IPS", cast=Csv(), default="")
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'mysite.instrumentation.DjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -82,9 +104,165 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # A file-backed test database gives the concurrency tests real
+        # SQLite locking; the in-memory shared cache fails instead of waiting.
+        "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
     }
 }
 
+# DATABASE_PROFILE=tuned switches SQLite to WAL journaling with a busy
+# timeout, a larger page cache, memory-mapped reads and persistent
+# connections, so concurrent voters wait for the lock instead of failing.
+DATABASE_PROFILE = config("DATABASE_PROFILE", cast=str, default="default")
+
+SQLITE_TUNED_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": config("DB_SYNCHRONOUS", cast=str, default="NORMAL"),
+    "busy_timeout": config("DB_BUSY_TIMEOUT_MS", cast=int, default=20000),
+    "cache_size": config("DB_CACHE_SIZE", cast=int, default=-64000),
+    "mmap_size": config("DB_MMAP_SIZE", cast=int, default=268435456),
+    "temp_store": "MEMORY",
+}
+
+if DATABASE_PROFILE == "tuned":
+    DATABASES["default"].update({
+        "ENGINE": "mysite.tuned_sqlite",
+        "CONN_MAX_AGE": config("DB_CONN_MAX_AGE", cast=int, default=600),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {
+            "timeout": SQLITE_TUNED_PRAGMAS["busy_timeout"] / 1000,
+            "pragmas": SQLITE_TUNED_PRAGMAS,
+        },
+    })
+
+# DB_REPLICA_NAME adds a "replica" SQLite file that the index, detail and
+# results pages read from. "python manage.py replicate --watch" keeps it
+# in sync with the primary; writes always go to the primary.
+DB_REPLICA_NAME = config("DB_REPLICA_NAME", cast=str, default="")
+
+if DB_REPLICA_NAME:
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "NAME": BASE_DIR / DB_REPLICA_NAME,
+        "TEST": {"MIRROR": "default"},
+    }
+
+# VOTE_SHARDS=n keeps the votes of question q in their own SQLite file,
+# votes_<q % n>.sqlite3, instead of the main vote table. Create each one
+# with "python manage.py migrate --database votes_<i>" and run
+# "python manage.py shard_votes" after changing n. The shards hold only
+# votes, so their foreign keys cannot be checked there.
+POLLS_VOTE_SHARDS = config("VOTE_SHARDS", cast=int, default=0)
+
+for shard in range(POLLS_VOTE_SHARDS):
+    shard_options = dict(DATABASES["default"].get("OPTIONS", {}))
+    shard_options["pragmas"] = {**shard_options.get("pragmas", {}),
+                                "foreign_keys": "OFF"}
+    DATABASES[f"votes_{shard}"] = {
+        **DATABASES["default"],
+        "ENGINE": "mysite.tuned_sqlite",
+        "NAME": BASE_DIR / f"votes_{shard}.sqlite3",
+        "OPTIONS": shard_options,
+        "TEST": {"NAME": BASE_DIR / f"test_votes_{shard}.sqlite3"},
+    }
+
+# "python manage.py archive_vote_shards" moves the votes of closed
+# questions into read-only files in this directory.
+POLLS_VOTE_ARCHIVE_DIR = BASE_DIR / config("VOTE_ARCHIVE_DIR", cast=str,
+                                           default="vote-archive")
+
+# "python manage.py freeze_polls" stores the final tallies of questions
+# closed for FREEZE_AFTER_DAYS, and with FREEZE_ARCHIVE_VOTES also moves
+# their votes to the archive directory.
+POLLS_FREEZE_AFTER_DAYS = config("FREEZE_AFTER_DAYS", cast=float, default=1)
+POLLS_FREEZE_ARCHIVE_VOTES = config("FREEZE_ARCHIVE_VOTES", cast=bool,
+                                    default=False)
+
+DATABASE_ROUTERS = [
+    "polls.routers.VoteShardRouter",
+    "polls.routers.PrimaryReplicaRouter",
+]
+
+POLLS_READ_DATABASE = "replica" if DB_REPLICA_NAME else None
+
+# Seconds a voter keeps reading from the primary after voting.
+POLLS_REPLICA_STICKY_SECONDS = config("REPLICA_STICKY_SECONDS", cast=int,
+                                      default=30)
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": config("CACHE_BACKEND", cast=str,
+                          default="django.core.cache.backends.locmem."
+                                  "LocMemCache"),
+        "LOCATION": config("CACHE_LOCATION", cast=str, default="ku-polls"),
+    }
+}
+
+# A per-process cache is shared neither between workers nor with the
+# management commands.
+SHARED_CACHE = not CACHES["default"]["BACKEND"].endswith(
+    (".LocMemCache", ".DummyCache"))
+
+if SESSION_PROFILE == "cache" and not SHARED_CACHE:
+    raise ImproperlyConfigured(
+        "SESSION_PROFILE=cache needs a CACHE_BACKEND shared by every "
+        "worker; with a per-process cache users are logged out at random.")
+
+# The ETags of the index and the JSON API come from versions kept in the
+# default cache, so with a per-process cache another worker's changes
+# would go unseen and clients would get 304s for stale pages. Turn
+# CONDITIONAL_GET on by hand only for a single-process server.
+POLLS_CONDITIONAL_GET = config("CONDITIONAL_GET", cast=bool,
+                               default=SHARED_CACHE)
+
+# Token bucket limits on POSTs, as "<burst>/<seconds>" per user and per
+# client address; an empty value turns a limit off. Set RATE_LIMIT_CACHE
+# to a shared cache alias so every worker counts against the same buckets.
+# Behind a reverse proxy, list its address in RATE_LIMIT_TRUSTED_PROXIES so
+# the client address comes from X-Forwarded-For, or turn the *_IP limits
+# off: every client would otherwise share the proxy's bucket.
+RATE_LIMIT_CACHE = config("RATE_LIMIT_CACHE", cast=str, default="default")
+RATE_LIMIT_TRUSTED_PROXIES = config("RATE_LIMIT_TRUSTED_PROXIES",
+                                    cast=Csv(), default="")
+RATE_LIMITS = {
+    "vote:user": config("VOTE_RATE_LIMIT", cast=str, default="20/60"),
+    "vote:ip": config("VOTE_IP_RATE_LIMIT", cast=str, default="120/60"),
+    "signup:ip": config("SIGNUP_RATE_LIMIT", cast=str, default="5/300"),
+}
+
+# Upper bound, in seconds, on how long the index listing is cached. The
+# local-memory cache is per process, so other workers only see question
+# edits once their copy expires; the index sends no ETag then, so a 304
+# cannot outlive that bound (see POLLS_CONDITIONAL_GET).
+POLLS_INDEX_CACHE_TIMEOUT = config("INDEX_CACHE_TIMEOUT", cast=int,
+                                   default=60)
+# Seconds a shared cache may serve anonymous index and results pages, and
+# how long it may keep serving a stale copy while it revalidates.
+POLLS_INDEX_MAX_AGE = config("INDEX_MAX_AGE", cast=int, default=30)
+POLLS_RESULTS_MAX_AGE = config("RESULTS_MAX_AGE", cast=int, default=5)
+POLLS_STALE_SECONDS = config("STALE_SECONDS", cast=int, default=30)
+# A results snapshot is rebuilt once it is this many seconds old or this
+# many vote changes behind; the lock keeps other workers on the old copy.
+POLLS_RESULTS_SNAPSHOT_SECONDS = config("RESULTS_SNAPSHOT_SECONDS",
+                                        cast=float, default=2)
+POLLS_RESULTS_SNAPSHOT_VOTES = config("RESULTS_SNAPSHOT_VOTES", cast=int,
+                                      default=20)
+POLLS_RESULTS_SNAPSHOT_LOCK_SECONDS = 5
+# Questions per page of the keyset-paginated index.
+POLLS_INDEX_PAGE_SIZE = config("INDEX_PAGE_SIZE", cast=int, default=10)
+
+# Seconds between keep-alive comments on the live results stream.
+POLLS_LIVE_KEEPALIVE_SECONDS = config("LIVE_KEEPALIVE_SECONDS", cast=int,
+                                      default=15)
+# Seconds before a live results stream ends and the browser reconnects,
+# which is also how long a stream may outlive a closed tab.
+POLLS_LIVE_STREAM_SECONDS = config("LIVE_STREAM_SECONDS", cast=int,
+                                   default=300)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -109,6 +287,53 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing
+# https://docs.djangoproject.com/en/4.1/topics/auth/passwords/
+# PASSWORD_HASHER_PROFILE=scrypt or argon2 (needs argon2-cffi) stores new
+# passwords with that hasher; older hashes are upgraded on login.
+
+DJANGO_PASSWORD_HASHERS = [
+    "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+
+PASSWORD_HASHER_PROFILE = config("PASSWORD_HASHER_PROFILE", cast=str,
+                                 default="default")
+
+if PASSWORD_HASHER_PROFILE == "scrypt":
+    PASSWORD_HASHERS = ["mysite.passwords.TunedScryptPasswordHasher"] + [
+        hasher for hasher in DJANGO_PASSWORD_HASHERS
+        if not hasher.endswith(".ScryptPasswordHasher")]
+elif PASSWORD_HASHER_PROFILE == "argon2":
+    PASSWORD_HASHERS = ["mysite.passwords.TunedArgon2PasswordHasher"] + [
+        hasher for hasher in DJANGO_PASSWORD_HASHERS
+        if not hasher.endswith(".Argon2PasswordHasher")]
+else:
+    PASSWORD_HASHERS = DJANGO_PASSWORD_HASHERS
+
+PASSWORD_HASHER_PARAMS = {
+    "SCRYPT_WORK_FACTOR": config("SCRYPT_WORK_FACTOR", cast=int,
+                                 default=2 ** 14),
+    "ARGON2_TIME_COST": config("ARGON2_TIME_COST", cast=int, default=2),
+    "ARGON2_MEMORY_COST": config("ARGON2_MEMORY_COST", cast=int,
+                                 default=102400),
+}
+
+# Password verification: "inline" hashes on the request worker, "pool"
+# hashes in WORKERS processes with at most MAX_PENDING logins in flight;
+# a login waiting longer than TIMEOUT_MS fails.
+PASSWORD_VERIFICATION = {
+    "MODE": config("PASSWORD_VERIFICATION_MODE", cast=str,
+                   default="inline"),
+    "WORKERS": config("PASSWORD_WORKERS", cast=int, default=0) or None,
+    "MAX_PENDING": config("PASSWORD_MAX_PENDING", cast=int, default=64),
+    "TIMEOUT_MS": config("PASSWORD_TIMEOUT_MS", cast=int, default=10000),
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.1/topics/i18n/
 
@@ -133,9 +358,22 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # username/password authentication
 AUTHENTICATION_BACKENDS = [
-   'django.contrib.auth.backends.ModelBackend',
+   'mysite.backends.OffloadedModelBackend',
 ]
 
 LOGIN_REDIRECT_URL = '/polls/'
 
 LOGOUT_REDIRECT_URL = '/accounts/login/'
+
+# Vote ingestion: "sync" writes each vote inside its request, "buffered"
+# queues votes and writes them in batches from a background thread.
+# WAIT_FOR_FLUSH makes a buffered vote wait until its batch is committed.
+POLLS_VOTE_INGESTION = {
+    'MODE': config("VOTE_INGESTION_MODE", cast=str, default="sync"),
+    'FLUSH_INTERVAL_MS': config("VOTE_FLUSH_INTERVAL_MS", cast=int,
+                                default=50),
+    'FLUSH_MAX_VOTES': config("VOTE_FLUSH_MAX_VOTES", cast=int, default=500),
+    'WAIT_FOR_FLUSH': config("VOTE_WAIT_FOR_FLUSH", cast=bool, default=True),
+    'FLUSH_TIMEOUT_MS': config("VOTE_FLUSH_TIMEOUT_MS", cast=int,
+                               default=2000),
+}
@@ -0,0 +1,34 @@
+"""SQLite backend that applies tuning PRAGMAs to every new connection.
+
+Select it with ``"ENGINE": "mysite.tuned_sqlite"`` and pass the PRAGMAs as
+``OPTIONS["pragmas"]``; the remaining OPTIONS go to ``sqlite3.connect``
+as usual.
+"""
+from django.db.backends.sqlite3 import base
+
+
+def apply_pragmas(connection, pragmas):
+    """Run ``PRAGMA name = value`` on `connection` for every item."""
+    for name, value in pragmas.items():
+        connection.execute(f'PRAGMA {name} = {value}')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """sqlite3 DatabaseWrapper with per-connection PRAGMAs."""
+
+    def get_connection_params(self):
+        """Keep the PRAGMAs out of the arguments of sqlite3.connect."""
+        params = super().get_connection_params()
+        self.pragmas = params.pop('pragmas', {})
+        return params
+
+    def get_new_connection(self, conn_params):
+        """Open a connection and apply the configured PRAGMAs."""
+        connection = super().get_new_connection(conn_params)
+        apply_pragmas(connection, self.pragmas)
+        return connection
+
+    def enable_constraint_checking(self):
+        """Leave foreign key checks off if the PRAGMAs turn them off."""
+        if str(getattr(self, 'pragmas', {}).get('foreign_keys')) != 'OFF':
+            super().enable_constraint_checking()
@@ -1,25 +1,43 @@
+from django.conf import settings
 from django.shortcuts import render, redirect
-from django.contrib.auth import login, authenticate
+from django.contrib.auth import login
 from django.contrib.auth.forms import UserCreationForm
+from django.contrib.auth.hashers import make_password
+
+from .passwords import HashingUnavailable, offload
+from .ratelimit import rate_limit
 
 
 def index(request):
     return redirect('polls:index')
 
 
+@rate_limit('signup')
 def signup(request):
-    """Register a new user."""
+    """Register a new user and log them in.
+
+    The password is hashed through offload(), like at login, instead of
+    by form.save(). The saved user is logged in directly; authenticating
+    again would hash the new password a second time.
+    """
+    status = 200
     if request.method == 'POST':
         form = UserCreationForm(request.POST)
         if form.is_valid():
-            form.save()
-            username = form.cleaned_data.get('username')
-            raw_passwd = form.cleaned_data.get('password')
-            user = authenticate(username=username, password=raw_passwd)
-            login(request, user)
-        return redirect('polls')
-        # what if form is not valid?
-        # we should display a message in signup.html
+            user = form.instance
+            try:
+                user.password = offload(make_password,
+                                        form.cleaned_data['password1'])
+            except HashingUnavailable:
+                form.add_error(None, "Too many signups in progress, "
+                                     "please try again.")
+                status = 503
+            else:
+                user.save()
+                login(request, user,
+                      backend=settings.AUTHENTICATION_BACKENDS[0])
+                return redirect('polls:index')
     else:
         form = UserCreationForm()
-    return render(request, 'registration/signup.html', {'form': form})
+    return render(request, 'registration/signup.html', {'form': form},
+                  status=status)
@@ -8,6 +8,24 @@ class ChoiceInline(admin.TabularInline):
     extra = 3
 
 
+class StateListFilter(admin.SimpleListFilter):
+    """Filter questions by their voting window, in the database."""
+
+    title = 'state'
+    parameter_name = 'state'
+
+    def lookups(self, request, model_admin):
+        """:return the selectable states."""
+        return [('upcoming', 'Upcoming'), ('open', 'Open'),
+                ('closed', 'Closed')]
+
+    def queryset(self, request, queryset):
+        """:return the questions in the selected state."""
+        if self.value() in ('upcoming', 'open', 'closed'):
+            return getattr(queryset, self.value())()
+        return queryset
+
+
 class QuestionAdmin(admin.ModelAdmin):
     fieldsets = [
         (None,               {'fields': ['question_text']}),
@@ -17,9 +35,31 @@ class QuestionAdmin(admin.ModelAdmin):
     inlines = [ChoiceInline]
     list_display = ('question_text', 'pub_date', 'was_published_recently',
                     'is_published', 'can_vote')
-    list_filter = ['pub_date']
+    list_filter = [StateListFilter, 'pub_date']
     search_fields = ['question_text']
 
+    def get_queryset(self, request):
+        """Compute the state columns in the list query."""
+        return super().get_queryset(request).with_state()
+
+    @admin.display(boolean=True, ordering='recently_published',
+                   description='Published recently?')
+    def was_published_recently(self, obj):
+        """:return whether `obj` was published within the last day."""
+        return obj.recently_published
+
+    @admin.display(boolean=True, ordering='published_now',
+                   description='Published?')
+    def is_published(self, obj):
+        """:return whether `obj` is published."""
+        return obj.published_now
+
+    @admin.display(boolean=True, ordering='open_now',
+                   description='Can vote?')
+    def can_vote(self, obj):
+        """:return whether `obj` accepts votes."""
+        return obj.open_now
+
 
 admin.site.register(Choice)
 admin.site.register(Question, QuestionAdmin)
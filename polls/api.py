@@ -0,0 +1,140 @@
+"""Compact JSON API for listing polls, reading tallies and voting.
+
+Poll responses carry an ETag made of the question's tally version and
+the transition schedule's state, which only live in the cache. A client
+that polls for changes therefore gets its 304 without a database query,
+and a new body once the poll opens or closes. Without a shared cache
+(``POLLS_CONDITIONAL_GET`` off) there is no ETag.
+"""
+import json
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.views.decorators.http import (condition, require_GET,
+                                          require_POST)
+from mysite.ratelimit import retry_after, too_many_requests
+
+from .cache import schedule, tally_version
+from .ingest import VoteFailed, submit_vote
+from .listing import question_page, question_summary
+from .models import Choice, Question
+from .routers import read_from_replica, stick_to_primary
+
+
+def error(message, status):
+    """:return a JSON error response."""
+    return JsonResponse({'error': message}, status=status)
+
+
+def tally_etag(request, pk):
+    """:return the ETag of the tallies and open state of question `pk`.
+
+    That is None unless conditional GETs are on.
+    """
+    if not settings.POLLS_CONDITIONAL_GET:
+        return None
+    return f'{pk}-{tally_version(pk)}-{schedule.state_key()}'
+
+
+def poll_data(question):
+    """:return the question with its choices and tallies as JSON data."""
+    choices = [
+        {'id': pk, 'choice_text': text, 'votes': votes}
+        for pk, text, votes in Choice.objects.filter(question=question)
+        .order_by('pk').values_list('pk', 'choice_text', 'vote_count')
+    ]
+    return {
+        'id': question.id,
+        'question_text': question.question_text,
+        'pub_date': question.pub_date,
+        'end_date': question.end_date,
+        'can_vote': question.can_vote(),
+        'choices': choices,
+        'total_votes': sum(choice['votes'] for choice in choices),
+    }
+
+
+@require_GET
+@read_from_replica
+def poll_list(request):
+    """List published questions, newest first, one keyset page at a time.
+
+    Takes the same ``after``, ``state`` and ``q`` parameters as the index.
+    """
+    try:
+        page, cursor = question_page(after=request.GET.get('after'),
+                                     state=request.GET.get('state'),
+                                     search=request.GET.get('q', '').strip())
+    except ValueError as exc:
+        return error(str(exc), 400)
+    next_url = None
+    if cursor is not None:
+        params = request.GET.copy()
+        params['after'] = cursor
+        next_url = f"{reverse('polls:api_poll_list')}?{params.urlencode()}"
+    return JsonResponse({
+        'questions': [dict(question_summary(question),
+                           url=reverse('polls:api_poll',
+                                       args=(question.id,)))
+                      for question in page],
+        'next': next_url,
+    })
+
+
+@require_GET
+@condition(etag_func=tally_etag)
+def poll_detail(request, pk):
+    """Return a published question with its choices and tallies.
+
+    It reads the primary: a replica may lag behind the version in the
+    ETag. Clients that poll mostly get their 304 before any read.
+    """
+    question = Question.objects.published().filter(pk=pk).first()
+    if question is None:
+        return error("Poll does not exist.", 404)
+    return JsonResponse(poll_data(question))
+
+
+@require_POST
+def poll_vote(request, pk):
+    """Vote for the ``choice`` of a JSON or form body.
+
+    :return the tallies after the vote, or a 202 with the tallies before
+            it when the vote is still waiting in the ingestion buffer
+            (``committed`` false). A vote whose batch was dropped gets a
+            503.
+    """
+    if not request.user.is_authenticated:
+        return error("Authentication required.", 401)
+    wait = retry_after(request, 'vote')
+    if wait:
+        return too_many_requests(wait, error("Too many votes.", 429))
+    question = Question.objects.filter(pk=pk).first()
+    if question is None:
+        return error("Poll does not exist.", 404)
+    if not question.can_vote(timezone.now()):
+        return error("Voting is not allowed.", 403)
+    if request.content_type == 'application/json':
+        try:
+            choice_id = json.loads(request.body).get('choice')
+        except (ValueError, AttributeError):
+            return error("Invalid JSON body.", 400)
+    else:
+        choice_id = request.POST.get('choice')
+    try:
+        choice = question.choice_set.get(pk=choice_id)
+    except (ValueError, TypeError, Choice.DoesNotExist):
+        return error("You didn't select a valid choice.", 400)
+    try:
+        committed = submit_vote(request.user, question, choice)
+    except VoteFailed:
+        return error("The vote could not be recorded.", 503)
+    data = poll_data(question)
+    data['committed'] = committed
+    response = JsonResponse(data, status=200 if committed else 202)
+    etag = tally_etag(request, pk)
+    if etag is not None:
+        response['ETag'] = f'"{etag}"'
+    return stick_to_primary(response)
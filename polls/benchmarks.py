@@ -0,0 +1,388 @@
+"""Seed data, measure the hot poll queries and load-test the views.
+
+These helpers back the benchmark management commands. They write straight
+into whatever database the default connection points at, so the commands
+run them against a throwaway test database.
+"""
+import datetime
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from mysite.tuned_sqlite.base import DatabaseWrapper
+
+from .models import Choice, Question, Vote
+
+BATCH_SIZE = 10000
+
+
+def seed(users=1000, questions=20, choices=4, votes=10000, seed_value=0):
+    """Bulk insert users, questions, choices and votes.
+
+    Each vote belongs to a distinct (user, question) pair, so `votes` may
+    not exceed ``users * questions``. The tallies are filled in from the
+    generated votes.
+
+    :return dict with the number of rows written per model.
+    """
+    if votes > users * questions:
+        raise ValueError("votes must not exceed users * questions.")
+    rng = random.Random(seed_value)
+    now = timezone.now()
+    with transaction.atomic():
+        User.objects.bulk_create(
+            [User(username=f'bench{i}', password='!') for i in range(users)],
+            batch_size=BATCH_SIZE)
+        user_ids = list(User.objects.filter(username__startswith='bench')
+                        .order_by('pk').values_list('pk', flat=True))
+        Question.objects.bulk_create(
+            [Question(question_text=f'Benchmark question {i}',
+                      pub_date=now - datetime.timedelta(hours=i),
+                      end_date=now + datetime.timedelta(days=30))
+             for i in range(questions)],
+            batch_size=BATCH_SIZE)
+        question_ids = list(Question.objects.filter(
+            question_text__startswith='Benchmark question'
+        ).order_by('pk').values_list('pk', flat=True))
+        Choice.objects.bulk_create(
+            [Choice(question_id=question_id, choice_text=f'Choice {i}')
+             for question_id in question_ids for i in range(choices)],
+            batch_size=BATCH_SIZE)
+        choice_ids = {}
+        for question_id, choice_id in Choice.objects.filter(
+                question_id__in=question_ids
+        ).values_list('question_id', 'pk'):
+            choice_ids.setdefault(question_id, []).append(choice_id)
+        tallies = dict.fromkeys(
+            (pk for ids in choice_ids.values() for pk in ids), 0)
+        pairs = ((user_id, question_id) for question_id in question_ids
+                 for user_id in user_ids)
+        batch = []
+        for user_id, question_id in pairs:
+            if votes <= 0:
+                break
+            votes -= 1
+            choice_id = rng.choice(choice_ids[question_id])
+            tallies[choice_id] += 1
+            batch.append(Vote(user_id=user_id, question_id=question_id,
+                              choice_id=choice_id, voted_at=now))
+            if len(batch) == BATCH_SIZE:
+                Vote.objects.bulk_create(batch)
+                batch = []
+        Vote.objects.bulk_create(batch)
+        Choice.objects.bulk_update(
+            [Choice(pk=pk, vote_count=count) for pk, count in tallies.items()],
+            ['vote_count'], batch_size=BATCH_SIZE)
+    return {
+        'users': len(user_ids),
+        'questions': len(question_ids),
+        'choices': len(tallies),
+        'votes': sum(tallies.values()),
+    }
+
+
+def hot_queries(rng):
+    """:return dict of name -> function building one hot query."""
+    user_ids = list(User.objects.values_list('pk', flat=True))
+    question_ids = list(Question.objects.values_list('pk', flat=True))
+    choice_ids = list(Choice.objects.values_list('pk', flat=True))
+    return {
+        'vote by user and question': lambda: Vote.objects.filter(
+            user_id=rng.choice(user_ids),
+            question_id=rng.choice(question_ids),
+        ).values('choice_id'),
+        'votes of one choice': lambda: Vote.objects.filter(
+            choice_id=rng.choice(choice_ids)
+        ).values('choice_id').annotate(votes=Count('id')),
+        'votes per choice of a question': lambda: Vote.objects.filter(
+            question_id=rng.choice(question_ids)
+        ).values('choice_id').annotate(votes=Count('id')),
+        'latest published questions': lambda: Question.objects.filter(
+            pub_date__lte=timezone.now()
+        ).order_by('-pub_date')[:5],
+    }
+
+
+def measure(queries, repeat=50):
+    """Time each query and capture its plan.
+
+    :return dict of name -> {'plan': str, 'mean_ms': float}.
+    """
+    report = {}
+    for name, build in queries.items():
+        plan = build().explain()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            list(build())
+        elapsed = time.perf_counter() - started
+        report[name] = {'plan': plan,
+                        'mean_ms': round(elapsed * 1000 / repeat, 3)}
+    return report
+
+
+def compare_indexes(repeat=50, seed_value=0,
+                    baseline='0005_choice_vote_count'):
+    """Measure the hot queries on the `baseline` schema and on the latest.
+
+    The baseline migration predates the unique (user, question) constraint
+    and the tuned indexes, so only the default foreign key indexes exist.
+
+    :return dict with 'before' and 'after' reports from measure().
+    """
+    queries = hot_queries(random.Random(seed_value))
+    call_command('migrate', 'polls', baseline, verbosity=0)
+    try:
+        before = measure(queries, repeat)
+    finally:
+        call_command('migrate', 'polls', verbosity=0)
+    return {'before': before, 'after': measure(queries, repeat)}
+
+
+def percentile(values, fraction):
+    """:return the nearest-rank percentile of sorted `values`."""
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1, round(fraction * len(values)) - 1))
+    return values[rank]
+
+
+def scenario_requests(name, questions, rng):
+    """:return a function sending one `name` request with a client."""
+    def index(client):
+        return client.get(reverse('polls:index'))
+
+    def detail(client):
+        question_id = rng.choice(list(questions))
+        return client.get(reverse('polls:detail', args=(question_id,)))
+
+    def vote(client):
+        question_id = rng.choice(list(questions))
+        return client.post(reverse('polls:vote', args=(question_id,)),
+                           {'choice': rng.choice(questions[question_id])})
+
+    def results(client):
+        question_id = rng.choice(list(questions))
+        return client.get(reverse('polls:results', args=(question_id,)))
+
+    return {'index': index, 'detail': detail, 'vote': vote,
+            'results': results}[name]
+
+
+def drive(name, requests=200, concurrency=4, seed_value=0):
+    """Send `requests` requests of scenario `name` from parallel clients.
+
+    Every worker logs in as its own user and measures each request's
+    latency and query count on its own database connection. Rate limits
+    are off for the run.
+
+    :return dict with throughput, latency percentiles and queries.
+    """
+    questions = {}
+    for question_id, choice_id in Choice.objects.filter(
+            question__pub_date__lte=timezone.now()
+    ).values_list('question_id', 'pk'):
+        questions.setdefault(question_id, []).append(choice_id)
+    users = list(User.objects.order_by('pk')[:concurrency])
+    latencies = []
+    queries = []
+    errors = []
+    lock = threading.Lock()
+
+    def work(worker):
+        rng = random.Random(seed_value + worker)
+        send = scenario_requests(name, questions, rng)
+        client = Client()
+        share = requests // concurrency + (worker < requests % concurrency)
+        try:
+            client.force_login(users[worker % len(users)])
+            for _ in range(share):
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = send(client)
+                    elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+                    queries.append(len(captured))
+                    if response.status_code >= 400:
+                        errors.append(response.status_code)
+        except Exception as error:
+            with lock:
+                errors.append(repr(error))
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=work, args=(worker,))
+               for worker in range(concurrency)]
+    # Measure the views themselves: a few clients voting flat out would
+    # only measure the rate limits. The votes stay in the test database.
+    with override_settings(RATE_LIMITS={}, POLLS_VOTE_SHARDS=0):
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        wall_time = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'concurrency': concurrency,
+        'errors': len(errors),
+        'throughput_rps': round(len(latencies) / wall_time, 1),
+        'latency_ms': {
+            label: round(percentile(latencies, fraction) * 1000, 3)
+            for label, fraction in (('p50', .5), ('p90', .9),
+                                    ('p99', .99), ('max', 1))
+        } if latencies else {},
+        'queries_per_request': (round(sum(queries) / len(queries), 2)
+                                if queries else None),
+    }
+
+
+def sqlite_vote_throughput(path, pragmas, writers=4, votes=200, readers=2):
+    """Measure concurrent vote transactions on a fresh SQLite file.
+
+    Every connection is opened by the ``mysite.tuned_sqlite`` backend with
+    `pragmas`. Each writer runs `votes` transactions with the statements
+    of record_vote(), the two conditional tally UPDATEs and the vote
+    upsert, while `readers` threads keep reading the tallies.
+
+    :return dict with the committed 'votes', 'votes_per_second' over the
+            commits and the number of 'errors'.
+    """
+    settings_dict = dict(connection.settings_dict,
+                         ENGINE='mysite.tuned_sqlite', NAME=path,
+                         OPTIONS={'timeout': 5, 'pragmas': pragmas})
+    setup = sqlite3.connect(path, isolation_level=None)
+    setup.executescript("""
+        CREATE TABLE tally (id INTEGER PRIMARY KEY, votes INTEGER);
+        INSERT INTO tally VALUES (1, 0), (2, 0);
+        CREATE TABLE vote (user INTEGER, question INTEGER, choice INTEGER,
+                           UNIQUE (user, question));
+    """)
+    setup.close()
+    committed = []
+    errors = []
+    stop = threading.Event()
+
+    def connect():
+        wrapper = DatabaseWrapper(settings_dict, alias='benchmark')
+        wrapper.ensure_connection()
+        return wrapper
+
+    def write(writer):
+        wrapper = connect()
+        conn = wrapper.connection
+        for i in range(votes):
+            user, choice = writer * votes + i, i % 2 + 1
+            try:
+                conn.execute('BEGIN')
+                conn.execute('UPDATE tally SET votes = votes - 1 '
+                             'WHERE id = (SELECT choice FROM vote WHERE '
+                             'user = ? AND question = 1) AND id != ?',
+                             (user, choice))
+                conn.execute('UPDATE tally SET votes = votes + 1 '
+                             'WHERE id = ? AND NOT EXISTS (SELECT 1 FROM '
+                             'vote WHERE user = ? AND question = 1 '
+                             'AND choice = ?)', (choice, user, choice))
+                conn.execute('INSERT INTO vote VALUES (?, 1, ?) '
+                             'ON CONFLICT (user, question) '
+                             'DO UPDATE SET choice = excluded.choice',
+                             (user, choice))
+                conn.execute('COMMIT')
+                committed.append(user)
+            except sqlite3.OperationalError as error:
+                errors.append(error)
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+        wrapper.close()
+
+    def read():
+        wrapper = connect()
+        while not stop.is_set():
+            wrapper.connection.execute(
+                'SELECT SUM(votes) FROM tally').fetchall()
+            wrapper.connection.execute(
+                'SELECT COUNT(*) FROM vote').fetchall()
+        wrapper.close()
+
+    background = [threading.Thread(target=read) for _ in range(readers)]
+    for thread in background:
+        thread.start()
+    threads = [threading.Thread(target=write, args=(writer,))
+               for writer in range(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for thread in background:
+        thread.join()
+    return {'votes': len(committed),
+            'votes_per_second': round(len(committed) / elapsed, 1),
+            'errors': len(errors)}
+
+
+def login_throughput(logins=100, concurrency=4, mode='inline'):
+    """Authenticate one user `logins` times from parallel threads.
+
+    The password is hashed with the configured hasher profile and
+    verified as PASSWORD_VERIFICATION `mode` ('inline' or 'pool') says.
+
+    :return dict with logins per second, overall and per CPU core.
+    """
+    password = 'bench-login-password'
+    user, _ = User.objects.get_or_create(username='benchlogin')
+    user.set_password(password)
+    user.save()
+    failures = []
+    lock = threading.Lock()
+
+    def work(worker):
+        share = logins // concurrency + (worker < logins % concurrency)
+        try:
+            for _ in range(share):
+                if authenticate(username='benchlogin',
+                                password=password) is None:
+                    with lock:
+                        failures.append(worker)
+        finally:
+            connection.close()
+
+    options = {**settings.PASSWORD_VERIFICATION, 'MODE': mode}
+    with override_settings(PASSWORD_VERIFICATION=options):
+        # One untimed login starts the pool processes.
+        authenticate(username='benchlogin', password=password)
+        threads = [threading.Thread(target=work, args=(worker,))
+                   for worker in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    cores = os.cpu_count() or 1
+    return {
+        'mode': mode,
+        'hasher': settings.PASSWORD_HASHERS[0].rsplit('.', 1)[1],
+        'logins': logins,
+        'concurrency': concurrency,
+        'failures': len(failures),
+        'cores': cores,
+        'logins_per_second': round(logins / elapsed, 1),
+        'logins_per_second_per_core': round(logins / elapsed / cores, 1),
+    }
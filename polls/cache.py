@@ -0,0 +1,167 @@
+"""Cached poll listings keyed on a question-set version.
+
+Every Question save or delete bumps the question-set version, which makes
+all cached listings unreachable at once. The in-process ``schedule`` also
+knows the next moment any question opens or closes; its ``state_key()``
+changes at that moment, so listings keyed on it turn over exactly on time
+without querying the database on every request.
+
+The choices of each question are cached separately and dropped whenever
+one of them is saved or deleted. Each question also has a tally version,
+the time in nanoseconds of the latest change to its votes, choices or
+text, for conditional GETs.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Choice, Question
+
+QUESTION_SET_VERSION_KEY = 'polls:question-set-version'
+
+
+def tally_key(question_id):
+    """:return the cache key of the tally version of a question."""
+    return f'polls:tallies:{question_id}'
+
+
+def choices_key(question_id):
+    """:return the cache key of the choice list of a question."""
+    return f'polls:choices:{question_id}'
+
+
+def question_set_version():
+    """:return the current question-set version."""
+    version = cache.get(QUESTION_SET_VERSION_KEY)
+    if version is None:
+        # Start from the clock so a version lost by eviction is never reused.
+        cache.add(QUESTION_SET_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(QUESTION_SET_VERSION_KEY)
+    return version
+
+
+def bump_question_set_version():
+    """Invalidate every listing built from the current question set."""
+    try:
+        cache.incr(QUESTION_SET_VERSION_KEY)
+    except ValueError:
+        cache.set(QUESTION_SET_VERSION_KEY, time.time_ns(), None)
+
+
+def tally_version(question_id):
+    """:return the tally version of a question.
+
+    The version is the time in nanoseconds of the last tally change seen,
+    or of the first request after the version was lost from the cache.
+    """
+    key = tally_key(question_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_tally_versions(question_ids):
+    """Mark the tallies of the given questions as changed now."""
+    now = time.time_ns()
+    cache.set_many({tally_key(pk): now for pk in question_ids}, None)
+
+
+def add_urls(questions):
+    """Attach the detail and results URLs to each of `questions`."""
+    for question in questions:
+        question.detail_url = reverse('polls:detail', args=(question.id,))
+        question.results_url = reverse('polls:results', args=(question.id,))
+    return questions
+
+
+class TransitionSchedule:
+    """Precomputed time of the next open or close of any question."""
+
+    def __init__(self):
+        """Initialize a schedule that has not looked at the questions."""
+        self._lock = threading.Lock()
+        self._version = None
+        self._next = None
+
+    def _refresh(self, now):
+        """:return the question-set version and its next transition.
+
+        The transition is recomputed only once it has passed or after a
+        Question save or delete has bumped the question-set version. It
+        is read from the primary, which already has that save.
+        """
+        version = question_set_version()
+        with self._lock:
+            if (version != self._version
+                    or (self._next is not None and now >= self._next)):
+                self._next = (Question.objects.using('default')
+                              .next_transition(now))
+                self._version = version
+            return self._version, self._next
+
+    def next_transition(self, now=None):
+        """:return the next moment any question opens or closes, or None."""
+        return self._refresh(now or timezone.now())[1]
+
+    def state_key(self, now=None):
+        """:return a cache key part that changes at every transition."""
+        version, upcoming = self._refresh(now or timezone.now())
+        return f"{version}:{upcoming.timestamp() if upcoming else 'never'}"
+
+    def timeout(self, limit, now=None):
+        """:return `limit` seconds, cut short at the next transition."""
+        now = now or timezone.now()
+        upcoming = self.next_transition(now)
+        if upcoming is None:
+            return limit
+        return min(limit, int((upcoming - now).total_seconds()) + 1)
+
+
+schedule = TransitionSchedule()
+
+
+def latest_questions(limit=5):
+    """:return the last `limit` published questions, from cache if valid.
+
+    The listing is read from the primary: its key holds the version of
+    the primary, which a lagging replica may not have caught up with.
+    """
+    now = timezone.now()
+    key = f'polls:index:{schedule.state_key(now)}:{limit}'
+    questions = cache.get(key)
+    if questions is not None:
+        return questions
+    questions = add_urls(list(Question.objects.using('default')
+                              .published(now)
+                              .order_by('-pub_date', '-id')[:limit]))
+    cache.set(key, questions,
+              schedule.timeout(settings.POLLS_INDEX_CACHE_TIMEOUT, now))
+    return questions
+
+
+def question_choices(question_id):
+    """:return the id and text of each choice of a question, from cache.
+
+    Only the fields that never change with voting are cached, so the
+    list stays valid until a choice itself is saved or deleted. It is
+    read from the primary, as a lagging replica would be cached for good.
+    """
+    key = choices_key(question_id)
+    choices = cache.get(key)
+    if choices is None:
+        choices = list(Choice.objects.using('default')
+                       .filter(question_id=question_id)
+                       .order_by('pk').values('id', 'choice_text'))
+        cache.set(key, choices, None)
+    return choices
+
+
+def forget_choices(question_ids):
+    """Drop the cached choice lists of the given questions."""
+    cache.delete_many([choices_key(pk) for pk in question_ids])
@@ -0,0 +1,163 @@
+"""Stream poll results and raw votes as CSV or JSON Lines.
+
+Rows are read with ``values_list`` and ``.iterator()``, so only one chunk
+of plain tuples is in memory at a time and no model instances are built.
+Each row is encoded as soon as it is read, which lets the export endpoint
+and ``export_votes`` write millions of votes with flat memory use. Under
+ASGI the endpoint streams through ``async_chunks``, since an ASGI server
+would otherwise drain a plain iterator into memory before sending it.
+"""
+import csv
+import datetime
+import itertools
+import json
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Choice, Vote
+from .shards import archived_question_ids, archived_vote_rows, vote_aliases
+
+CHUNK_SIZE = 2000
+KINDS = ('results', 'votes')
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/jsonl'}
+
+VOTE_COLUMNS = ('id', 'question_id', 'choice_id', 'user_id', 'voted_at')
+RESULT_COLUMNS = ('question_id', 'choice_id', 'choice_text', 'votes')
+
+
+def parse_moment(value, end=False):
+    """:return the ISO date or datetime `value` as an aware datetime.
+
+    A bare date means the start of that day, or the start of the next
+    day when `end` is set, so ``until=2022-09-01`` includes the whole day.
+    """
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"{value!r} is not an ISO date or datetime.")
+        if end:
+            day += datetime.timedelta(days=1)
+        moment = datetime.datetime.combine(day, datetime.time())
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def filtered_votes(questions=None, choices=None, since=None, until=None,
+                   using=None):
+    """:return the votes matching the given filters.
+
+    `since` is inclusive and `until` exclusive; both apply to the time of
+    the latest vote.
+    """
+    votes = Vote.objects.using(using) if using else Vote.objects.all()
+    if questions:
+        votes = votes.filter(question_id__in=questions)
+    if choices:
+        votes = votes.filter(choice_id__in=choices)
+    if since is not None:
+        votes = votes.filter(voted_at__gte=since)
+    if until is not None:
+        votes = votes.filter(voted_at__lt=until)
+    return votes
+
+
+def vote_rows(questions=None, choices=None, since=None, until=None,
+              using=None):
+    """Yield one tuple of ``VOTE_COLUMNS`` per matching vote.
+
+    The live votes come first, shard by shard, then the archived ones.
+    """
+    for alias in vote_aliases(using or 'default'):
+        votes = filtered_votes(questions, choices, since, until, alias)
+        yield from (votes.order_by('pk').values_list(*VOTE_COLUMNS)
+                    .iterator(chunk_size=CHUNK_SIZE))
+    for question_id in sorted(archived_question_ids(questions or None)):
+        yield from archived_vote_rows(question_id, choices, since, until)
+
+
+def result_rows(questions=None, choices=None, since=None, until=None,
+                using=None):
+    """Yield one tuple of ``RESULT_COLUMNS`` per matching choice.
+
+    Without a date range the stored tallies are used; with one, the
+    matching votes are counted.
+    """
+    rows = Choice.objects.using(using) if using else Choice.objects.all()
+    if questions:
+        rows = rows.filter(question_id__in=questions)
+    if choices:
+        rows = rows.filter(pk__in=choices)
+    rows = rows.order_by('question_id', 'pk')
+    if since is None and until is None:
+        yield from rows.values_list('question_id', 'pk', 'choice_text',
+                                    'vote_count').iterator(CHUNK_SIZE)
+        return
+    counts = Counter()
+    for alias in vote_aliases(using or 'default'):
+        counts.update(dict(
+            filtered_votes(questions, choices, since, until, alias)
+            .values('choice_id').annotate(votes=Count('id'))
+            .values_list('choice_id', 'votes').order_by()))
+    for question_id in archived_question_ids(questions or None):
+        counts.update(row[2] for row in archived_vote_rows(
+            question_id, choices, since, until))
+    for question_id, choice_id, text in rows.values_list(
+            'question_id', 'pk', 'choice_text').iterator(CHUNK_SIZE):
+        yield question_id, choice_id, text, counts.get(choice_id, 0)
+
+
+class Echo:
+    """File-like object whose write() returns what was written."""
+
+    def write(self, value):
+        """:return `value` unchanged."""
+        return value
+
+
+def encode(rows, columns, output_format):
+    """Yield `rows` as CSV lines or JSON Lines, header first for CSV."""
+    if output_format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(columns)
+        for row in rows:
+            yield writer.writerow(
+                value.isoformat() if isinstance(value, datetime.datetime)
+                else value for value in row)
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(columns, row)),
+                             cls=DjangoJSONEncoder) + '\n'
+
+
+def export(kind, output_format, **filters):
+    """:return an iterator of encoded `kind` rows in `output_format`."""
+    if output_format not in FORMATS:
+        raise ValueError(f"Unknown format {output_format!r}.")
+    if kind == 'votes':
+        return encode(vote_rows(**filters), VOTE_COLUMNS, output_format)
+    if kind == 'results':
+        return encode(result_rows(**filters), RESULT_COLUMNS, output_format)
+    raise ValueError(f"Unknown export {kind!r}.")
+
+
+async def async_chunks(chunks, size=CHUNK_SIZE):
+    """Yield the encoded `chunks` joined `size` at a time.
+
+    The chunks, and the queries behind them, are read in the sync thread.
+    """
+    take = sync_to_async(lambda: ''.join(itertools.islice(chunks, size)))
+    while True:
+        data = await take()
+        if not data:
+            return
+        yield data
@@ -0,0 +1,62 @@
+"""HTTP cache policy of the poll pages.
+
+Responses to clients without a session are public: a shared cache may
+serve them for a few seconds and then keep serving the stale copy while
+it revalidates. Clients with a session, such as logged-in users, get
+private responses that are revalidated on every request, so a voter
+sees their vote as soon as it is committed. Either way the ETag comes
+from versions kept in the cache, so an unchanged page is answered with a
+304 before the view runs.
+"""
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+
+def cache_policy(etag_func, max_age, per_user=False):
+    """Decorate a view with an ETag and the shared or private policy.
+
+    :param etag_func: called like the view; returns the version of the
+                      page that changes whenever its content does, or
+                      None to let the view run without an ETag.
+    :param max_age: seconds a shared cache may serve an anonymous copy,
+                    or a function of the request returning them.
+    :param per_user: the page shows the user and their messages, so the
+                     ETag names the viewer and pending messages skip it.
+    """
+    def etag(request, *args, **kwargs):
+        if per_user and get_messages(request):
+            return None
+        version = etag_func(request, *args, **kwargs)
+        if version is None:
+            return None
+        if not per_user:
+            return str(version)
+        viewer = request.user.pk if request.user.is_authenticated else 0
+        return f'{version}-{viewer}'
+
+    def decorator(view):
+        conditional = condition(etag_func=etag)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional(request, *args, **kwargs)
+            if response.status_code not in (200, 304):
+                return response
+            # A session cookie is enough to go private, without loading
+            # the session or the user for pages that do not show them.
+            if (settings.SESSION_COOKIE_NAME in request.COOKIES
+                    or response.cookies):
+                patch_cache_control(response, private=True, no_cache=True)
+            else:
+                seconds = max_age(request) if callable(max_age) else max_age
+                patch_cache_control(
+                    response, public=True, max_age=seconds,
+                    stale_while_revalidate=settings.POLLS_STALE_SECONDS)
+            patch_vary_headers(response, ['Cookie'])
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,169 @@
+"""Streaming bulk import of users, questions, choices and votes.
+
+Reads Django fixture exports (a JSON array, like data/polls.json) or JSON
+Lines with one fixture object per line. The file is decoded one chunk at
+a time and the rows are written with ``bulk_create`` in batches, one
+transaction per batch, so memory use depends on the batch size and not on
+the size of the file. ``bulk_create`` sends no model signals; the caches,
+tallies and rollups those signals and ``vote()`` would maintain are
+brought up to date here instead.
+"""
+import json
+import time
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from .cache import bump_question_set_version, forget_choices
+from .models import Choice, Question, Vote
+from .shards import by_shard, shard_atomic
+from .tallies import add_rollup_counts, minute_bucket, rebuild_tallies
+
+# Models in the order their batches are written, parents first.
+IMPORT_MODELS = {
+    'auth.user': User,
+    'polls.question': Question,
+    'polls.choice': Choice,
+    'polls.vote': Vote,
+}
+
+READ_SIZE = 1 << 16
+
+
+def iter_records(stream, read_size=READ_SIZE):
+    """Yield the objects of a JSON array or JSON Lines text `stream`.
+
+    Only the current chunk and one partially read object are held in
+    memory at a time.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    finished = False
+    while not finished:
+        chunk = stream.read(read_size)
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == len(buffer):
+                break
+            if not started and buffer[position] == '[':
+                position += 1
+                started = True
+                continue
+            if buffer[position] == ']':
+                finished = True
+                break
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise
+                break
+            started = True
+            position = end
+            yield record
+        if not chunk:
+            finished = True
+
+
+def build_instance(record):
+    """:return an unsaved model instance built from a fixture `record`."""
+    try:
+        model = IMPORT_MODELS[record['model'].lower()]
+    except KeyError:
+        raise ValueError(f"Cannot import model {record.get('model')!r}.")
+    values = {}
+    if 'pk' in record:
+        values[model._meta.pk.attname] = record['pk']
+    for name, value in record.get('fields', {}).items():
+        field = model._meta.get_field(name)
+        if field.many_to_many:
+            continue
+        if field.is_relation:
+            values[field.attname] = value
+        else:
+            values[field.attname] = field.to_python(value)
+    return model(**values)
+
+
+class Importer:
+    """Accumulate instances and write them batch by batch."""
+
+    def __init__(self, batch_size=5000):
+        """Initialize an importer that commits every `batch_size` rows."""
+        self.batch_size = batch_size
+        self.pending = {model: [] for model in IMPORT_MODELS.values()}
+        self.queued = 0
+        self.written = Counter()
+        self.questions = set()
+        self.started = time.perf_counter()
+
+    def add(self, instance):
+        """Queue one instance, writing the batch once it is full."""
+        if isinstance(instance, (Choice, Vote)):
+            self.questions.add(instance.question_id)
+        self.pending[type(instance)].append(instance)
+        self.queued += 1
+        if self.queued >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write every queued instance in one transaction."""
+        rollups = Counter()
+        for vote in self.pending[Vote]:
+            rollups[(vote.question_id, vote.choice_id,
+                     minute_bucket(vote.voted_at))] += 1
+        votes = by_shard(self.pending.pop(Vote),
+                         lambda vote: vote.question_id)
+        with transaction.atomic(), shard_atomic(votes):
+            for model, instances in self.pending.items():
+                if instances:
+                    model.objects.bulk_create(instances)
+                    self.written[model._meta.label] += len(instances)
+            for alias, instances in votes.items():
+                Vote.objects.using(alias).bulk_create(instances)
+                self.written[Vote._meta.label] += len(instances)
+            add_rollup_counts(rollups)
+        self.pending = {model: [] for model in IMPORT_MODELS.values()}
+        self.queued = 0
+
+    def finish(self):
+        """Write the last batch and refresh everything derived from it.
+
+        :return dict with the rows written per model, the elapsed seconds
+                and the rows written per second.
+        """
+        self.flush()
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), list(IMPORT_MODELS.values()))
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+        if self.questions:
+            rebuild_tallies(self.questions)
+            forget_choices(self.questions)
+        bump_question_set_version()
+        elapsed = time.perf_counter() - self.started
+        total = sum(self.written.values())
+        return {
+            'rows': dict(self.written),
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(total / elapsed, 1) if elapsed else None,
+        }
+
+
+def import_stream(stream, batch_size=5000, importer=None):
+    """Import every record of `stream`.
+
+    :return the summary from Importer.finish().
+    """
+    importer = importer or Importer(batch_size)
+    for record in iter_records(stream):
+        importer.add(build_instance(record))
+    return importer.finish()
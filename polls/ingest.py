@@ -0,0 +1,151 @@
+"""Vote ingestion: synchronous or buffered write-behind.
+
+In ``sync`` mode every vote is written inside its own request. In
+``buffered`` mode ``vote()`` only enqueues the vote; a background thread
+keeps the last vote of each (user, question) pair and writes the batch in
+one transaction every ``FLUSH_INTERVAL_MS`` or as soon as
+``FLUSH_MAX_VOTES`` votes are waiting. With ``WAIT_FOR_FLUSH`` the request
+blocks until its batch is committed, so no accepted vote can be lost;
+without it votes still buffered when the process dies are dropped.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+from .tallies import apply_votes, record_vote
+
+logger = logging.getLogger(__name__)
+
+
+class VoteFailed(Exception):
+    """The batch holding a buffered vote could not be written."""
+
+
+class VoteBuffer:
+    """Coalescing in-process vote queue drained by a flusher thread."""
+
+    def __init__(self, flush_interval=0.05, max_votes=500):
+        """Initialize an empty buffer; the thread starts on first use."""
+        self.flush_interval = flush_interval
+        self.max_votes = max_votes
+        self._pending = {}
+        self._batch = 0
+        self._flushed = 0
+        self._failed = set()
+        self._condition = threading.Condition()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stopping = False
+
+    def submit(self, user_id, question_id, choice_id):
+        """Enqueue a vote, replacing any queued vote of the same user.
+
+        :return a ticket to pass to wait().
+        """
+        with self._condition:
+            if self._stopping:
+                raise RuntimeError("The vote buffer has been stopped.")
+            self._pending[(user_id, question_id)] = choice_id
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='vote-flusher', daemon=True)
+                self._thread.start()
+            if len(self._pending) >= self.max_votes:
+                self._wakeup.set()
+            return self._batch
+
+    def wait(self, ticket, timeout=None):
+        """Block until the batch holding `ticket` is committed.
+
+        :return True if it was committed before the timeout.
+        :raise VoteFailed: if the batch was dropped.
+        """
+        with self._condition:
+            done = self._condition.wait_for(
+                lambda: self._flushed > ticket, timeout)
+            if ticket in self._failed:
+                raise VoteFailed("The vote could not be recorded.")
+            return done
+
+    def flush(self):
+        """Write every queued vote now.
+
+        :return the number of vote rows that were inserted or moved.
+        """
+        with self._condition:
+            votes, self._pending = self._pending, {}
+            batch = self._batch
+            self._batch += 1
+        try:
+            return apply_votes(votes)
+        except Exception:
+            logger.exception("Dropped a batch of %d votes.", len(votes))
+            with self._condition:
+                self._failed.add(batch)
+            return 0
+        finally:
+            with self._condition:
+                self._flushed = max(self._flushed, batch + 1)
+                self._condition.notify_all()
+
+    def stop(self):
+        """Stop accepting votes and drain the queue."""
+        with self._condition:
+            self._stopping = True
+            thread = self._thread
+        self._wakeup.set()
+        if thread is not None:
+            thread.join()
+        else:
+            self.flush()
+
+    def _run(self):
+        """Flush on every interval or when woken by a full queue."""
+        try:
+            while True:
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                self.flush()
+                with self._condition:
+                    if self._stopping and not self._pending:
+                        return
+        finally:
+            connection.close()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_vote_buffer():
+    """:return the process-wide vote buffer, created from the settings."""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            options = settings.POLLS_VOTE_INGESTION
+            _buffer = VoteBuffer(
+                flush_interval=options['FLUSH_INTERVAL_MS'] / 1000,
+                max_votes=options['FLUSH_MAX_VOTES'])
+            atexit.register(_buffer.stop)
+        return _buffer
+
+
+def submit_vote(user, question, choice):
+    """Record a vote using the configured ingestion mode.
+
+    :return True if the vote is committed when this returns, False if it
+            is still waiting in the buffer.
+    :raise VoteFailed: if its buffered batch was dropped.
+    """
+    options = settings.POLLS_VOTE_INGESTION
+    if options['MODE'] != 'buffered':
+        record_vote(user, question, choice)
+        return True
+    vote_buffer = get_vote_buffer()
+    ticket = vote_buffer.submit(user.id, question.id, choice.id)
+    if options['WAIT_FOR_FLUSH']:
+        return vote_buffer.wait(ticket, options['FLUSH_TIMEOUT_MS'] / 1000)
+    return False
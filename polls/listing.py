@@ -0,0 +1,84 @@
+"""Keyset pagination of the published questions, newest first.
+
+A page is addressed by an opaque cursor holding the (pub_date, id) of
+the last question already shown. The next page is read with a range
+condition on the ``polls_question_pub_date_id`` index instead of an
+OFFSET, so page 1,000 costs the same as page 1. Only the unfiltered
+first page is cached.
+"""
+import base64
+import binascii
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .cache import add_urls, latest_questions
+from .models import Question
+
+STATES = ('open', 'closed')
+
+
+def encode_cursor(question):
+    """:return the cursor of the page that follows `question`."""
+    raw = f'{question.pub_date.isoformat()}|{question.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """:return the (pub_date, id) held by `cursor`.
+
+    :raise ValueError: if `cursor` was not made by encode_cursor().
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        stamp, pk = raw.decode().split('|')
+        pub_date, pk = parse_datetime(stamp), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid page cursor.")
+    if pub_date is None:
+        raise ValueError("Invalid page cursor.")
+    return pub_date, pk
+
+
+def question_summary(question):
+    """:return the JSON-ready fields of a listed question."""
+    return {
+        'id': question.id,
+        'question_text': question.question_text,
+        'pub_date': question.pub_date,
+        'end_date': question.end_date,
+        'detail_url': question.detail_url,
+        'results_url': question.results_url,
+    }
+
+
+def question_page(after=None, state=None, search=None, size=None):
+    """:return one page of published questions and the next cursor.
+
+    :param after: cursor of the previous page, or None for the first.
+    :param state: 'open' or 'closed' to only list those questions.
+    :param search: text the question must contain.
+    :raise ValueError: for an unknown state or a malformed cursor.
+    """
+    size = size or settings.POLLS_INDEX_PAGE_SIZE
+    if state and state not in STATES:
+        raise ValueError(f"state must be one of {', '.join(STATES)}.")
+    if not (after or state or search):
+        questions = latest_questions(size + 1)
+    else:
+        now = timezone.now()
+        questions = Question.objects.published(now)
+        if state:
+            questions = getattr(questions, state)(now)
+        if search:
+            questions = questions.filter(question_text__icontains=search)
+        if after:
+            pub_date, pk = decode_cursor(after)
+            questions = (questions.filter(pub_date__lte=pub_date)
+                         .exclude(pub_date=pub_date, id__gte=pk))
+        questions = add_urls(list(questions.order_by('-pub_date', '-id')
+                                  [:size + 1]))
+    page = questions[:size]
+    cursor = encode_cursor(page[-1]) if len(questions) > size else None
+    return page, cursor
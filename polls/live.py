@@ -0,0 +1,120 @@
+"""Live tally updates for the streaming results endpoint.
+
+A single in-process ``TallyPublisher`` is told about every committed vote.
+It reads the question's tallies once and hands the same snapshot to every
+subscriber, so N watchers cost one aggregation per change. Each
+subscriber keeps only the newest snapshot it has not sent yet; a slow
+client therefore receives one coalesced delta instead of a backlog.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+
+from .models import Choice
+
+
+def current_tallies(question_id):
+    """:return a dict mapping choice id to its vote count."""
+    return dict(Choice.objects.filter(question_id=question_id)
+                .values_list('id', 'vote_count'))
+
+
+class Subscription:
+    """One client's view of a question's tallies, owned by an event loop."""
+
+    def __init__(self, question_id, loop):
+        """Initialize a subscription that delivers on `loop`."""
+        self.question_id = question_id
+        self._loop = loop
+        self._ready = asyncio.Event()
+        self._latest = None
+        self._sent = {}
+
+    def prime(self, tallies):
+        """Record `tallies` as already sent to the client."""
+        self._sent = dict(tallies)
+
+    def offer(self, tallies):
+        """Hand a new snapshot over from any thread."""
+        self._loop.call_soon_threadsafe(self._receive, tallies)
+
+    def _receive(self, tallies):
+        self._latest = tallies
+        self._ready.set()
+
+    async def changes(self, timeout=None):
+        """Wait for the next snapshot.
+
+        :return the tallies that changed since the last call, or None if
+                nothing arrived within `timeout` seconds.
+        """
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._ready.clear()
+        latest, self._latest = self._latest, None
+        delta = {choice_id: count for choice_id, count in latest.items()
+                 if self._sent.get(choice_id) != count}
+        self._sent.update(delta)
+        return delta
+
+
+class TallyPublisher:
+    """Fan out tally snapshots to the subscribers of each question."""
+
+    def __init__(self):
+        """Initialize a publisher without subscribers."""
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+        self._reads = 0
+        self._delivered = {}
+
+    def subscribe(self, question_id):
+        """:return a new subscription bound to the running event loop."""
+        subscription = Subscription(question_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers[question_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stop delivering to `subscription`."""
+        with self._lock:
+            watchers = self._subscribers.get(subscription.question_id)
+            if watchers is not None:
+                watchers.discard(subscription)
+                if not watchers:
+                    del self._subscribers[subscription.question_id]
+                    self._delivered.pop(subscription.question_id, None)
+
+    def has_subscribers(self, question_id):
+        """:return True if anyone watches `question_id`."""
+        return bool(self._subscribers.get(question_id))
+
+    def publish(self, question_id):
+        """Send the current tallies of `question_id` to its subscribers.
+
+        The tallies are read outside the lock. Each read is numbered as it
+        starts, and one that ends after a later read was delivered is
+        dropped, so subscribers never go back to older tallies.
+        """
+        if not self.has_subscribers(question_id):
+            return
+        with self._lock:
+            self._reads += 1
+            read = self._reads
+        tallies = current_tallies(question_id)
+        with self._lock:
+            watchers = self._subscribers.get(question_id)
+            if not watchers or read < self._delivered.get(question_id, 0):
+                return
+            self._delivered[question_id] = read
+            for subscription in list(watchers):
+                try:
+                    subscription.offer(tallies)
+                except RuntimeError:
+                    # The subscriber's event loop is gone.
+                    watchers.discard(subscription)
+
+
+publisher = TallyPublisher()
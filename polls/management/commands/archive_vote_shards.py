@@ -0,0 +1,76 @@
+"""Move the votes of closed questions into read-only archive files."""
+import datetime
+from functools import partial
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from polls.models import Question, Vote
+from polls.shards import (archive_path, archive_question, restore_question,
+                          vote_aliases)
+from polls.tallies import rebuild_tallies
+
+
+class Command(BaseCommand):
+    """Archive the live votes of closed questions, or restore them."""
+
+    help = ("Move the votes of questions closed for a while out of the "
+            "live vote tables into one read-only SQLite file each.")
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument('question_ids', nargs='*', type=int,
+                            help="Only archive or restore these questions.")
+        parser.add_argument('--closed-for', type=float, default=1,
+                            metavar='DAYS',
+                            help="Only archive questions closed at least "
+                                 "this many days ago (default 1).")
+        parser.add_argument('--restore', action='store_true',
+                            help="Move the archived votes of the given "
+                                 "questions back, e.g. before reopening "
+                                 "them.")
+
+    def handle(self, *args, **options):
+        """Archive or restore each question and report it."""
+        if options['restore']:
+            if not options['question_ids']:
+                raise CommandError("Name the questions to restore.")
+            for question_id in options['question_ids']:
+                try:
+                    count = restore_question(question_id)
+                except ValueError as error:
+                    raise CommandError(str(error))
+                self.stdout.write(f"question {question_id}: "
+                                  f"{count} votes restored")
+            # A vote kept over its archived one was counted twice; recount
+            # once the archives are gone.
+            transaction.on_commit(partial(rebuild_tallies,
+                                          options['question_ids']))
+            return
+        closed_before = (timezone.now()
+                         - datetime.timedelta(days=options['closed_for']))
+        closed = set(Question.objects.closed(closed_before)
+                     .values_list('pk', flat=True))
+        if options['question_ids']:
+            closed &= set(options['question_ids'])
+        with_votes = set()
+        for alias in vote_aliases():
+            with_votes.update(Vote.objects.using(alias).order_by()
+                              .values_list('question_id', flat=True)
+                              .distinct())
+        failed = 0
+        archived = 0
+        for question_id in sorted(closed & with_votes):
+            try:
+                count = archive_question(question_id)
+            except ValueError as error:
+                failed += 1
+                self.stderr.write(str(error))
+                continue
+            archived += count
+            self.stdout.write(f"question {question_id}: {count} votes -> "
+                              f"{archive_path(question_id)}")
+        if failed:
+            raise CommandError(f"{failed} questions could not be archived.")
+        self.stdout.write(self.style.SUCCESS(f"{archived} votes archived."))
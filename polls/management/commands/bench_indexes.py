@@ -0,0 +1,51 @@
+"""Benchmark the hot queries with and without the tuned indexes."""
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from polls.benchmarks import compare_indexes, seed
+
+
+class Command(BaseCommand):
+    """Seed a throwaway database and compare query plans and timings."""
+
+    help = ("Seed a test database with votes and report EXPLAIN QUERY PLAN "
+            "output and timings of the hot queries before and after the "
+            "tuned indexes.")
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument('--votes', type=int, default=1000000)
+        parser.add_argument('--users', type=int, default=20000)
+        parser.add_argument('--questions', type=int, default=50)
+        parser.add_argument('--choices', type=int, default=4)
+        parser.add_argument('--repeat', type=int, default=50,
+                            help="Executions of each query per measurement.")
+        parser.add_argument('--json', action='store_true',
+                            help="Print the report as JSON.")
+
+    def handle(self, *args, **options):
+        """Run the benchmark on a test database and print the report."""
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            counts = seed(users=options['users'],
+                          questions=options['questions'],
+                          choices=options['choices'],
+                          votes=options['votes'])
+            report = compare_indexes(repeat=options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        if options['json']:
+            self.stdout.write(json.dumps({'rows': counts, **report},
+                                         indent=2))
+            return
+        self.stdout.write(f"Seeded {counts}")
+        for name in report['before']:
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for phase in ('before', 'after'):
+                result = report[phase][name]
+                self.stdout.write(f"  {phase}: {result['mean_ms']} ms")
+                for line in result['plan'].splitlines():
+                    self.stdout.write(f"    {line}")
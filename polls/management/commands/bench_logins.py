@@ -0,0 +1,38 @@
+"""Benchmark password verification in logins per second per core."""
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from mysite.passwords import get_hashing_pool
+from polls.benchmarks import login_throughput
+
+
+class Command(BaseCommand):
+    """Measure logins per second with inline and pooled hashing."""
+
+    help = ("Authenticate a test user from parallel threads and report "
+            "logins per second and per CPU core for the configured "
+            "password hasher, hashing inline and in the process pool.")
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument('--logins', type=int, default=100)
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--mode', action='append',
+                            choices=('inline', 'pool'),
+                            help="Only run these modes.")
+
+    def handle(self, *args, **options):
+        """Run the benchmark on a test database and print the report."""
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            report = [login_throughput(logins=options['logins'],
+                                       concurrency=options['concurrency'],
+                                       mode=mode)
+                      for mode in options['mode'] or ('inline', 'pool')]
+        finally:
+            get_hashing_pool().shutdown()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        self.stdout.write(json.dumps(report, indent=2))
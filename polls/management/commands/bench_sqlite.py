@@ -0,0 +1,37 @@
+"""Benchmark concurrent vote transactions with and without SQLite tuning."""
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from polls.benchmarks import sqlite_vote_throughput
+
+
+class Command(BaseCommand):
+    """Compare committed votes per second of the plain and tuned PRAGMAs."""
+
+    help = ("Run concurrent vote transactions on scratch SQLite files, "
+            "once with SQLite's defaults and once with "
+            "SQLITE_TUNED_PRAGMAS, and report the committed votes per "
+            "second and lock errors as JSON.")
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--votes', type=int, default=200,
+                            help="Vote transactions per writer.")
+        parser.add_argument('--readers', type=int, default=2)
+
+    def handle(self, *args, **options):
+        """Run both profiles and print the report."""
+        report = {}
+        with tempfile.TemporaryDirectory() as directory:
+            for profile, pragmas in (('plain', {}),
+                                     ('tuned', settings.SQLITE_TUNED_PRAGMAS)):
+                report[profile] = sqlite_vote_throughput(
+                    os.path.join(directory, f'{profile}.db'), pragmas,
+                    writers=options['writers'], votes=options['votes'],
+                    readers=options['readers'])
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,67 @@
+"""Load-test the polls views and report the results as JSON."""
+import json
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+
+from polls.benchmarks import drive, seed
+from polls.tallies import rebuild_tallies
+
+SCENARIOS = ('index', 'detail', 'vote', 'results')
+
+
+class Command(BaseCommand):
+    """Seed a throwaway database and drive the views with parallel clients."""
+
+    help = ("Seed a test database and report throughput, latency "
+            "percentiles and queries per request of the polls views as "
+            "JSON.")
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--questions', type=int, default=20)
+        parser.add_argument('--choices', type=int, default=4)
+        parser.add_argument('--votes', type=int, default=2000)
+        parser.add_argument('--fixture', action='append', default=[],
+                            help="Also load this fixture, e.g. "
+                                 "data/polls.json. May be repeated.")
+        parser.add_argument('--requests', type=int, default=200,
+                            help="Requests per scenario.")
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--scenario', action='append',
+                            choices=SCENARIOS,
+                            help="Only run these scenarios.")
+        parser.add_argument('--output', help="Write the report here.")
+
+    def handle(self, *args, **options):
+        """Run every scenario on a test database and print the report."""
+        if options['users'] < options['concurrency']:
+            raise CommandError("Need at least one user per client.")
+        old_name = connection.settings_dict['NAME']
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            if options['fixture']:
+                call_command('loaddata', *options['fixture'], verbosity=0)
+                rebuild_tallies()
+            rows = seed(users=options['users'],
+                        questions=options['questions'],
+                        choices=options['choices'],
+                        votes=options['votes'])
+            results = {
+                name: drive(name, requests=options['requests'],
+                            concurrency=options['concurrency'])
+                for name in options['scenario'] or SCENARIOS
+            }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        report = json.dumps({'rows': rows, 'scenarios': results}, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report + '\n')
+        self.stdout.write(report)
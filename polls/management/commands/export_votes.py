@@ -0,0 +1,50 @@
+"""Stream poll results or raw votes to a CSV or JSON Lines file."""
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.exports import FORMATS, KINDS, export, parse_moment
+
+
+class Command(BaseCommand):
+    """Export results or votes without loading them into memory."""
+
+    help = ("Write the results or the raw votes of the polls as CSV or "
+            "JSON Lines, one chunk of rows at a time.")
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument('kind', choices=KINDS,
+                            help="Per-choice results or raw vote rows.")
+        parser.add_argument('--format', choices=sorted(FORMATS),
+                            default='csv', help="Output encoding.")
+        parser.add_argument('--question', type=int, action='append',
+                            dest='questions',
+                            help="Only export this question; repeatable.")
+        parser.add_argument('--choice', type=int, action='append',
+                            dest='choices',
+                            help="Only export this choice; repeatable.")
+        parser.add_argument('--since',
+                            help="Only votes cast at or after this ISO "
+                                 "date or datetime.")
+        parser.add_argument('--until',
+                            help="Only votes cast before this ISO "
+                                 "datetime, or up to the end of this date.")
+        parser.add_argument('--output', default='-',
+                            help="File to write; '-' for standard output.")
+
+    def handle(self, *args, **options):
+        """Write the export row by row."""
+        try:
+            rows = export(options['kind'], options['format'],
+                          questions=options['questions'],
+                          choices=options['choices'],
+                          since=parse_moment(options['since']),
+                          until=parse_moment(options['until'], end=True))
+        except ValueError as error:
+            raise CommandError(error)
+        if options['output'] == '-':
+            for row in rows:
+                self.stdout.write(row, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8',
+                  newline='') as stream:
+            stream.writelines(rows)
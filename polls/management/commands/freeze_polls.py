@@ -0,0 +1,82 @@
+"""Freeze the final results of closed questions."""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.summaries import (freeze_question, frozen_question_ids,
+                             questions_to_freeze, verify_question)
+
+
+class Command(BaseCommand):
+    """Store the final tallies of closed questions, or verify them."""
+
+    help = ("Store the final tallies of questions closed for a while, "
+            "optionally archiving their votes, or verify frozen ones.")
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument('question_ids', nargs='*', type=int,
+                            help="Only freeze or verify these questions.")
+        parser.add_argument('--closed-for', type=float, metavar='DAYS',
+                            help="Only freeze questions closed at least "
+                                 "this many days ago (FREEZE_AFTER_DAYS "
+                                 "by default).")
+        parser.add_argument('--archive-votes', action='store_true',
+                            default=settings.POLLS_FREEZE_ARCHIVE_VOTES,
+                            help="Also move the votes to read-only "
+                                 "archive files.")
+        parser.add_argument('--verify', action='store_true',
+                            help="Check the frozen tallies against the "
+                                 "live and archived votes instead.")
+        parser.add_argument('--watch', action='store_true',
+                            help="Keep freezing every --interval seconds.")
+        parser.add_argument('--interval', type=float, default=3600.0)
+
+    def handle(self, *args, **options):
+        """Verify, or freeze once or repeatedly with --watch."""
+        if options['verify']:
+            return self.verify(options['question_ids'] or None)
+        while True:
+            failed = self.freeze(options)
+            if not options['watch']:
+                if failed:
+                    raise CommandError(
+                        f"{failed} questions could not be frozen.")
+                return
+            time.sleep(options['interval'])
+
+    def freeze(self, options):
+        """Freeze every question due; :return how many failed."""
+        question_ids = questions_to_freeze(options['closed_for'])
+        if options['question_ids']:
+            question_ids = question_ids.filter(pk__in=options['question_ids'])
+        frozen = failed = 0
+        for question_id in question_ids:
+            try:
+                votes = freeze_question(question_id,
+                                        options['archive_votes'])
+            except ValueError as error:
+                failed += 1
+                self.stderr.write(str(error))
+                continue
+            frozen += 1
+            self.stdout.write(f"question {question_id}: {votes} votes")
+        self.stdout.write(self.style.SUCCESS(f"{frozen} questions frozen."))
+        return failed
+
+    def verify(self, question_ids):
+        """Report every frozen tally that differs from the votes."""
+        frozen = frozen_question_ids(question_ids)
+        mismatches = 0
+        for question_id in sorted(frozen):
+            for choice_id, votes, counted in verify_question(question_id):
+                mismatches += 1
+                self.stdout.write(f"question {question_id} choice "
+                                  f"{choice_id}: frozen {votes}, "
+                                  f"counted {counted}")
+        if mismatches:
+            raise CommandError(f"{mismatches} frozen tallies do not match "
+                               f"the votes.")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(frozen)} frozen questions verified."))
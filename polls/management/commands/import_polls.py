@@ -0,0 +1,43 @@
+"""Stream large poll exports into the database with bulk inserts."""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.imports import Importer, build_instance, iter_records
+
+try:
+    import resource
+except ImportError:  # Not available on Windows.
+    resource = None
+
+
+class Command(BaseCommand):
+    """Import users, questions, choices and votes from JSON or JSONL."""
+
+    help = ("Import fixture-style JSON arrays or JSON Lines files of "
+            "users, questions, choices and votes with batched bulk "
+            "inserts. Unlike loaddata, the files are never loaded whole.")
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument('files', nargs='+',
+                            help="Files to import, parents first, e.g. "
+                                 "data/users.json data/polls.json.")
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help="Rows written per transaction.")
+
+    def handle(self, *args, **options):
+        """Import every file and report the throughput."""
+        importer = Importer(options['batch_size'])
+        for path in options['files']:
+            try:
+                with open(path, encoding='utf-8') as stream:
+                    for record in iter_records(stream):
+                        importer.add(build_instance(record))
+            except (OSError, ValueError) as error:
+                raise CommandError(f"{path}: {error}")
+        summary = importer.finish()
+        if resource is not None:
+            summary['peak_memory_kb'] = resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss
+        self.stdout.write(json.dumps(summary, indent=2))
@@ -0,0 +1,31 @@
+"""Rebuild or reconcile the per-choice vote tallies."""
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.tallies import rebuild_tallies
+
+
+class Command(BaseCommand):
+    """Recount the vote table and repair drifted ``Choice.vote_count``."""
+
+    help = "Recount votes and repair the per-choice vote tallies."
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument('question_ids', nargs='*', type=int,
+                            help="Only rebuild these questions.")
+        parser.add_argument('--check', action='store_true',
+                            help="Report drift without writing; "
+                                 "exit with an error if any is found.")
+
+    def handle(self, *args, **options):
+        """Run the rebuild and report each drifted choice."""
+        questions = options['question_ids'] or None
+        drifted = rebuild_tallies(questions, dry_run=options['check'])
+        for choice, stored, actual in drifted:
+            self.stdout.write(f"choice {choice.pk} ({choice}): "
+                              f"{stored} -> {actual}")
+        if options['check'] and drifted:
+            raise CommandError(f"{len(drifted)} tallies out of date.")
+        verb = "found" if options['check'] else "fixed"
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(drifted)} drifted tallies {verb}."))
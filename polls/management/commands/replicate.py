@@ -0,0 +1,36 @@
+"""Keep the local read replica in sync with the primary database."""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from polls.replication import replicate
+
+
+class Command(BaseCommand):
+    """Copy the primary SQLite database onto the replica alias."""
+
+    help = "Copy the primary SQLite database onto the read replica."
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument('--source', default='default')
+        parser.add_argument('--target', default='replica')
+        parser.add_argument('--watch', action='store_true',
+                            help="Keep copying every --interval seconds.")
+        parser.add_argument('--interval', type=float, default=1.0)
+
+    def handle(self, *args, **options):
+        """Copy once, or repeatedly with --watch."""
+        if options['target'] not in connections:
+            raise CommandError(f"No database alias {options['target']!r}; "
+                               "set DB_REPLICA_NAME.")
+        while True:
+            started = time.perf_counter()
+            replicate(options['source'], options['target'])
+            elapsed = (time.perf_counter() - started) * 1000
+            self.stdout.write(f"Replicated {options['source']} to "
+                              f"{options['target']} in {elapsed:.1f} ms.")
+            if not options['watch']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,32 @@
+"""Move the votes to the shards their questions map to."""
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.shards import move_votes, vote_aliases
+from polls.tallies import rebuild_tallies
+
+
+class Command(BaseCommand):
+    """Rebalance the votes between the main database and the shards."""
+
+    help = ("Move every vote to the shard of its question, then repair "
+            "the tallies of the moved questions.")
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument('--shards', type=int,
+                            help="Move the votes for this many shards "
+                                 "instead of VOTE_SHARDS; run it before "
+                                 "lowering VOTE_SHARDS (0 moves every "
+                                 "vote back to the main database).")
+
+    def handle(self, *args, **options):
+        """Move the votes and report the moved questions."""
+        shards = options['shards']
+        if shards is not None and not 0 <= shards < len(vote_aliases()):
+            raise CommandError(f"Only {len(vote_aliases()) - 1} shards "
+                               f"are configured.")
+        moved = move_votes(shards)
+        drifted = rebuild_tallies(moved) if moved else []
+        self.stdout.write(self.style.SUCCESS(
+            f"Votes of {len(moved)} questions moved, "
+            f"{len(drifted)} tallies repaired."))
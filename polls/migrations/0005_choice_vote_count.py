@@ -0,0 +1,27 @@
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_vote_count(apps, schema_editor):
+    """Initialize the tallies from the existing vote rows."""
+    Choice = apps.get_model('polls', 'Choice')
+    choices = list(Choice.objects.annotate(actual=Count('vote')))
+    for choice in choices:
+        choice.vote_count = choice.actual
+    Choice.objects.bulk_update(choices, ['vote_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("polls", "0004_vote_question"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="choice",
+            name="vote_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_vote_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_votes(apps, schema_editor):
+    """Keep only the latest vote of each user on each question."""
+    Vote = apps.get_model('polls', 'Vote')
+    Choice = apps.get_model('polls', 'Choice')
+    duplicates = (Vote.objects.values('user_id', 'question_id')
+                  .annotate(rows=Count('id'), latest=Max('id'))
+                  .filter(rows__gt=1))
+    for row in duplicates:
+        Vote.objects.filter(user_id=row['user_id'],
+                            question_id=row['question_id'],
+                            id__lt=row['latest']).delete()
+    choices = list(Choice.objects.annotate(actual=Count('vote')))
+    for choice in choices:
+        choice.vote_count = choice.actual
+    Choice.objects.bulk_update(choices, ['vote_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("polls", "0005_choice_vote_count"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_votes,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="vote",
+            constraint=models.UniqueConstraint(
+                fields=("user", "question"),
+                name="unique_vote_per_user_question",
+            ),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from django.db.models import Count
+
+
+def seed_rollups(apps, schema_editor):
+    """Roll existing votes into one bucket so the history matches tallies."""
+    Vote = apps.get_model('polls', 'Vote')
+    VoteRollup = apps.get_model('polls', 'VoteRollup')
+    bucket = django.utils.timezone.now().replace(second=0, microsecond=0)
+    rows = (Vote.objects.filter(question__isnull=False)
+            .values('question_id', 'choice_id').annotate(votes=Count('id')))
+    VoteRollup.objects.bulk_create(
+        [VoteRollup(question_id=row['question_id'],
+                    choice_id=row['choice_id'],
+                    bucket=bucket, count=row['votes']) for row in rows],
+        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0006_vote_unique_vote_per_user_question'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='voted_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='time of the latest vote'),
+        ),
+        migrations.CreateModel(
+            name='VoteRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField(verbose_name='start of the minute')),
+                ('count', models.IntegerField(default=0)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.choice')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.question')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['question', 'bucket'], name='polls_rollup_question_bucket')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='voterollup',
+            constraint=models.UniqueConstraint(fields=('choice', 'bucket'), name='unique_rollup_per_choice_bucket'),
+        ),
+        migrations.RunPython(seed_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0009_question_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChoiceSummary',
+            fields=[
+                ('choice', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='polls.choice')),
+                ('votes', models.IntegerField()),
+                ('frozen_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='time the question was frozen')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.question')),
+            ],
+        ),
+    ]
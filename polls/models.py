@@ -2,9 +2,71 @@
 import datetime
 from django.contrib import admin
 from django.db import models
+from django.db.models import BooleanField, ExpressionWrapper, Min, Q
 from django.utils import timezone
 from django.contrib.auth.models import User
 
+# A question closes just after its end_date, since voting at end_date
+# itself is still allowed.
+CLOSE_DELAY = datetime.timedelta(microseconds=1)
+
+
+def open_at(now):
+    """:return the condition of questions open for voting at `now`."""
+    return (Q(pub_date__lte=now)
+            & (Q(end_date__isnull=True) | Q(end_date__gte=now)))
+
+
+class QuestionQuerySet(models.QuerySet):
+    """Voting-window filters that run in the database.
+
+    Every filter takes an optional `now` so callers can share one clock
+    reading; a question without an end_date never closes.
+    """
+
+    def published(self, now=None):
+        """:return the questions whose pub_date has passed."""
+        return self.filter(pub_date__lte=now or timezone.now())
+
+    def upcoming(self, now=None):
+        """:return the questions not published yet."""
+        return self.filter(pub_date__gt=now or timezone.now())
+
+    def open(self, now=None):
+        """:return the questions that accept votes."""
+        return self.filter(open_at(now or timezone.now()))
+
+    def closed(self, now=None):
+        """:return the questions whose voting has ended."""
+        return self.filter(end_date__lt=now or timezone.now())
+
+    def with_state(self, now=None):
+        """Annotate published_now, recently_published and open_now."""
+        now = now or timezone.now()
+        return self.annotate(
+            published_now=ExpressionWrapper(Q(pub_date__lte=now),
+                                            output_field=BooleanField()),
+            recently_published=ExpressionWrapper(
+                Q(pub_date__lte=now,
+                  pub_date__gte=now - datetime.timedelta(days=1)),
+                output_field=BooleanField()),
+            open_now=ExpressionWrapper(open_at(now),
+                                       output_field=BooleanField()),
+        )
+
+    def next_transition(self, now=None):
+        """:return the next moment a question opens or closes, or None."""
+        now = now or timezone.now()
+        bounds = self.aggregate(
+            opens=Min('pub_date', filter=Q(pub_date__gt=now)),
+            closes=Min('end_date', filter=Q(end_date__gte=now)),
+        )
+        moments = [bounds['opens']]
+        if bounds['closes'] is not None:
+            moments.append(bounds['closes'] + CLOSE_DELAY)
+        return min((moment for moment in moments if moment is not None),
+                   default=None)
+
 
 class Question(models.Model):
     """Question model class represent question_text pub_date and end_date."""
@@ -15,6 +77,15 @@ class Question(models.Model):
                                     default=timezone.now,
                                     blank=True, null=True)
 
+    objects = QuestionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Serves the newest-first listing and its (pub_date, id) keyset.
+            models.Index(fields=['-pub_date', '-id'],
+                         name='polls_question_pub_date_id'),
+        ]
+
     def __str__(self):
         """:return The question text."""
         return self.question_text
@@ -24,32 +95,36 @@ class Question(models.Model):
         ordering='pub_date',
         description='Published recently?',
     )
-    def was_published_recently(self):
+    def was_published_recently(self, now=None):
         """
         Check the question that was published recently.
 
         :return boolean True if question was published recently.
         """
-        now = timezone.now()
+        now = now or timezone.now()
         return now - datetime.timedelta(days=1) <= self.pub_date <= now
 
-    def is_published(self):
+    def is_published(self, now=None):
         """
         Check the question that is published.
 
         :return boolean True if question is published.
         """
-        now = timezone.now()
+        now = now or timezone.now()
         return now >= self.pub_date
 
-    def can_vote(self):
+    def can_vote(self, now=None):
         """
         Check the question at the time that can vote.
 
+        A question without an end_date stays open once published.
+
         :return boolean True if the question is at the time of voting.
         """
-        now = timezone.now()
-        return self.pub_date <= now <= self.end_date
+        now = now or timezone.now()
+        if self.pub_date > now:
+            return False
+        return self.end_date is None or now <= self.end_date
 
 
 class Choice(models.Model):
@@ -57,11 +132,12 @@ class Choice(models.Model):
 
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice_text = models.CharField(max_length=200)
+    vote_count = models.IntegerField(default=0, editable=False)
 
     @property
     def votes(self):
         """:return the number of votes on the choice of polls question."""
-        return Vote.objects.filter(choice=self).count()
+        return self.vote_count
 
     def __str__(self):
         """:return the content of choice text."""
@@ -74,3 +150,46 @@ class Vote(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
     question = models.ForeignKey(Question, on_delete=models.CASCADE, null=True)
+    voted_at = models.DateTimeField('time of the latest vote',
+                                    default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'question'],
+                                    name='unique_vote_per_user_question'),
+        ]
+        indexes = [
+            # Covers per-choice counts of a question without the table.
+            models.Index(fields=['question', 'choice'],
+                         name='polls_vote_question_choice'),
+        ]
+
+
+class VoteRollup(models.Model):
+    """Net change of the votes on a choice within one minute."""
+
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    bucket = models.DateTimeField('start of the minute')
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['choice', 'bucket'],
+                                    name='unique_rollup_per_choice_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['question', 'bucket'],
+                         name='polls_rollup_question_bucket'),
+        ]
+
+
+class ChoiceSummary(models.Model):
+    """Final tally of a choice of a frozen question."""
+
+    choice = models.OneToOneField(Choice, on_delete=models.CASCADE,
+                                  primary_key=True, related_name='summary')
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    votes = models.IntegerField()
+    frozen_at = models.DateTimeField('time the question was frozen',
+                                     default=timezone.now)
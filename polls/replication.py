@@ -0,0 +1,22 @@
+"""Local replication stand-in that copies one SQLite file onto another."""
+import sqlite3
+from contextlib import closing
+
+from django.conf import settings
+
+
+def copy_sqlite(source_path, target_path):
+    """Copy the database at `source_path` onto `target_path`.
+
+    The SQLite online backup API copies a consistent snapshot while the
+    source stays writable.
+    """
+    with closing(sqlite3.connect(source_path)) as source, \
+            closing(sqlite3.connect(target_path)) as target:
+        source.backup(target)
+
+
+def replicate(source='default', target='replica'):
+    """Copy the `source` database alias onto the `target` alias."""
+    copy_sqlite(settings.DATABASES[source]['NAME'],
+                settings.DATABASES[target]['NAME'])
@@ -0,0 +1,103 @@
+"""Route poll page reads to a read replica.
+
+Views wrapped with ``read_from_replica`` read the polls models from
+``POLLS_READ_DATABASE``. Everything else, including every write, the
+admin and the auth and session tables, stays on the primary. A user who
+just voted carries a short-lived cookie that pins their reads to the
+primary, so the results page shows their own vote even if the replica
+lags behind.
+
+``VoteShardRouter`` comes first and keeps each vote in the shard of its
+question when ``POLLS_VOTE_SHARDS`` is set.
+"""
+import contextvars
+from functools import wraps
+
+from django.conf import settings
+
+from .shards import SHARD_PREFIX, shard_alias
+
+STICKY_COOKIE = 'polls_primary'
+
+_read_alias = contextvars.ContextVar('polls_read_alias', default=None)
+
+
+class VoteShardRouter:
+    """Send the votes of a known question to that question's shard."""
+
+    @staticmethod
+    def question_id(model, instance):
+        """:return the question id of a vote or of a related instance."""
+        if model._meta.label != 'polls.Vote' or instance is None:
+            return None
+        if instance._meta.label == 'polls.Question':
+            return instance.pk
+        return getattr(instance, 'question_id', None)
+
+    def db_for_read(self, model, **hints):
+        """:return the shard of the vote's question, when it is known."""
+        question_id = self.question_id(model, hints.get('instance'))
+        if question_id is None or not settings.POLLS_VOTE_SHARDS:
+            return None
+        return shard_alias(question_id)
+
+    db_for_write = db_for_read
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """Only create the vote table in the shards."""
+        if db.startswith(SHARD_PREFIX):
+            return app_label == 'polls' and model_name == 'vote'
+        return None
+
+
+class PrimaryReplicaRouter:
+    """Send reads of the polls models to the alias chosen for the view."""
+
+    def db_for_read(self, model, **hints):
+        """:return the read alias of the current view for polls models."""
+        if model._meta.app_label == 'polls':
+            return _read_alias.get()
+        return None
+
+    def db_for_write(self, model, **hints):
+        """:return the primary for every write."""
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Allow relations; the replica is a copy of the primary."""
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """Only migrate the primary; the replica is copied from it."""
+        return db == 'default'
+
+
+def read_alias(request):
+    """:return the alias `request` should read the polls models from."""
+    alias = settings.POLLS_READ_DATABASE
+    if alias is None or STICKY_COOKIE in request.COOKIES:
+        return 'default'
+    return alias
+
+
+def read_from_replica(view):
+    """Decorate `view` so its polls reads go to the read replica."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = _read_alias.set(read_alias(request))
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _read_alias.reset(token)
+    return wrapper
+
+
+def stick_to_primary(response):
+    """Pin the reads of the client to the primary for a short while.
+
+    The same cookie makes the results page skip the shared snapshot, so
+    the voter sees their own vote even without a replica.
+    """
+    response.set_cookie(STICKY_COOKIE, '1', httponly=True, samesite='Lax',
+                        max_age=settings.POLLS_REPLICA_STICKY_SECONDS)
+    return response
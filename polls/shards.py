@@ -0,0 +1,309 @@
+"""Optional partitioning of the votes by question.
+
+With ``POLLS_VOTE_SHARDS`` set to n, the votes of question q live in the
+``votes_<q % n>`` database, a SQLite file of its own, instead of the main
+``polls_vote`` table. ``VoteShardRouter`` sends the vote reads and writes
+that name their question there; the tallies and everything else stay in
+the main database, so the pages never have to read a shard.
+
+``archive_vote_shards`` moves the votes of long-closed questions out of
+the live tables into one compact, read-only SQLite file per question
+under ``POLLS_VOTE_ARCHIVE_DIR``. Counts, exports and tally rebuilds read
+those files as well.
+"""
+import datetime
+import os
+import re
+import sqlite3
+from collections import Counter, defaultdict
+from contextlib import ExitStack, closing, contextmanager
+from functools import partial
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Vote
+
+SHARD_PREFIX = 'votes_'
+BATCH_SIZE = 5000
+
+ARCHIVE_COLUMNS = ('id', 'question_id', 'choice_id', 'user_id', 'voted_at')
+ARCHIVE_SCHEMA = ('CREATE TABLE polls_vote (id INTEGER PRIMARY KEY, '
+                  'question_id INTEGER NOT NULL, choice_id INTEGER NOT NULL, '
+                  'user_id INTEGER NOT NULL, voted_at TEXT NOT NULL)')
+ARCHIVE_NAME = re.compile(r'question-(\d+)\.sqlite3')
+
+
+def shard_alias(question_id, shards=None):
+    """:return the alias of the database holding a question's live votes.
+
+    :param shards: number of shards, ``POLLS_VOTE_SHARDS`` by default.
+    """
+    shards = settings.POLLS_VOTE_SHARDS if shards is None else shards
+    if not shards:
+        return 'default'
+    return f'{SHARD_PREFIX}{question_id % shards}'
+
+
+def vote_aliases(primary='default'):
+    """:return `primary` followed by the alias of every vote shard."""
+    return [primary] + sorted(alias for alias in settings.DATABASES
+                              if alias.startswith(SHARD_PREFIX))
+
+
+def by_shard(items, question_id):
+    """:return dict mapping shard aliases to their share of `items`.
+
+    :param question_id: function returning the question id of an item.
+    """
+    groups = defaultdict(list)
+    for item in items:
+        groups[shard_alias(question_id(item))].append(item)
+    return groups
+
+
+@contextmanager
+def shard_atomic(aliases):
+    """Run the block in a transaction on each shard among `aliases`.
+
+    Use it inside the transaction on the main database: the shards then
+    commit first, and a failed main commit leaves the votes ahead of the
+    tallies until ``rebuild_tallies`` runs.
+    """
+    with ExitStack() as stack:
+        for alias in sorted(aliases):
+            if alias != 'default':
+                stack.enter_context(transaction.atomic(using=alias))
+        yield
+
+
+def previous_choice_id(user, question_id):
+    """:return the id of the choice `user` voted for, or None."""
+    return (Vote.objects.using(shard_alias(question_id))
+            .filter(user=user, question_id=question_id)
+            .values_list('choice_id', flat=True).first())
+
+
+def delete_votes(aliases, **filters):
+    """Delete the matching votes from the shards among `aliases`.
+
+    Deletes on the main database cascade to its votes, but not to the
+    votes in the shards.
+    """
+    for alias in aliases:
+        if alias != 'default':
+            Vote.objects.using(alias).filter(**filters).delete()
+
+
+def move_votes(shards=None):
+    """Move every live vote to the shard its question maps to.
+
+    Run it after raising ``POLLS_VOTE_SHARDS``, or with the new `shards`
+    count before lowering it. When a user already voted in the new
+    shard, that newer vote is kept.
+
+    :return the ids of the questions whose votes were moved.
+    """
+    moved = set()
+    for source in vote_aliases():
+        question_ids = list(Vote.objects.using(source).order_by()
+                            .values_list('question_id', flat=True)
+                            .distinct())
+        for question_id in question_ids:
+            target = shard_alias(question_id, shards)
+            if target == source:
+                continue
+            votes = Vote.objects.using(source).filter(
+                question_id=question_id).order_by('pk')
+            while True:
+                with transaction.atomic(using=target), \
+                        transaction.atomic(using=source):
+                    batch = list(votes.values_list(
+                        'pk', 'user_id', 'choice_id', 'voted_at'
+                    )[:BATCH_SIZE])
+                    if not batch:
+                        break
+                    Vote.objects.using(target).bulk_create(
+                        [Vote(user_id=user_id, question_id=question_id,
+                              choice_id=choice_id, voted_at=voted_at)
+                         for _, user_id, choice_id, voted_at in batch],
+                        ignore_conflicts=True)
+                    votes.filter(pk__lte=batch[-1][0]).delete()
+            moved.add(question_id)
+    return moved
+
+
+def live_counts(question_id):
+    """:return dict mapping choice ids to their live votes."""
+    return dict(Vote.objects.using(shard_alias(question_id))
+                .filter(question_id=question_id)
+                .values_list('choice_id').annotate(Count('id')).order_by())
+
+
+def vote_counts(question_ids=None):
+    """:return a Counter of the live and archived votes of each choice."""
+    counts = Counter()
+    for alias in vote_aliases():
+        votes = Vote.objects.using(alias)
+        if question_ids is not None:
+            votes = votes.filter(question_id__in=question_ids)
+        counts.update(dict(votes.values_list('choice_id')
+                           .annotate(Count('id')).order_by()))
+    for question_id in archived_question_ids(question_ids):
+        counts.update(archived_counts(question_id))
+    return counts
+
+
+def archive_path(question_id):
+    """:return the path of the vote archive of a question."""
+    return os.path.join(settings.POLLS_VOTE_ARCHIVE_DIR,
+                        f'question-{question_id}.sqlite3')
+
+
+def archived_question_ids(question_ids=None):
+    """:return the ids of the questions with a vote archive.
+
+    :param question_ids: only consider these questions.
+    """
+    try:
+        names = os.listdir(settings.POLLS_VOTE_ARCHIVE_DIR)
+    except FileNotFoundError:
+        return set()
+    archived = {int(match.group(1)) for match in map(ARCHIVE_NAME.fullmatch,
+                                                     names) if match}
+    if question_ids is not None:
+        archived &= set(question_ids)
+    return archived
+
+
+def open_archive(path):
+    """:return a read-only connection to the archive at `path`."""
+    return closing(sqlite3.connect(f'{Path(path).resolve().as_uri()}'
+                                   '?mode=ro', uri=True))
+
+
+def _archive_counts(path):
+    with open_archive(path) as archive:
+        return dict(archive.execute('SELECT choice_id, COUNT(*) '
+                                    'FROM polls_vote GROUP BY choice_id'))
+
+
+def archived_counts(question_id):
+    """:return dict mapping choice ids to their archived votes."""
+    return _archive_counts(archive_path(question_id))
+
+
+def archived_vote_rows(question_id, choices=None, since=None, until=None):
+    """Yield the ``ARCHIVE_COLUMNS`` of the archived votes of a question.
+
+    `since` is inclusive and `until` exclusive, as for the live votes.
+    """
+    adapt = connections['default'].ops.adapt_datetimefield_value
+    conditions, params = [], []
+    if choices:
+        conditions.append(f"choice_id IN ({', '.join('?' * len(choices))})")
+        params.extend(choices)
+    if since is not None:
+        conditions.append('voted_at >= ?')
+        params.append(adapt(since))
+    if until is not None:
+        conditions.append('voted_at < ?')
+        params.append(adapt(until))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    with open_archive(archive_path(question_id)) as archive:
+        for *row, voted_at in archive.execute(
+                f"SELECT {', '.join(ARCHIVE_COLUMNS)} FROM polls_vote "
+                f"{where} ORDER BY id", params):
+            voted_at = parse_datetime(voted_at)
+            if settings.USE_TZ:
+                voted_at = timezone.make_aware(voted_at,
+                                               datetime.timezone.utc)
+            yield (*row, voted_at)
+
+
+def archive_question(question_id):
+    """Move the live votes of a closed question to its read-only archive.
+
+    The archive is written to a temporary file, checked against the live
+    votes and renamed into place before they are deleted, so a run that
+    was interrupted can simply be started again.
+
+    :return the number of votes archived.
+    :raise ValueError: if the archive and the live votes differ.
+    """
+    alias = shard_alias(question_id)
+    votes = Vote.objects.using(alias).filter(question_id=question_id)
+    live = live_counts(question_id)
+    path = archive_path(question_id)
+    if not os.path.exists(path):
+        if not live:
+            return 0
+        os.makedirs(settings.POLLS_VOTE_ARCHIVE_DIR, exist_ok=True)
+        draft = f'{path}.partial'
+        if os.path.exists(draft):
+            os.remove(draft)
+        adapt = connections[alias].ops.adapt_datetimefield_value
+        # Written once in id order, the file has no free pages to vacuum.
+        with closing(sqlite3.connect(draft)) as archive:
+            archive.execute('PRAGMA journal_mode = OFF')
+            archive.execute(ARCHIVE_SCHEMA)
+            archive.executemany(
+                'INSERT INTO polls_vote VALUES (?, ?, ?, ?, ?)',
+                ((*row, adapt(voted_at)) for *row, voted_at in
+                 votes.order_by('pk').values_list(*ARCHIVE_COLUMNS)
+                 .iterator(BATCH_SIZE)))
+            archive.commit()
+        if _archive_counts(draft) != live:
+            os.remove(draft)
+            raise ValueError(f"The archive of question {question_id} "
+                             f"does not match its votes.")
+        os.chmod(draft, 0o444)
+        os.replace(draft, path)
+    elif not live:
+        return 0
+    elif archived_counts(question_id) != live:
+        raise ValueError(f"Question {question_id} has an archive and "
+                         f"different live votes.")
+    votes.delete()
+    return sum(live.values())
+
+
+def restore_question(question_id):
+    """Move the archived votes of a question back to its live shard.
+
+    The votes get new ids. A user who voted again meanwhile keeps that
+    newer vote, and the archive is only removed once every archived voter
+    has a live vote, after the transaction commits.
+
+    :return the number of votes restored.
+    :raise ValueError: if some archived votes could not be restored.
+    """
+    path = archive_path(question_id)
+    if not os.path.exists(path):
+        return 0
+    alias = shard_alias(question_id)
+    votes = Vote.objects.using(alias).filter(question_id=question_id)
+    with transaction.atomic(using=alias):
+        voters = set(votes.values_list('user_id', flat=True))
+        live = len(voters)
+        batch = []
+        for _, _, choice_id, user_id, voted_at in \
+                archived_vote_rows(question_id):
+            voters.add(user_id)
+            batch.append(Vote(question_id=question_id, choice_id=choice_id,
+                              user_id=user_id, voted_at=voted_at))
+            if len(batch) == BATCH_SIZE:
+                Vote.objects.using(alias).bulk_create(batch,
+                                                      ignore_conflicts=True)
+                batch = []
+        Vote.objects.using(alias).bulk_create(batch, ignore_conflicts=True)
+        restored = votes.count()
+        if restored != len(voters):
+            raise ValueError(f"Only {restored - live} of the archived votes "
+                             f"of question {question_id} could be restored.")
+        transaction.on_commit(partial(os.remove, path), using=alias)
+    return restored - live
@@ -0,0 +1,77 @@
+"""Signal handlers that keep the caches and the votes in step with polls."""
+import os
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .cache import (bump_question_set_version, bump_tally_versions,
+                    forget_choices)
+from .models import Choice, ChoiceSummary, Question, User
+from .shards import (archive_path, delete_votes, restore_question,
+                     shard_alias)
+from .snapshots import forget_snapshots
+from .tallies import withdraw_votes
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, instance, **kwargs):
+    """Invalidate the cached listings and the question's own responses."""
+    bump_question_set_version()
+    bump_tally_versions([instance.pk])
+    forget_snapshots([instance.pk])
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def choice_changed(sender, instance, **kwargs):
+    """Drop the cached choice list and responses of the choice's question."""
+    forget_choices([instance.question_id])
+    bump_tally_versions([instance.question_id])
+    forget_snapshots([instance.question_id])
+
+
+@receiver(post_save, sender=Question)
+def question_reopened(sender, instance, created, **kwargs):
+    """Thaw a question that accepts votes again.
+
+    Its archived votes go back to the live table first, so a returning
+    voter changes their vote instead of casting a second one. A restore
+    that fails raises and so fails the save.
+    """
+    if not created and instance.can_vote():
+        restore_question(instance.pk)
+        ChoiceSummary.objects.filter(question=instance).delete()
+
+
+def remove_archive(question_id):
+    """Remove the vote archive of a deleted question, if it has one."""
+    if os.path.exists(archive_path(question_id)):
+        os.remove(archive_path(question_id))
+
+
+# The cascades only reach the votes in the main database. The others go
+# once the delete is committed, so a rolled back delete keeps them.
+
+@receiver(post_delete, sender=Question)
+def question_deleted(sender, instance, **kwargs):
+    """Delete the question's votes held in a shard or an archive."""
+    transaction.on_commit(partial(delete_votes, [shard_alias(instance.pk)],
+                                  question_id=instance.pk))
+    transaction.on_commit(partial(remove_archive, instance.pk))
+
+
+@receiver(post_delete, sender=Choice)
+def choice_deleted(sender, instance, **kwargs):
+    """Delete the choice's votes held in a shard."""
+    transaction.on_commit(partial(
+        delete_votes, [shard_alias(instance.question_id)],
+        choice_id=instance.pk))
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    """Take the user's votes off the tallies before they go."""
+    withdraw_votes(instance.pk)
@@ -0,0 +1,150 @@
+"""Shared snapshots of the results of each question.
+
+The results page of a hot poll is built from a cached snapshot of the
+question, its choices with their percentages, the total and the leader.
+A snapshot is rebuilt once it is ``POLLS_RESULTS_SNAPSHOT_SECONDS`` old
+or ``POLLS_RESULTS_SNAPSHOT_VOTES`` vote changes behind. Only the worker
+that wins a ``cache.add`` lock rebuilds it; the others keep serving the
+stale copy meanwhile. Hits, stale hits, misses and recomputes are
+counted in the metrics registry.
+
+The snapshot of a frozen question (see ``summaries``) is built from its
+final tallies and kept until the question or its choices change.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from mysite.instrumentation import registry
+
+from .cache import tally_version
+from .models import Choice, Question
+
+# Snapshots of deleted or idle questions eventually leave the cache.
+SNAPSHOT_TIMEOUT = 24 * 60 * 60
+
+
+def snapshot_key(question_id):
+    """:return the cache key of the results snapshot of a question."""
+    return f'polls:results:{question_id}'
+
+
+def changes_key(question_id):
+    """:return the cache key of the vote change counter of a question."""
+    return f'polls:vote-changes:{question_id}'
+
+
+def lock_key(question_id):
+    """:return the cache key of the rebuild lock of a question."""
+    return f'polls:results-lock:{question_id}'
+
+
+def count_vote_changes(question_id, count=1):
+    """Add `count` committed vote changes to the counter of a question."""
+    try:
+        cache.incr(changes_key(question_id), count)
+    except ValueError:
+        cache.add(changes_key(question_id), count, None)
+
+
+def forget_snapshots(question_ids):
+    """Drop the snapshots of questions whose text or choices changed."""
+    cache.delete_many([snapshot_key(pk) for pk in question_ids])
+
+
+def build_snapshot(question_id):
+    """:return a new results snapshot, or None if there is no question."""
+    # Read the version and counter first, then the tallies from the
+    # primary, which already holds every change the version counts. A
+    # replica may lag behind it, and the version is also the ETag.
+    version = tally_version(question_id)
+    changes = cache.get(changes_key(question_id), 0)
+    choices = list(Choice.objects.using('default')
+                   .select_related('question', 'summary')
+                   .filter(question_id=question_id).order_by('pk'))
+    if choices:
+        question = choices[0].question
+    else:
+        question = (Question.objects.using('default')
+                    .filter(pk=question_id).first())
+        if question is None:
+            return None
+    frozen = bool(choices) and all(hasattr(choice, 'summary')
+                                   for choice in choices)
+    if frozen:
+        for choice in choices:
+            choice.vote_count = choice.summary.votes
+    total_votes = sum(choice.vote_count for choice in choices)
+    for choice in choices:
+        choice.percentage = (100 * choice.vote_count / total_votes
+                             if total_votes else 0)
+    leader = None
+    if total_votes:
+        leader = max(choices, key=lambda choice: choice.vote_count)
+    return {
+        'version': version,
+        'changes': changes,
+        'frozen': frozen,
+        'built_at': time.time(),
+        'question': question,
+        'choices': choices,
+        'total_votes': total_votes,
+        'leader': leader,
+    }
+
+
+def is_due(snapshot, changes):
+    """:return True if `snapshot` should be rebuilt.
+
+    The snapshot of a frozen question never is.
+    """
+    if snapshot.get('frozen'):
+        return False
+    return (time.time() - snapshot['built_at']
+            >= settings.POLLS_RESULTS_SNAPSHOT_SECONDS
+            or changes - snapshot['changes']
+            >= settings.POLLS_RESULTS_SNAPSHOT_VOTES)
+
+
+def current_snapshot(question_id):
+    """:return the cached snapshot if it is not due, without counting."""
+    values = cache.get_many([snapshot_key(question_id),
+                             changes_key(question_id)])
+    snapshot = values.get(snapshot_key(question_id))
+    if snapshot is None or is_due(snapshot,
+                                  values.get(changes_key(question_id), 0)):
+        return None
+    return snapshot
+
+
+def results_snapshot(question_id, fresh=False):
+    """:return the results snapshot of a question, rebuilding it if due.
+
+    :param fresh: rebuild even if the cached snapshot is not due, for a
+                  client that must see its own vote.
+    """
+    values = cache.get_many([snapshot_key(question_id),
+                             changes_key(question_id)])
+    snapshot = values.get(snapshot_key(question_id))
+    locked = False
+    if snapshot is None:
+        registry.increment('results_snapshot.miss')
+    elif not fresh:
+        if not is_due(snapshot, values.get(changes_key(question_id), 0)):
+            registry.increment('results_snapshot.hit')
+            return snapshot
+        locked = cache.add(lock_key(question_id), True,
+                           settings.POLLS_RESULTS_SNAPSHOT_LOCK_SECONDS)
+        if not locked:
+            registry.increment('results_snapshot.stale')
+            return snapshot
+    try:
+        snapshot = build_snapshot(question_id)
+        registry.increment('results_snapshot.recompute')
+        if snapshot is not None:
+            cache.set(snapshot_key(question_id), snapshot, SNAPSHOT_TIMEOUT)
+    finally:
+        if locked:
+            cache.delete(lock_key(question_id))
+    return snapshot
@@ -0,0 +1,81 @@
+"""Frozen final results of closed questions.
+
+Once a question has been closed for ``POLLS_FREEZE_AFTER_DAYS``, its
+votes can no longer change. ``freeze_question`` checks the tallies
+against the votes and copies them into ``ChoiceSummary`` rows. The
+results page of a frozen question is then built from those rows, and
+its snapshot never goes stale. The raw votes can move to a read-only
+archive (see ``shards``), and ``verify_question`` checks a summary
+against whatever votes remain, live or archived.
+"""
+import datetime
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Choice, ChoiceSummary, Question
+from .shards import archive_question, vote_counts
+from .snapshots import forget_snapshots
+
+
+def frozen_question_ids(question_ids=None):
+    """:return the ids of the frozen questions among `question_ids`."""
+    summaries = ChoiceSummary.objects.all()
+    if question_ids is not None:
+        summaries = summaries.filter(question_id__in=question_ids)
+    return set(summaries.values_list('question_id', flat=True).distinct())
+
+
+def freeze_question(question_id, archive_votes=False):
+    """Store the final tallies of a closed question.
+
+    :param archive_votes: also move its votes to a read-only archive.
+    :return the total number of votes frozen.
+    :raise ValueError: if the question is still open or its tallies do
+                       not match its votes.
+    """
+    question = Question.objects.get(pk=question_id)
+    if question.can_vote():
+        raise ValueError(f"Question {question_id} is still open.")
+    tallies = dict(Choice.objects.filter(question_id=question_id)
+                   .values_list('pk', 'vote_count'))
+    counts = vote_counts([question_id])
+    if any(counts.get(pk, 0) != votes for pk, votes in tallies.items()):
+        raise ValueError(f"The tallies of question {question_id} do not "
+                         f"match its votes; run rebuild_tallies first.")
+    now = timezone.now()
+    ChoiceSummary.objects.bulk_create(
+        [ChoiceSummary(choice_id=pk, question_id=question_id,
+                       votes=votes, frozen_at=now)
+         for pk, votes in tallies.items()],
+        ignore_conflicts=True)
+    forget_snapshots([question_id])
+    if archive_votes:
+        archive_question(question_id)
+    return sum(tallies.values())
+
+
+def verify_question(question_id):
+    """Check the summary of a frozen question against its votes.
+
+    :return list of (choice id, frozen votes, counted votes) that differ.
+    """
+    counts = vote_counts([question_id])
+    return [(pk, votes, counts.get(pk, 0)) for pk, votes
+            in ChoiceSummary.objects.filter(question_id=question_id)
+            .order_by('pk').values_list('pk', 'votes')
+            if counts.get(pk, 0) != votes]
+
+
+def questions_to_freeze(closed_for=None):
+    """:return the ids of the questions closed long enough to freeze.
+
+    :param closed_for: days since closing, ``POLLS_FREEZE_AFTER_DAYS``
+                       by default.
+    """
+    if closed_for is None:
+        closed_for = settings.POLLS_FREEZE_AFTER_DAYS
+    closed_before = timezone.now() - datetime.timedelta(days=closed_for)
+    return (Question.objects.closed(closed_before)
+            .filter(choice__isnull=False, choice__summary__isnull=True)
+            .order_by('pk').values_list('pk', flat=True).distinct())
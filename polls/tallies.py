@@ -0,0 +1,218 @@
+"""Maintained per-choice vote tallies.
+
+``Choice.vote_count`` is a denormalized copy of the number of ``Vote`` rows
+pointing at each choice. It is updated in the same transaction that inserts,
+moves or withdraws a vote, so result pages read one integer per choice
+instead of counting the vote table. The same transaction adds the change to the
+choice's ``VoteRollup`` row for the current minute, which keeps the
+results-over-time history without re-grouping the vote table.
+
+When the votes are sharded (see ``shards``) they sit in another database
+than the tallies, and every vote goes through ``apply_votes``.
+"""
+from collections import Counter
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Exists, F, Subquery
+from django.utils import timezone
+
+from .cache import bump_tally_versions
+from .live import publisher
+from .snapshots import count_vote_changes
+from .models import Choice, Vote, VoteRollup
+from .shards import (by_shard, delete_votes, shard_alias, shard_atomic,
+                     vote_aliases, vote_counts)
+
+
+def minute_bucket(when):
+    """:return the start of the minute that holds `when`."""
+    return when.replace(second=0, microsecond=0)
+
+
+def tallies_committed(question_id, count=1):
+    """Announce `count` committed vote changes of a question."""
+    bump_tally_versions([question_id])
+    count_vote_changes(question_id, count)
+    publisher.publish(question_id)
+
+
+def add_rollup_counts(counts):
+    """Add vote changes to their rollup rows.
+
+    :param counts: dict mapping (question_id, choice_id, bucket) to a net
+                   change, where bucket is the start of a minute.
+    """
+    for (question_id, choice_id, bucket), delta in counts.items():
+        if not delta:
+            continue
+        updated = VoteRollup.objects.filter(
+            choice_id=choice_id, bucket=bucket
+        ).update(count=F('count') + delta)
+        if not updated:
+            VoteRollup.objects.create(question_id=question_id,
+                                      choice_id=choice_id,
+                                      bucket=bucket, count=delta)
+
+
+def add_to_rollups(deltas, when):
+    """Add vote changes to the rollup rows of the minute holding `when`.
+
+    :param deltas: dict mapping (question_id, choice_id) to a net change.
+    """
+    bucket = minute_bucket(when)
+    add_rollup_counts({(question_id, choice_id, bucket): delta
+                       for (question_id, choice_id), delta in deltas.items()})
+
+
+def record_vote(user, question, choice):
+    """Insert or move the vote of `user` on `question` to `choice`.
+
+    The vote row is written with a single upsert on the (user, question)
+    unique constraint. The tallies are adjusted by two conditional UPDATEs
+    that compare against the stored vote in SQL, so a repeated vote is a
+    no-op. The first UPDATE takes SQLite's write lock, which serializes
+    concurrent voters for the rest of the transaction.
+
+    :return True if the tallies changed.
+    """
+    if shard_alias(question.pk) != 'default':
+        # The tally UPDATEs cannot look into another database.
+        return bool(apply_votes({(user.pk, question.pk): choice.pk}))
+    current = Vote.objects.filter(user=user, question=question)
+    now = timezone.now()
+    with transaction.atomic():
+        moved = Choice.objects.filter(
+            pk=Subquery(current.values('choice_id')[:1])
+        ).exclude(pk=choice.pk).update(vote_count=F('vote_count') - 1)
+        added = Choice.objects.filter(pk=choice.pk).exclude(
+            Exists(current.filter(choice=choice))
+        ).update(vote_count=F('vote_count') + 1)
+        if added:
+            deltas = {(question.pk, choice.pk): 1}
+            if moved:
+                previous_id = current.values_list('choice_id',
+                                                  flat=True).first()
+                deltas[(question.pk, previous_id)] = -1
+            Vote.objects.bulk_create(
+                [Vote(user=user, question=question, choice=choice,
+                      voted_at=now)],
+                update_conflicts=True,
+                unique_fields=['user', 'question'],
+                update_fields=['choice', 'voted_at'],
+            )
+            add_to_rollups(deltas, now)
+            transaction.on_commit(partial(tallies_committed, question.pk))
+    return bool(added)
+
+
+def apply_votes(votes):
+    """Write a batch of votes and their tally changes in one transaction.
+
+    :param votes: dict mapping (user_id, question_id) to the chosen choice
+                  id; later votes of the same user on a question must
+                  already have replaced earlier ones.
+    :return the number of vote rows that were inserted or moved.
+    """
+    if not votes:
+        return 0
+    now = timezone.now()
+    shards = by_shard(votes, lambda key: key[1])
+    with transaction.atomic(), shard_atomic(shards):
+        # Touch the target choices first so this transaction holds the
+        # write lock before it reads the stored votes.
+        Choice.objects.filter(pk__in=set(votes.values())).update(
+            vote_count=F('vote_count'))
+        stored = {}
+        for alias, keys in shards.items():
+            stored.update({
+                (user_id, question_id): choice_id
+                for user_id, question_id, choice_id
+                in Vote.objects.using(alias).filter(
+                    user_id__in={key[0] for key in keys},
+                    question_id__in={key[1] for key in keys},
+                ).values_list('user_id', 'question_id', 'choice_id')
+            })
+        deltas = Counter()
+        changed = []
+        for (user_id, question_id), choice_id in votes.items():
+            previous_id = stored.get((user_id, question_id))
+            if previous_id == choice_id:
+                continue
+            if previous_id is not None:
+                deltas[(question_id, previous_id)] -= 1
+            deltas[(question_id, choice_id)] += 1
+            changed.append(Vote(user_id=user_id, question_id=question_id,
+                                choice_id=choice_id, voted_at=now))
+        for alias, rows in by_shard(changed,
+                                    lambda vote: vote.question_id).items():
+            Vote.objects.using(alias).bulk_create(
+                rows, batch_size=500, update_conflicts=True,
+                unique_fields=['user', 'question'],
+                update_fields=['choice', 'voted_at'])
+        for (question_id, choice_id), delta in deltas.items():
+            if delta:
+                Choice.objects.filter(pk=choice_id).update(
+                    vote_count=F('vote_count') + delta)
+        add_to_rollups(deltas, now)
+        per_question = Counter(vote.question_id for vote in changed)
+        for question_id, count in per_question.items():
+            transaction.on_commit(
+                partial(tallies_committed, question_id, count))
+    return len(changed)
+
+
+def withdraw_votes(user_id):
+    """Delete every live vote of a user and take it off the tallies.
+
+    The votes in the main database go in this transaction, those in the
+    shards once it commits, so a rolled back delete keeps them all.
+
+    :return the number of votes withdrawn.
+    """
+    aliases = vote_aliases()
+    now = timezone.now()
+    deltas = Counter()
+    with transaction.atomic():
+        for alias in aliases:
+            deltas.update({
+                key: -1 for key in Vote.objects.using(alias)
+                .filter(user_id=user_id)
+                .values_list('question_id', 'choice_id')})
+        Vote.objects.filter(user_id=user_id).delete()
+        for (question_id, choice_id), delta in deltas.items():
+            Choice.objects.filter(pk=choice_id).update(
+                vote_count=F('vote_count') + delta)
+        add_to_rollups(deltas, now)
+        for question_id, _ in deltas:
+            transaction.on_commit(partial(tallies_committed, question_id))
+        transaction.on_commit(partial(delete_votes, aliases, user_id=user_id))
+    return len(deltas)
+
+
+def rebuild_tallies(questions=None, dry_run=False):
+    """Recount votes and fix every choice whose tally has drifted.
+
+    The votes are counted in every shard and archive.
+
+    :param questions: optional iterable of question ids to limit the rebuild.
+    :param dry_run: report the drift without writing it.
+    :return list of (choice, stored count, actual count) that differed.
+    """
+    choices = Choice.objects.all()
+    if questions is not None:
+        questions = list(questions)
+        choices = choices.filter(question_id__in=questions)
+    counts = vote_counts(questions)
+    drifted = []
+    for choice in choices.order_by('pk'):
+        actual = counts.get(choice.pk, 0)
+        if choice.vote_count != actual:
+            drifted.append((choice, choice.vote_count, actual))
+            choice.vote_count = actual
+    if drifted and not dry_run:
+        with transaction.atomic():
+            Choice.objects.bulk_update([row[0] for row in drifted],
+                                       ['vote_count'], batch_size=500)
+        bump_tally_versions({row[0].question_id for row in drifted})
+    return drifted
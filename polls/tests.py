@@ -1,9 +1,46 @@
 """Create the unittest for ku-polls."""
+import asyncio
 import datetime
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+from io import StringIO
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
 from django.urls import reverse
-from django.test import TestCase
+from django.conf import settings
+from django.db import router
+from django.test import (Client, RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
-from .models import Question, User
+from mysite.instrumentation import registry
+from mysite import ratelimit
+from mysite.passwords import HashingPool, HashingUnavailable, verify
+from mysite.tuned_sqlite.base import DatabaseWrapper
+from . import benchmarks, live, shards, snapshots
+from .cache import (TransitionSchedule, latest_questions,
+                    question_choices, question_set_version)
+from .exports import export
+from .imports import import_stream, iter_records
+from .ingest import VoteBuffer, VoteFailed
+from .models import (CLOSE_DELAY, Choice, ChoiceSummary, Question, User,
+                     Vote)
+from .replication import copy_sqlite
+from .summaries import freeze_question
+from .routers import STICKY_COOKIE, read_from_replica
+from .tallies import rebuild_tallies, record_vote
 
 
 def create_question(question_text, days=0, hours=0,
@@ -26,6 +63,27 @@ def create_question(question_text, days=0, hours=0,
                                    pub_date=time, end_date=end_date)
 
 
+def create_poll(days=-1, end_vote_date=1, voters=0, votes=()):
+    """
+    Create the 'Tea or coffee?' question with Tea and Coffee choices.
+
+    `voters` users are created as voter0, voter1, ... and the first of
+    them vote for the choice texts listed in `votes`, in order.
+
+    :return the question, the tea and coffee choices and the voters.
+    """
+    question = create_question('Tea or coffee?', days=days,
+                               end_vote_date=end_vote_date)
+    tea = question.choice_set.create(choice_text='Tea')
+    coffee = question.choice_set.create(choice_text='Coffee')
+    users = [User.objects.create_user(username=f'voter{i}')
+             for i in range(max(voters, len(votes)))]
+    choices = {'Tea': tea, 'Coffee': coffee}
+    for user, text in zip(users, votes):
+        record_vote(user, question, choices[text])
+    return question, tea, coffee, users
+
+
 class QuestionModelTests(TestCase):
     """Create the unittest of model."""
 
@@ -100,10 +158,53 @@ class QuestionModelTests(TestCase):
                             days=-1, end_vote_date=2)
         self.assertIs(in_time_question.can_vote(), True)
 
+    def test_can_vote_without_end_date(self):
+        """A question without an end_date stays open once published."""
+        question = create_question('Tea or coffee?', days=-1)
+        question.end_date = None
+        self.assertIs(question.can_vote(), True)
+
+    def test_state_filters(self):
+        """The open, upcoming and closed filters run in the database."""
+        upcoming = create_question('Upcoming.', days=1, end_vote_date=2)
+        closed = create_question('Closed.', days=-2, end_vote_date=-1)
+        endless = Question.objects.create(question_text='Endless.',
+                                          pub_date=timezone.now(),
+                                          end_date=None)
+        self.assertEqual(list(Question.objects.open()), [endless])
+        self.assertEqual(list(Question.objects.upcoming()), [upcoming])
+        self.assertEqual(list(Question.objects.closed()), [closed])
+        self.assertEqual(Question.objects.published().count(), 2)
+
+    def test_schedule_turns_over_at_transition(self):
+        """The state key changes once the next question opens."""
+        schedule = TransitionSchedule()
+        question = create_question('Upcoming.', days=1, end_vote_date=2)
+        self.assertEqual(schedule.next_transition(), question.pub_date)
+        before = schedule.state_key()
+        self.assertEqual(schedule.state_key(), before)
+        self.assertNotEqual(schedule.state_key(now=question.pub_date),
+                            before)
+        self.assertEqual(schedule.next_transition(question.pub_date),
+                         question.end_date + CLOSE_DELAY)
+
+    def test_admin_list_filters_by_state(self):
+        """The admin list shows and filters the state without errors."""
+        create_question('Tea or coffee?', days=-1, end_vote_date=1)
+        self.client.force_login(User.objects.create_superuser(
+            username='admin', password='admin'))
+        response = self.client.get(
+            reverse('admin:polls_question_changelist'), {'state': 'open'})
+        self.assertContains(response, 'Tea or coffee?')
+
 
 class QuestionIndexViewTests(TestCase):
     """Create unittest of index view."""
 
+    def setUp(self):
+        """Start every test with an empty cache."""
+        cache.clear()
+
     def test_no_questions(self):
         """If no questions exist, an appropriate message is displayed."""
         response = self.client.get(reverse('polls:index'))
@@ -159,6 +260,91 @@ class QuestionIndexViewTests(TestCase):
             [question2, question1],
         )
 
+    def test_index_is_cached(self):
+        """A repeated index request does not query the questions again."""
+        create_question(question_text="Past question.", days=-30)
+        self.client.get(reverse('polls:index'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, "Past question.")
+
+    def test_saved_question_invalidates_cache(self):
+        """Saving a question shows up on the next index request."""
+        self.client.get(reverse('polls:index'))
+        create_question(question_text="New question.", days=-1)
+        response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, "New question.")
+
+    def test_future_question_appears_on_time(self):
+        """A cached index shows a future question once it is published."""
+        question = create_question(question_text="Future question.",
+                                   minutes=5)
+        self.client.get(reverse('polls:index'))
+        later = question.pub_date + datetime.timedelta(seconds=1)
+        with mock.patch('polls.cache.timezone.now', return_value=later):
+            response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, "Future question.")
+
+
+@override_settings(POLLS_INDEX_PAGE_SIZE=2)
+class QuestionPaginationTests(TestCase):
+    """Create unittest of the keyset-paginated index."""
+
+    def setUp(self):
+        """Create five past questions, two of them published together."""
+        cache.clear()
+        self.questions = [create_question(f'Question {i}.', days=-i,
+                                          end_vote_date=2 - i)
+                          for i in range(1, 5)]
+        self.questions.append(Question.objects.create(
+            question_text='Question 5.', pub_date=self.questions[-1].pub_date,
+            end_date=None))
+
+    def walk(self, **params):
+        """:return the ids of every page of the JSON index, in order."""
+        ids = []
+        data = self.client.get(reverse('polls:index'),
+                               {'format': 'json', **params}).json()
+        ids.extend(question['id'] for question in data['questions'])
+        while data['next']:
+            data = self.client.get(data['next']).json()
+            ids.extend(question['id'] for question in data['questions'])
+        return ids
+
+    def test_pages_cover_every_question_once(self):
+        """Following the cursors lists each question once, newest first."""
+        ids = self.walk()
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(set(ids), {q.id for q in self.questions})
+        self.assertEqual(ids[:3], [q.id for q in self.questions[:3]])
+
+    def test_filters(self):
+        """The state and text filters narrow every page."""
+        self.assertEqual(self.walk(state='open'),
+                         [self.questions[0].id, self.questions[4].id])
+        self.assertEqual(self.walk(q='question 3'), [self.questions[2].id])
+
+    def test_html_next_link(self):
+        """The HTML index links to the next page with the same filters."""
+        response = self.client.get(reverse('polls:index'), {'q': 'Question'})
+        self.assertEqual(len(response.context['latest_question_list']), 2)
+        self.assertIn('after=', response.context['next_url'])
+        self.assertIn('q=Question', response.context['next_url'])
+
+    def test_bad_cursor(self):
+        """A malformed cursor is rejected instead of guessed."""
+        response = self.client.get(reverse('polls:index'),
+                                   {'after': 'nonsense', 'format': 'json'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_seek_uses_index(self):
+        """Later pages seek on the index instead of counting past rows."""
+        question = self.questions[2]
+        plan = (Question.objects.filter(pub_date__lte=question.pub_date)
+                .exclude(pub_date=question.pub_date, id__gte=question.id)
+                .order_by('-pub_date', '-id')[:3].explain())
+        self.assertIn('polls_question_pub_date_id', plan)
+
 
 class QuestionDetailViewTests(TestCase):
     """Create unittest of detail view."""
@@ -169,6 +355,7 @@ class QuestionDetailViewTests(TestCase):
         self.user.set_password('demopass1')
         self.user.save()
         self.client.login(username='demo1', password='demopass1')
+        cache.clear()
 
     def test_future_question(self):
         """
@@ -194,3 +381,1246 @@ class QuestionDetailViewTests(TestCase):
         url = reverse('polls:detail', args=(past_question.id,))
         response = self.client.get(url)
         self.assertContains(response, past_question.question_text)
+
+    def test_detail_query_count(self):
+        """With the choices cached, the page reads the question once.
+
+        The other two queries load the session and the user.
+        """
+        question, tea, _, _ = create_poll()
+        record_vote(self.user, question, tea)
+        url = reverse('polls:detail', args=(question.id,))
+        self.client.get(url)
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.context['previous_choice_id'], tea.id)
+        self.assertContains(response, 'Voted', count=1)
+
+    def test_new_choice_invalidates_cache(self):
+        """Adding a choice shows up on the next detail page."""
+        question = create_question('Tea or coffee?', days=-1,
+                                   end_vote_date=1)
+        url = reverse('polls:detail', args=(question.id,))
+        self.client.get(url)
+        question.choice_set.create(choice_text='Juice')
+        self.assertContains(self.client.get(url), 'Juice')
+
+
+@override_settings(
+    SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies',
+    MESSAGE_STORAGE='django.contrib.messages.storage.cookie.CookieStorage')
+class LeanSessionTests(TestCase):
+    """Create unittest of the voting flow with signed cookie sessions."""
+
+    def setUp(self):
+        """Log in a user and create a question with two choices."""
+        cache.clear()
+        self.user = User.objects.create_user(username='demo1',
+                                             password='demopass1')
+        self.client.login(username='demo1', password='demopass1')
+        self.question, self.tea, _, _ = create_poll()
+
+    def test_middleware_listed_once(self):
+        """Every middleware runs once per request."""
+        self.assertEqual(len(settings.MIDDLEWARE),
+                         len(set(settings.MIDDLEWARE)))
+
+    def test_vote_cycle_query_count(self):
+        """A detail, vote and results cycle never touches the sessions.
+
+        The detail page reads the user and the question; the vote also
+        reads the choice and writes the tallies, the vote and its rollup
+        inside a savepoint; the fresh results read the choices.
+        """
+        detail = reverse('polls:detail', args=(self.question.id,))
+        self.client.get(detail)
+        with self.assertNumQueries(2):
+            self.client.get(detail)
+        with self.assertNumQueries(10):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('polls:vote',
+                                         args=(self.question.id,)),
+                                 {'choice': self.tea.id})
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('polls:results',
+                                               args=(self.question.id,)))
+        self.assertEqual(response.context['total_votes'], 1)
+
+    def test_messages_in_cookie(self):
+        """A closed question's message travels in a cookie."""
+        closed = create_question('Closed?', days=-2, end_vote_date=-1)
+        response = self.client.get(reverse('polls:detail',
+                                           args=(closed.id,)))
+        self.assertIn('messages', response.cookies)
+
+
+class VoteTallyTests(TestCase):
+    """Create unittest of the maintained vote tallies."""
+
+    def setUp(self):
+        """Initialize a votable question with two choices."""
+        self.user = User.objects.create_user(username='demo1',
+                                             password='demopass1')
+        self.client.login(username='demo1', password='demopass1')
+        self.question, self.tea, self.coffee, _ = create_poll()
+
+    def vote_for(self, choice):
+        """Post a vote for `choice` as the logged in user."""
+        return self.client.post(reverse('polls:vote',
+                                        args=(self.question.id,)),
+                                {'choice': choice.id})
+
+    def test_vote_increments_tally(self):
+        """A first vote adds one to the selected choice."""
+        response = self.vote_for(self.tea)
+        self.assertEqual(response.status_code, 302)
+        self.tea.refresh_from_db()
+        self.assertEqual(self.tea.votes, 1)
+
+    def test_changed_vote_moves_tally(self):
+        """Changing a vote moves the count to the new choice."""
+        self.vote_for(self.tea)
+        self.vote_for(self.coffee)
+        self.vote_for(self.coffee)
+        self.tea.refresh_from_db()
+        self.coffee.refresh_from_db()
+        self.assertEqual((self.tea.votes, self.coffee.votes), (0, 1))
+        self.assertEqual(Vote.objects.filter(user=self.user).count(), 1)
+
+    def test_rebuild_tallies_command(self):
+        """rebuild_tallies repairs tallies that drifted from the votes."""
+        self.vote_for(self.tea)
+        Choice.objects.filter(pk=self.tea.pk).update(vote_count=7)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_tallies', '--check', stdout=StringIO())
+        call_command('rebuild_tallies', stdout=StringIO())
+        self.tea.refresh_from_db()
+        self.assertEqual(self.tea.votes, 1)
+
+    def test_deleted_user_leaves_tallies(self):
+        """Deleting a voter takes their vote off the tallies."""
+        self.vote_for(self.tea)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.tea.refresh_from_db()
+        self.assertEqual(self.tea.votes, 0)
+        self.assertEqual(rebuild_tallies(dry_run=True), [])
+
+
+class VoteHistoryTests(TestCase):
+    """Create unittest of the vote rollups and the history endpoint."""
+
+    def setUp(self):
+        """Initialize a question with two choices and two voters."""
+        self.question, self.tea, self.coffee, self.users = create_poll(
+            voters=2)
+        self.start = timezone.now().replace(second=0, microsecond=0)
+
+    def vote_at(self, minute, user, choice):
+        """Record a vote `minute` minutes after the start of the test."""
+        when = self.start + datetime.timedelta(minutes=minute, seconds=30)
+        with mock.patch('polls.tallies.timezone.now', return_value=when):
+            record_vote(user, self.question, choice)
+
+    def test_history_follows_votes(self):
+        """The history replays the tallies minute by minute."""
+        first, second = self.users
+        self.vote_at(0, first, self.tea)
+        self.vote_at(0, second, self.tea)
+        self.vote_at(2, first, self.coffee)
+        vote = Vote.objects.get(user=first)
+        self.assertEqual(vote.voted_at,
+                         self.start + datetime.timedelta(minutes=2,
+                                                         seconds=30))
+        response = self.client.get(reverse('polls:results_history',
+                                           args=(self.question.id,)))
+        points = response.json()['points']
+        self.assertEqual(len(points), 2)
+        self.assertEqual(points[0]['tallies'], {str(self.tea.id): 2})
+        self.assertEqual(points[1]['changes'], {str(self.tea.id): -1,
+                                                str(self.coffee.id): 1})
+        self.assertEqual(points[1]['tallies'], {str(self.tea.id): 1,
+                                                str(self.coffee.id): 1})
+
+    def test_history_by_hour(self):
+        """Coarser intervals merge the minute rollups."""
+        self.vote_at(0, self.users[0], self.tea)
+        self.vote_at(1, self.users[1], self.coffee)
+        response = self.client.get(reverse('polls:results_history',
+                                           args=(self.question.id,)),
+                                   {'interval': 'hour'})
+        points = response.json()['points']
+        self.assertEqual(len(points), 1 if self.start.minute < 59 else 2)
+        self.assertEqual(points[-1]['tallies'], {str(self.tea.id): 1,
+                                                 str(self.coffee.id): 1})
+
+
+class ExportTests(TestCase):
+    """Create unittest of the streaming results and votes export."""
+
+    def setUp(self):
+        """Create a question with two voters and log in as staff."""
+        self.question, self.tea, self.coffee, self.users = create_poll(
+            votes=('Tea', 'Coffee'))
+        self.url = reverse('polls:results_export', args=(self.question.id,))
+        self.client.force_login(User.objects.create_user(
+            username='admin', is_staff=True))
+
+    def test_votes_csv(self):
+        """Raw votes stream as CSV, filtered by choice."""
+        response = self.client.get(self.url, {'kind': 'votes',
+                                              'choice': self.tea.id})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,question_id,choice_id,user_id,'
+                                   'voted_at')
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[1].split(',')[2], str(self.tea.id))
+
+    def test_results_jsonl_with_date_range(self):
+        """A date range counts only the votes cast inside it."""
+        Vote.objects.filter(choice=self.tea).update(
+            voted_at=timezone.now() - datetime.timedelta(days=3))
+        since = (timezone.now() - datetime.timedelta(days=1)).date()
+        response = self.client.get(self.url, {'format': 'jsonl',
+                                              'since': since.isoformat()})
+        rows = [json.loads(line) for line
+                in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual({row['choice_text']: row['votes'] for row in rows},
+                         {'Tea': 0, 'Coffee': 1})
+
+    async def test_votes_stream_under_asgi(self):
+        """Under ASGI the export is an async stream of joined chunks."""
+        self.async_client.cookies = self.client.cookies
+        response = await self.async_client.get(self.url, {'kind': 'votes'})
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk
+                            in response.streaming_content])
+        self.assertEqual(len(content.decode().splitlines()), 3)
+
+    def test_export_requires_staff(self):
+        """Voters cannot export everyone's votes."""
+        self.client.force_login(self.users[0])
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+
+    def test_command_writes_votes(self):
+        """The management command streams the same rows."""
+        out = StringIO()
+        call_command('export_votes', 'votes', '--format', 'jsonl',
+                     '--question', str(self.question.id), stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+        with self.assertRaises(CommandError):
+            call_command('export_votes', 'votes', '--since', 'yesterday')
+
+
+class ApiTests(TestCase):
+    """Create unittest of the JSON API."""
+
+    def setUp(self):
+        """Create an open question with two choices and log in."""
+        cache.clear()
+        self.question, self.tea, _, _ = create_poll()
+        self.user = User.objects.create_user(username='demo1')
+        self.client.force_login(self.user)
+        self.url = reverse('polls:api_poll', args=(self.question.id,))
+
+    def test_list(self):
+        """The list links each question to its API URL."""
+        data = self.client.get(reverse('polls:api_poll_list')).json()
+        self.assertEqual(data['questions'][0]['url'], self.url)
+        self.assertIsNone(data['next'])
+
+    def test_vote_returns_tallies(self):
+        """A vote answers with the updated tallies."""
+        response = self.client.post(
+            reverse('polls:api_vote', args=(self.question.id,)),
+            json.dumps({'choice': self.tea.id}),
+            content_type='application/json')
+        self.assertEqual(response.json()['total_votes'], 1)
+        self.assertEqual(response.json()['choices'][0]['votes'], 1)
+        self.assertTrue(response.json()['committed'])
+
+    def test_buffered_and_failed_votes(self):
+        """A vote still buffered is a 202, a dropped one a 503."""
+        url = reverse('polls:api_vote', args=(self.question.id,))
+        with mock.patch('polls.api.submit_vote', return_value=False):
+            response = self.client.post(url, {'choice': self.tea.id})
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(response.json()['committed'])
+        with mock.patch('polls.api.submit_vote', side_effect=VoteFailed):
+            response = self.client.post(url, {'choice': self.tea.id})
+        self.assertEqual(response.status_code, 503)
+
+    def test_vote_rejects_bad_choice(self):
+        """An unknown choice is a client error, not a redirect."""
+        response = self.client.post(
+            reverse('polls:api_vote', args=(self.question.id,)),
+            {'choice': 'tea'})
+        self.assertEqual(response.status_code, 400)
+        self.client.logout()
+        response = self.client.post(
+            reverse('polls:api_vote', args=(self.question.id,)),
+            {'choice': self.tea.id})
+        self.assertEqual(response.status_code, 401)
+
+    def test_no_etag_without_shared_cache(self):
+        """A per-process cache cannot vouch for other workers' votes."""
+        self.client.logout()
+        with self.settings(POLLS_CONDITIONAL_GET=False):
+            response = self.client.get(self.url)
+        self.assertFalse(response.has_header('ETag'))
+
+    @override_settings(POLLS_CONDITIONAL_GET=True)
+    def test_conditional_get(self):
+        """An unchanged poll is a 304 without queries until a vote lands."""
+        self.client.logout()
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            record_vote(self.user, self.question, self.tea)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @override_settings(POLLS_CONDITIONAL_GET=True)
+    def test_conditional_get_sees_closing(self):
+        """The ETag changes once the poll closes, with no vote at all."""
+        self.client.logout()
+        etag = self.client.get(self.url)['ETag']
+        later = timezone.now() + datetime.timedelta(days=2)
+        with mock.patch('polls.cache.timezone.now', return_value=later):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(RATE_LIMITS={'vote:user': '3/30', 'vote:ip': '50/60',
+                                'signup:ip': '2/60'})
+class RateLimitTests(TestCase):
+    """Create unittest of the token bucket rate limits."""
+
+    def setUp(self):
+        """Create a question and a logged in voter with a steady clock."""
+        cache.clear()
+        self.question, self.tea, _, _ = create_poll()
+        self.url = reverse('polls:vote', args=(self.question.id,))
+        self.client.force_login(User.objects.create_user(username='demo1'))
+        self.now = 1000000.0
+        clock = mock.patch('mysite.ratelimit.time.time',
+                           side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def vote(self, client=None, address='10.0.0.1'):
+        """:return the response to a vote for tea."""
+        return (client or self.client).post(self.url, {'choice': self.tea.id},
+                                            REMOTE_ADDR=address)
+
+    def test_steady_voter_is_never_limited(self):
+        """A voter within the rate keeps voting while another floods."""
+        flooder = Client()
+        flooder.force_login(User.objects.create_user(username='demo2'))
+        limited = 0
+        for _ in range(30):
+            self.assertEqual(self.vote().status_code, 302)
+            for _ in range(5):
+                limited += self.vote(flooder, '10.0.0.2').status_code == 429
+            self.now += 10
+        self.assertEqual(limited, 30 * 5 - 3 - 29)
+
+    def test_burst_is_answered_with_429(self):
+        """Votes past the burst wait for the next token."""
+        for _ in range(3):
+            self.assertEqual(self.vote().status_code, 302)
+        response = self.vote()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '10')
+        self.now += 10
+        self.assertEqual(self.vote().status_code, 302)
+
+    def test_address_limit_covers_every_user(self):
+        """Many accounts behind one address share its bucket."""
+        for number in range(50):
+            client = Client()
+            client.force_login(User.objects.create_user(
+                username=f'voter{number}'))
+            self.assertEqual(self.vote(client).status_code, 302)
+        self.assertEqual(self.vote().status_code, 429)
+
+    def test_signup_is_limited(self):
+        """Signups from one address are limited before the form runs."""
+        for expected in (200, 200, 429):
+            response = self.client.post(reverse('signup'), {},
+                                        REMOTE_ADDR='10.0.0.3')
+            self.assertEqual(response.status_code, expected)
+
+    def test_api_vote_is_limited(self):
+        """The JSON API shares the vote buckets and answers in JSON."""
+        url = reverse('polls:api_vote', args=(self.question.id,))
+        for _ in range(3):
+            self.vote()
+        response = self.client.post(url, {'choice': self.tea.id},
+                                    REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json(), {'error': "Too many votes."})
+
+    def test_local_fallback(self):
+        """Buckets fall back to local memory while the cache is down."""
+        ratelimit._local.clear()
+        with mock.patch('mysite.ratelimit.caches') as shared:
+            shared.__getitem__.return_value.get.side_effect = OSError
+            statuses = [self.vote().status_code for _ in range(4)]
+        self.assertEqual(statuses, [302, 302, 302, 429])
+
+    def test_parallel_requests_share_the_burst(self):
+        """Concurrent requests never spend the same token twice."""
+        taken = []
+
+        def take():
+            for _ in range(5):
+                taken.append(ratelimit.take_token('rate:test', 10, 1000))
+
+        with mock.patch.object(ratelimit, 'LOCK_WAIT', 5):
+            threads = [threading.Thread(target=take) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(taken.count(0), 10)
+
+    @override_settings(RATE_LIMIT_TRUSTED_PROXIES=['10.0.0.9'])
+    def test_trusted_proxy(self):
+        """Behind a trusted proxy the forwarded client address counts."""
+        request = RequestFactory().post(
+            '/', REMOTE_ADDR='10.0.0.9',
+            HTTP_X_FORWARDED_FOR='1.2.3.4, 5.6.7.8, 10.0.0.9')
+        self.assertEqual(ratelimit.client_ip(request), '5.6.7.8')
+        request.META['REMOTE_ADDR'] = '5.6.7.8'
+        self.assertEqual(ratelimit.client_ip(request), '5.6.7.8')
+
+
+class QuestionResultsViewTests(TestCase):
+    """Create unittest of results view."""
+
+    def create_choices(self, question, count):
+        """Add `count` choices, giving choice i a tally of i."""
+        for i in range(count):
+            question.choice_set.create(choice_text=f'Choice {i}',
+                                       vote_count=i)
+
+    def test_results_context(self):
+        """The results page exposes the total, percentages and leader."""
+        question = create_question('Past question.', days=-1)
+        self.create_choices(question, 3)
+        response = self.client.get(reverse('polls:results',
+                                           args=(question.id,)))
+        self.assertEqual(response.context['total_votes'], 3)
+        self.assertEqual(response.context['leader'].choice_text, 'Choice 2')
+        percentages = [choice.percentage
+                       for choice in response.context['choices']]
+        self.assertAlmostEqual(percentages[1], 100 / 3)
+        self.assertContains(response, '66.7%')
+
+    def test_results_query_count_is_constant(self):
+        """The number of queries does not grow with the number of choices."""
+        for count in (2, 10):
+            question = create_question(f'{count} choices.', days=-1)
+            self.create_choices(question, count)
+            with self.assertNumQueries(1):
+                self.client.get(reverse('polls:results',
+                                        args=(question.id,)))
+
+    def test_results_without_choices(self):
+        """A question without choices still renders with zero votes."""
+        question = create_question('Empty question.', days=-1)
+        response = self.client.get(reverse('polls:results',
+                                           args=(question.id,)))
+        self.assertEqual(response.context['total_votes'], 0)
+        self.assertIsNone(response.context['leader'])
+
+
+@override_settings(POLLS_RESULTS_SNAPSHOT_SECONDS=60,
+                   POLLS_RESULTS_SNAPSHOT_VOTES=2)
+class ResultsSnapshotTests(TestCase):
+    """Create unittest of the shared results snapshots."""
+
+    def setUp(self):
+        """Create a question with one choice and reset the counters."""
+        cache.clear()
+        registry.reset()
+        self.question, self.tea, _, _ = create_poll()
+        self.url = reverse('polls:results', args=(self.question.id,))
+
+    def counters(self):
+        """:return the snapshot counters recorded so far."""
+        return {name.split('.')[1]: count for name, count
+                in registry.snapshot()['counters'].items()
+                if name.startswith('results_snapshot.')}
+
+    def vote(self, username):
+        """Commit a vote for tea by a new user."""
+        with self.captureOnCommitCallbacks(execute=True):
+            record_vote(User.objects.create_user(username=username),
+                        self.question, self.tea)
+
+    def test_snapshot_is_shared(self):
+        """Later viewers get the snapshot without touching the database."""
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+        self.assertEqual(self.counters(),
+                         {'miss': 1, 'recompute': 1, 'hit': 1})
+
+    def test_rebuilt_after_enough_votes(self):
+        """The snapshot is rebuilt once it is K vote changes behind."""
+        self.client.get(self.url)
+        self.vote('demo1')
+        self.assertEqual(self.client.get(self.url).context['total_votes'], 0)
+        self.vote('demo2')
+        self.assertEqual(self.client.get(self.url).context['total_votes'], 2)
+
+    def test_stale_copy_while_rebuilding(self):
+        """Only the lock holder rebuilds; others serve the stale copy."""
+        self.client.get(self.url)
+        cache.add(snapshots.lock_key(self.question.id), True)
+        later = time.time() + 120
+        with mock.patch('polls.snapshots.time.time', return_value=later):
+            with self.assertNumQueries(0):
+                self.client.get(self.url)
+        self.assertEqual(self.counters()['stale'], 1)
+
+
+class HttpCachingTests(TestCase):
+    """Create unittest of the HTTP cache policy of the poll pages."""
+
+    def setUp(self):
+        """Create an open question with one choice."""
+        cache.clear()
+        self.question, self.tea, _, _ = create_poll()
+        self.url = reverse('polls:results', args=(self.question.id,))
+
+    def test_anonymous_results_are_public(self):
+        """Anonymous results may be shared and revalidate without queries."""
+        response = self.client.get(self.url)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn(f'max-age={settings.POLLS_RESULTS_MAX_AGE}',
+                      response['Cache-Control'])
+        self.assertIn('stale-while-revalidate', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url,
+                                     HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_vote_changes_results_etag(self):
+        """A committed vote makes the voter's next request a full page."""
+        user = User.objects.create_user(username='demo1')
+        self.client.force_login(user)
+        response = self.client.get(self.url)
+        self.assertIn('private', response['Cache-Control'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('polls:vote', args=(self.question.id,)),
+                             {'choice': self.tea.id})
+        response = self.client.get(self.url,
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_question_has_no_etag(self):
+        """A page without a version gets no ETag, so `*` cannot match."""
+        response = self.client.get(reverse('polls:results', args=(99999,)),
+                                   HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+    @override_settings(POLLS_CONDITIONAL_GET=True)
+    def test_index_etag_follows_question_set(self):
+        """The index revalidates until a question is added."""
+        etag = self.client.get(reverse('polls:index'))['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('polls:index'),
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        create_question('Juice?', days=-1)
+        response = self.client.get(reverse('polls:index'),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_index_without_shared_cache_has_no_etag(self):
+        """Another worker's edits would not change a local index ETag."""
+        with self.settings(POLLS_CONDITIONAL_GET=False):
+            response = self.client.get(reverse('polls:index'))
+        self.assertFalse(response.has_header('ETag'))
+
+
+@override_settings(RATE_LIMITS={})
+class ConcurrentVoteTests(TransactionTestCase):
+    """Create stress test of votes posted from parallel requests."""
+
+    def test_parallel_votes_are_counted_once(self):
+        """Parallel votes leave one vote per user and exact tallies."""
+        question, *choices, _ = create_poll()
+        users = [User.objects.create_user(username=f'voter{i}',
+                                          password='demopass1')
+                 for i in range(4)]
+        url = reverse('polls:vote', args=(question.id,))
+        errors = []
+
+        def post_votes(user):
+            client = Client()
+            try:
+                client.force_login(user)
+                for i in range(10):
+                    response = client.post(
+                        url, {'choice': choices[i % 2].id})
+                    if response.status_code != 302:
+                        errors.append(response.status_code)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=post_votes, args=(user,))
+                   for user in users for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(Vote.objects.count(), len(users))
+        for choice in choices:
+            choice.refresh_from_db()
+            self.assertEqual(choice.votes,
+                             Vote.objects.filter(choice=choice).count())
+        self.assertEqual(sum(choice.votes for choice in choices), len(users))
+
+
+class VoteBufferTests(TransactionTestCase):
+    """Create unittest of the buffered vote ingestion."""
+
+    def setUp(self):
+        """Initialize a question with two choices and two voters."""
+        self.question, self.tea, self.coffee, self.users = create_poll(
+            voters=2)
+
+    def test_stop_drains_coalesced_votes(self):
+        """Stopping the buffer writes the last vote of each user."""
+        vote_buffer = VoteBuffer(flush_interval=60)
+        first, second = self.users
+        vote_buffer.submit(first.id, self.question.id, self.tea.id)
+        vote_buffer.submit(first.id, self.question.id, self.coffee.id)
+        vote_buffer.submit(second.id, self.question.id, self.coffee.id)
+        self.assertEqual(Vote.objects.count(), 0)
+        vote_buffer.stop()
+        self.assertEqual(Vote.objects.filter(choice=self.coffee).count(), 2)
+        self.tea.refresh_from_db()
+        self.coffee.refresh_from_db()
+        self.assertEqual((self.tea.votes, self.coffee.votes), (0, 2))
+
+    def test_full_buffer_flushes_early(self):
+        """Reaching max_votes flushes without waiting for the interval."""
+        vote_buffer = VoteBuffer(flush_interval=60, max_votes=2)
+        ticket = vote_buffer.submit(self.users[0].id, self.question.id,
+                                    self.tea.id)
+        vote_buffer.submit(self.users[1].id, self.question.id, self.tea.id)
+        self.assertTrue(vote_buffer.wait(ticket, timeout=5))
+        self.tea.refresh_from_db()
+        self.assertEqual(self.tea.votes, 2)
+        vote_buffer.stop()
+
+    @override_settings(POLLS_VOTE_INGESTION={
+        'MODE': 'buffered', 'FLUSH_INTERVAL_MS': 10,
+        'FLUSH_MAX_VOTES': 500, 'WAIT_FOR_FLUSH': True,
+        'FLUSH_TIMEOUT_MS': 5000,
+    })
+    def test_buffered_vote_view(self):
+        """In buffered mode a vote is committed before the redirect."""
+        self.client.force_login(self.users[0])
+        response = self.client.post(
+            reverse('polls:vote', args=(self.question.id,)),
+            {'choice': self.coffee.id})
+        self.assertEqual(response.status_code, 302)
+        self.coffee.refresh_from_db()
+        self.assertEqual(self.coffee.votes, 1)
+
+    @override_settings(POLLS_VOTE_INGESTION={
+        'MODE': 'buffered', 'FLUSH_INTERVAL_MS': 10,
+        'FLUSH_MAX_VOTES': 500, 'WAIT_FOR_FLUSH': True,
+        'FLUSH_TIMEOUT_MS': 5000,
+    })
+    def test_dropped_vote_is_reported(self):
+        """A vote whose batch fails is an error, not a redirect."""
+        self.client.force_login(self.users[0])
+        with mock.patch('polls.ingest.apply_votes',
+                        side_effect=RuntimeError), \
+                self.assertLogs('polls.ingest', 'ERROR'):
+            response = self.client.post(
+                reverse('polls:vote', args=(self.question.id,)),
+                {'choice': self.coffee.id})
+        self.assertEqual(response.status_code, 503)
+        self.assertContains(response, "could not be recorded",
+                            status_code=503)
+
+
+class LiveResultsTests(TransactionTestCase):
+    """Create unittest of the streaming results endpoint."""
+
+    def setUp(self):
+        """Initialize a question with two choices and two voters."""
+        self.question, self.tea, self.coffee, self.users = create_poll(
+            voters=2)
+
+    async def next_event(self, stream):
+        """:return the data of the next event on `stream`."""
+        chunk = await asyncio.wait_for(stream.__anext__(), timeout=5)
+        data = chunk.decode().split('data: ', 1)[1]
+        return {int(key): value for key, value in json.loads(data).items()}
+
+    async def test_watchers_receive_coalesced_updates(self):
+        """Every watcher gets one delta, built from one read per vote."""
+        url = reverse('polls:results_stream', args=(self.question.id,))
+        streams = []
+        for _ in range(3):
+            response = await self.async_client.get(url)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            streams.append(response.streaming_content)
+        for stream in streams:
+            self.assertEqual(await self.next_event(stream),
+                             {self.tea.id: 0, self.coffee.id: 0})
+        with mock.patch('polls.live.current_tallies',
+                        wraps=live.current_tallies) as aggregate:
+            for user in self.users:
+                await sync_to_async(record_vote)(user, self.question,
+                                                 self.coffee)
+        self.assertEqual(aggregate.call_count, len(self.users))
+        for stream in streams:
+            self.assertEqual(await self.next_event(stream),
+                             {self.coffee.id: 2})
+            await stream.aclose()
+
+    @override_settings(POLLS_LIVE_STREAM_SECONDS=0)
+    async def test_stream_ends_and_unsubscribes(self):
+        """A stream past its lifetime ends, even if nobody closes it."""
+        response = await self.async_client.get(
+            reverse('polls:results_stream', args=(self.question.id,)))
+        stream = response.streaming_content
+        await self.next_event(stream)
+        with self.assertRaises(StopAsyncIteration):
+            await stream.__anext__()
+        self.assertFalse(live.publisher.has_subscribers(self.question.id))
+
+    def test_publish_reads_outside_the_lock(self):
+        """Publishing reads the tallies without blocking other questions."""
+        publisher = live.TallyPublisher()
+        subscription = mock.Mock(question_id=self.question.id)
+        publisher._subscribers[self.question.id].add(subscription)
+
+        def read(question_id):
+            self.assertFalse(publisher._lock.locked())
+            return {self.tea.id: 0}
+
+        with mock.patch('polls.live.current_tallies', side_effect=read):
+            publisher.publish(self.question.id)
+        subscription.offer.assert_called_once_with({self.tea.id: 0})
+
+    async def test_results_page_follows_stream_under_asgi(self):
+        """Only an ASGI results page opens the live stream."""
+        url = reverse('polls:results', args=(self.question.id,))
+        response = await self.async_client.get(url)
+        self.assertContains(response, 'EventSource')
+        response = await sync_to_async(self.client.get)(url)
+        self.assertNotContains(response, 'EventSource')
+
+    def test_wsgi_request_gets_one_snapshot(self):
+        """Without ASGI the stream sends one snapshot and a retry hint."""
+        response = self.client.get(reverse('polls:results_stream',
+                                           args=(self.question.id,)))
+        self.assertContains(response, 'retry: ')
+        self.assertContains(response, f'"{self.tea.id}": 0')
+
+
+class BenchmarkTests(TestCase):
+    """Create unittest of the benchmark helpers."""
+
+    def test_seed_keeps_tallies_consistent(self):
+        """Seeded votes are unique per user and match the tallies."""
+        counts = benchmarks.seed(users=10, questions=3, choices=2, votes=25)
+        self.assertEqual(counts['votes'], 25)
+        self.assertEqual(Vote.objects.count(), 25)
+        self.assertEqual(rebuild_tallies(dry_run=True), [])
+
+    def test_measure_reports_plans(self):
+        """Every hot query gets a plan and a timing."""
+        benchmarks.seed(users=5, questions=2, choices=2, votes=10)
+        queries = benchmarks.hot_queries(random.Random(0))
+        report = benchmarks.measure(queries, repeat=2)
+        self.assertEqual(set(report), set(queries))
+        plan = report['votes per choice of a question']['plan']
+        self.assertIn('polls_vote_question_choice', plan)
+
+
+class LoadBenchmarkTests(TransactionTestCase):
+    """Create unittest of the view load test driver."""
+
+    def test_drive_reports_every_request(self):
+        """The driver reports latency percentiles and queries per request."""
+        benchmarks.seed(users=4, questions=2, choices=2, votes=4)
+        report = benchmarks.drive('results', requests=10, concurrency=2)
+        self.assertEqual(report['requests'], 10)
+        self.assertEqual(report['errors'], 0)
+        self.assertLessEqual(report['latency_ms']['p50'],
+                             report['latency_ms']['max'])
+        self.assertLessEqual(report['queries_per_request'], 1)
+
+    def test_login_throughput(self):
+        """The login benchmark reports logins per second per core."""
+        report = benchmarks.login_throughput(logins=2, concurrency=2)
+        self.assertEqual(report['failures'], 0)
+        self.assertGreater(report['logins_per_second_per_core'], 0)
+
+
+class InstrumentationTests(TestCase):
+    """Create unittest of the request instrumentation middleware."""
+
+    def setUp(self):
+        """Start every test with empty metrics."""
+        registry.reset()
+        self.question = create_question('Past question.', days=-1)
+        self.question.choice_set.create(choice_text='Yes')
+
+    @override_settings(METRICS_SAMPLE_RATE=1.0, INTERNAL_IPS=['127.0.0.1'])
+    def test_sampled_request_is_recorded(self):
+        """A sampled request adds its wall, query and template time."""
+        self.client.get(reverse('polls:results', args=(self.question.id,)))
+        response = self.client.get(reverse('metrics'))
+        results = response.json()['views']['polls:results']
+        self.assertEqual(results['wall_ms']['count'], 1)
+        self.assertEqual(results['db_queries']['mean'], 1)
+        self.assertEqual(results['template_ms']['count'], 1)
+        self.assertGreater(results['template_ms']['mean'], 0)
+
+    @override_settings(METRICS_SAMPLE_RATE=1.0)
+    async def test_async_request_skips_query_histograms(self):
+        """An async request records no made-up zero query times."""
+        await self.async_client.get(reverse('polls:results',
+                                            args=(self.question.id,)))
+        results = registry.snapshot()['views']['polls:results']
+        self.assertEqual(results['wall_ms']['count'], 1)
+        self.assertEqual(results['template_ms']['count'], 1)
+        self.assertEqual(results['db_queries']['count'], 0)
+        self.assertEqual(results['db_ms']['count'], 0)
+
+    @override_settings(METRICS_SAMPLE_RATE=0.0)
+    def test_unsampled_request_is_not_recorded(self):
+        """With a zero sample rate nothing is recorded."""
+        self.client.get(reverse('polls:results', args=(self.question.id,)))
+        self.assertEqual(registry.snapshot()['views'], {})
+
+    def test_metrics_hidden_from_outside(self):
+        """Anonymous clients outside INTERNAL_IPS cannot read metrics."""
+        response = self.client.get(reverse('metrics'),
+                                   REMOTE_ADDR='203.0.113.9')
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(INTERNAL_IPS=['127.0.0.1'],
+                       RATE_LIMIT_TRUSTED_PROXIES=['127.0.0.1'])
+    def test_metrics_hidden_behind_local_proxy(self):
+        """A local proxy does not make the clients it forwards internal."""
+        response = self.client.get(reverse('metrics'),
+                                   HTTP_X_FORWARDED_FOR='203.0.113.9')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code,
+                         200)
+
+
+class SQLiteTuningTests(SimpleTestCase):
+    """Create unittest of the tuned SQLite database profile."""
+
+    def setUp(self):
+        """Work in a scratch directory."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_backend_applies_pragmas(self):
+        """The tuned backend switches new connections to WAL."""
+        settings_dict = dict(connection.settings_dict,
+                             ENGINE='mysite.tuned_sqlite',
+                             NAME=os.path.join(self.directory, 'tuned.db'),
+                             OPTIONS={'pragmas':
+                                      settings.SQLITE_TUNED_PRAGMAS})
+        wrapper = DatabaseWrapper(settings_dict)
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0],
+                             settings.SQLITE_TUNED_PRAGMAS['busy_timeout'])
+
+    def test_tuned_profile_commits_every_vote(self):
+        """Concurrent writers on the tuned profile commit without errors."""
+        report = benchmarks.sqlite_vote_throughput(
+            os.path.join(self.directory, 'tuned.db'),
+            settings.SQLITE_TUNED_PRAGMAS, writers=2, votes=20, readers=1)
+        self.assertEqual(report['errors'], 0)
+        self.assertEqual(report['votes'], 40)
+
+
+@override_settings(POLLS_READ_DATABASE='replica')
+class ReplicaRoutingTests(TestCase):
+    """Create unittest of the read replica routing."""
+
+    @staticmethod
+    @read_from_replica
+    def routed_aliases(request):
+        """:return the read aliases chosen for a poll and a user."""
+        return router.db_for_read(Question), router.db_for_read(User)
+
+    def test_page_reads_go_to_replica(self):
+        """Poll reads of a decorated view use the replica, auth does not."""
+        request = RequestFactory().get('/')
+        self.assertEqual(self.routed_aliases(request), ('replica', 'default'))
+        self.assertEqual(router.db_for_read(Question), 'default')
+
+    def test_recent_voter_reads_primary(self):
+        """The sticky cookie pins poll reads to the primary."""
+        request = RequestFactory().get('/')
+        request.COOKIES[STICKY_COOKIE] = '1'
+        self.assertEqual(self.routed_aliases(request)[0], 'default')
+
+    def test_snapshot_reads_primary(self):
+        """A snapshot carries the newest version, so it reads the primary."""
+        question = create_question('Tea or coffee?', days=-1)
+        question.choice_set.create(choice_text='Tea')
+        build = read_from_replica(
+            lambda request: snapshots.build_snapshot(question.id))
+        snapshot = build(RequestFactory().get('/'))
+        self.assertEqual(len(snapshot['choices']), 1)
+
+    def test_choice_list_reads_primary(self):
+        """The choice list is cached for good, so it reads the primary."""
+        question = create_question('Tea or coffee?', days=-1)
+        question.choice_set.create(choice_text='Tea')
+        cache.clear()
+        choices = read_from_replica(
+            lambda request: question_choices(question.id))
+        self.assertEqual([choice['choice_text'] for choice
+                          in choices(RequestFactory().get('/'))], ['Tea'])
+
+    def test_cached_listing_reads_primary(self):
+        """The index listing is cached under a primary version."""
+        question = create_question('Tea or coffee?', days=-1)
+        cache.clear()
+        listing = read_from_replica(lambda request: latest_questions())
+        self.assertEqual(listing(RequestFactory().get('/')), [question])
+
+    def test_vote_sets_sticky_cookie(self):
+        """Voting pins the voter to the primary for a while."""
+        user = User.objects.create_user(username='demo1')
+        self.client.force_login(user)
+        question, choice, _, _ = create_poll()
+        response = self.client.post(reverse('polls:vote',
+                                            args=(question.id,)),
+                                    {'choice': choice.id})
+        self.assertEqual(response.cookies[STICKY_COOKIE]['max-age'],
+                         settings.POLLS_REPLICA_STICKY_SECONDS)
+
+    def test_replication_copies_database(self):
+        """The replication stand-in copies one SQLite file onto another."""
+        with tempfile.TemporaryDirectory() as directory:
+            primary = os.path.join(directory, 'primary.db')
+            replica = os.path.join(directory, 'replica.db')
+            with sqlite3.connect(primary) as conn:
+                conn.execute('CREATE TABLE vote (choice INTEGER)')
+                conn.execute('INSERT INTO vote VALUES (1)')
+            copy_sqlite(primary, replica)
+            with closing(sqlite3.connect(replica)) as conn:
+                rows = conn.execute('SELECT choice FROM vote').fetchall()
+        self.assertEqual(rows, [(1,)])
+
+
+class VoteShardTests(TestCase):
+    """Create unittest of the vote shards and archives."""
+
+    def setUp(self):
+        """Create a question closed two days ago, with two votes."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        archive_dir = override_settings(POLLS_VOTE_ARCHIVE_DIR=directory.name)
+        archive_dir.enable()
+        self.addCleanup(archive_dir.disable)
+        self.question, self.tea, self.coffee, self.users = create_poll(
+            days=-5, end_vote_date=5, votes=('Tea', 'Coffee'))
+        Question.objects.filter(pk=self.question.pk).update(
+            end_date=timezone.now() - datetime.timedelta(days=2))
+
+    @override_settings(POLLS_VOTE_SHARDS=4)
+    def test_votes_routed_to_question_shard(self):
+        """Votes naming their question go to that question's shard."""
+        self.assertEqual(shards.shard_alias(6), 'votes_2')
+        self.assertEqual(router.db_for_write(Vote, instance=Vote(
+            question_id=6)), 'votes_2')
+        self.assertEqual(router.db_for_read(Vote, instance=self.tea),
+                         shards.shard_alias(self.question.id))
+        self.assertEqual(router.db_for_read(Vote, instance=User()),
+                         'default')
+        self.assertTrue(router.allow_migrate('votes_1', 'polls',
+                                             model_name='vote'))
+        self.assertFalse(router.allow_migrate('votes_1', 'polls',
+                                              model_name='choice'))
+
+    def test_archive_closed_question(self):
+        """Archived votes leave the live table but still count."""
+        call_command('archive_vote_shards', stdout=StringIO())
+        path = shards.archive_path(self.question.id)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o444)
+        self.assertFalse(Vote.objects.filter(question=self.question).exists())
+        self.assertEqual(rebuild_tallies(), [])
+        self.assertEqual(
+            len(list(export('votes', 'csv',
+                            questions=[self.question.id]))), 3)
+        response = self.client.get(reverse('polls:results',
+                                           args=(self.question.id,)))
+        self.assertEqual(response.context['total_votes'], 2)
+
+    def test_recently_closed_question_stays_live(self):
+        """Only questions closed for long enough are archived."""
+        call_command('archive_vote_shards', '--closed-for', '3',
+                     stdout=StringIO())
+        self.assertEqual(Vote.objects.filter(question=self.question).count(),
+                         2)
+        self.assertEqual(shards.archived_question_ids(), set())
+
+    def test_restore(self):
+        """Restoring moves the archived votes back to the live table."""
+        call_command('archive_vote_shards', stdout=StringIO())
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('archive_vote_shards', str(self.question.id),
+                         '--restore', stdout=StringIO())
+        self.assertEqual(Vote.objects.filter(question=self.question).count(),
+                         2)
+        self.assertFalse(os.path.exists(
+            shards.archive_path(self.question.id)))
+        self.assertEqual(rebuild_tallies(), [])
+
+    def test_restore_keeps_newer_vote(self):
+        """A user who voted again after the archive keeps that vote."""
+        call_command('archive_vote_shards', stdout=StringIO())
+        user = self.users[0]
+        Vote.objects.create(user=user, question=self.question,
+                            choice=self.coffee)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(shards.restore_question(self.question.id), 1)
+        self.assertEqual(Vote.objects.get(user=user).choice, self.coffee)
+        self.assertEqual(Vote.objects.filter(question=self.question).count(),
+                         2)
+
+    def test_closed_question_refuses_votes(self):
+        """A vote on a closed question is not recorded."""
+        self.client.force_login(User.objects.create_user(username='demo3'))
+        response = self.client.post(reverse('polls:vote',
+                                            args=(self.question.id,)),
+                                    {'choice': self.tea.id})
+        self.assertRedirects(response, reverse('polls:index'),
+                             fetch_redirect_response=False)
+        self.assertEqual(Vote.objects.count(), 2)
+
+
+class FreezeTests(TestCase):
+    """Create unittest of the frozen results of closed questions."""
+
+    def setUp(self):
+        """Create a question closed two days ago, with three votes."""
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        archive_dir = override_settings(POLLS_VOTE_ARCHIVE_DIR=directory.name)
+        archive_dir.enable()
+        self.addCleanup(archive_dir.disable)
+        self.question, self.tea, self.coffee, self.users = create_poll(
+            days=-5, end_vote_date=5, votes=('Tea', 'Tea', 'Coffee'))
+        Question.objects.filter(pk=self.question.pk).update(
+            end_date=timezone.now() - datetime.timedelta(days=2))
+        self.url = reverse('polls:results', args=(self.question.id,))
+
+    def freeze(self, *args):
+        """Run freeze_polls with `args`."""
+        call_command('freeze_polls', *args, stdout=StringIO(),
+                     stderr=StringIO())
+
+    def test_results_from_summary(self):
+        """A frozen question's results never read the vote table."""
+        self.freeze()
+        self.assertEqual(ChoiceSummary.objects.filter(
+            question=self.question).count(), 2)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertFalse([query for query in queries
+                          if 'polls_vote' in query['sql']])
+        self.assertEqual(response.context['total_votes'], 3)
+        self.assertEqual(response.context['leader'], self.tea)
+        later = time.time() + 3600
+        with mock.patch('polls.snapshots.time.time', return_value=later):
+            with self.assertNumQueries(0):
+                self.client.get(self.url)
+
+    def test_open_question_is_not_frozen(self):
+        """Questions that still accept votes are left alone."""
+        question = create_question('Juice?', days=-1, end_vote_date=1)
+        question.choice_set.create(choice_text='Orange')
+        self.freeze()
+        self.assertFalse(ChoiceSummary.objects.filter(
+            question=question).exists())
+        with self.assertRaises(ValueError):
+            freeze_question(question.id)
+
+    def test_drifted_tallies_are_not_frozen(self):
+        """Tallies that disagree with the votes are refused."""
+        Choice.objects.filter(pk=self.tea.pk).update(vote_count=5)
+        with self.assertRaises(CommandError):
+            self.freeze()
+        self.assertFalse(ChoiceSummary.objects.exists())
+
+    def test_verify(self):
+        """Verification compares the summary with the archived votes."""
+        self.freeze('--archive-votes')
+        self.assertFalse(Vote.objects.exists())
+        self.freeze('--verify')
+        ChoiceSummary.objects.filter(choice=self.tea).update(votes=7)
+        with self.assertRaises(CommandError):
+            self.freeze('--verify')
+
+    def test_reopening_thaws(self):
+        """A reopened question is served from its live tallies again."""
+        self.freeze()
+        self.question.refresh_from_db()
+        self.question.end_date = timezone.now() + datetime.timedelta(days=1)
+        self.question.save()
+        self.assertFalse(ChoiceSummary.objects.exists())
+
+    def test_reopening_restores_archived_votes(self):
+        """A returning voter changes their archived vote, not adds one."""
+        self.freeze('--archive-votes')
+        self.question.refresh_from_db()
+        self.question.end_date = timezone.now() + datetime.timedelta(days=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.question.save()
+        self.assertEqual(shards.archived_question_ids(), set())
+        self.client.force_login(self.users[0])
+        self.client.post(reverse('polls:vote', args=(self.question.id,)),
+                         {'choice': self.coffee.id})
+        self.assertEqual(Vote.objects.filter(question=self.question).count(),
+                         3)
+        self.coffee.refresh_from_db()
+        self.assertEqual(self.coffee.vote_count, 2)
+        self.assertEqual(rebuild_tallies(), [])
+
+
+class ImportTests(TestCase):
+    """Create unittest of the streaming bulk importer."""
+
+    records = [
+        {'model': 'auth.user', 'pk': 50,
+         'fields': {'username': 'importer', 'password': '!'}},
+        {'model': 'polls.question', 'pk': 60,
+         'fields': {'question_text': 'Tea or coffee?',
+                    'pub_date': '2022-09-01T00:00:00Z',
+                    'end_date': '2030-09-01T00:00:00Z'}},
+        {'model': 'polls.choice', 'pk': 70,
+         'fields': {'question': 60, 'choice_text': 'Tea'}},
+        {'model': 'polls.choice', 'pk': 71,
+         'fields': {'question': 60, 'choice_text': 'Coffee'}},
+        {'model': 'polls.vote', 'pk': 80,
+         'fields': {'user': 50, 'question': 60, 'choice': 71}},
+    ]
+
+    def test_reads_json_array_and_lines(self):
+        """Both formats decode to the same records across small chunks."""
+        array = StringIO(json.dumps(self.records, indent=2))
+        lines = StringIO('\n'.join(json.dumps(r) for r in self.records))
+        self.assertEqual(list(iter_records(array, read_size=7)), self.records)
+        self.assertEqual(list(iter_records(lines, read_size=7)), self.records)
+
+    def test_import_refreshes_tallies_and_caches(self):
+        """Imported votes are counted and the listings are invalidated."""
+        version = question_set_version()
+        summary = import_stream(StringIO(json.dumps(self.records)),
+                                batch_size=2)
+        self.assertEqual(summary['rows']['polls.Vote'], 1)
+        self.assertEqual(Choice.objects.get(pk=71).votes, 1)
+        self.assertEqual(Choice.objects.get(pk=70).votes, 0)
+        self.assertNotEqual(question_set_version(), version)
+
+
+class PasswordTests(TestCase):
+    """Create unittest of the hasher profile and offloaded logins."""
+
+    @override_settings(
+        PASSWORD_HASHERS=['mysite.passwords.TunedScryptPasswordHasher',
+                          'django.contrib.auth.hashers.MD5PasswordHasher'],
+        PASSWORD_HASHER_PARAMS={'SCRYPT_WORK_FACTOR': 2 ** 10})
+    def test_login_rehashes_with_profile_hasher(self):
+        """A login with an outdated hash stores it with the new hasher."""
+        user = User.objects.create(username='demo1',
+                                   password=make_password('demopass1',
+                                                          hasher='md5'))
+        self.assertEqual(authenticate(username='demo1',
+                                      password='demopass1'), user)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('scrypt$'))
+        self.assertIsNone(authenticate(username='demo1', password='nope'))
+
+    def test_pool_verifies_in_worker_process(self):
+        """The pool checks passwords in a separate process."""
+        pool = HashingPool(workers=1)
+        try:
+            encoded = make_password('demopass1')
+            self.assertEqual(pool.run(verify, 'demopass1', encoded),
+                             (True, None))
+        finally:
+            pool.shutdown()
+
+    def test_shutdown_cancels_queued_hashes(self):
+        """Shutdown cancels the queue itself, as Python 3.8 cannot."""
+        pool = HashingPool(workers=1)
+        executor = pool._executor = mock.Mock()
+        queued = mock.Mock()
+        pool._pending.add(queued)
+        pool.shutdown()
+        queued.cancel.assert_called_once_with()
+        executor.shutdown.assert_called_once_with()
+
+    def test_saturated_pool_rejects(self):
+        """A login that cannot get a hashing slot fails fast."""
+        pool = HashingPool(workers=1, max_pending=1)
+        pool._slots.acquire()
+        with self.assertRaises(HashingUnavailable):
+            pool.run(verify, 'demopass1', '', timeout=0.01)
+
+    def test_signup_logs_in_new_user(self):
+        """Signing up logs the saved user in and opens the polls."""
+        response = self.client.post(reverse('signup'), {
+            'username': 'student1',
+            'password1': 'kupolls-pass-2022',
+            'password2': 'kupolls-pass-2022',
+        })
+        self.assertRedirects(response, reverse('polls:index'))
+        self.assertEqual(int(self.client.session['_auth_user_id']),
+                         User.objects.get(username='student1').pk)
+
+    def test_signup_hashes_through_offload(self):
+        """Signup hashes like a login does, and fails while saturated."""
+        data = {'username': 'student1', 'password1': 'kupolls-pass-2022',
+                'password2': 'kupolls-pass-2022'}
+        with mock.patch('mysite.views.offload',
+                        side_effect=HashingUnavailable):
+            response = self.client.post(reverse('signup'), data)
+        self.assertContains(response, "Too many signups", status_code=503)
+        self.assertFalse(User.objects.filter(username='student1').exists())
+        with mock.patch('mysite.views.offload',
+                        return_value='offloaded') as offload:
+            self.client.post(reverse('signup'), data)
+        offload.assert_called_once_with(make_password, 'kupolls-pass-2022')
+        self.assertEqual(User.objects.get(username='student1').password,
+                         'offloaded')
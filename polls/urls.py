@@ -1,11 +1,20 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 
 app_name = 'polls'
 urlpatterns = [
     path('', views.IndexView.as_view(), name='index'),
     path('<int:question_id>/', views.DetailView.as_view(), name='detail'),
     path('<int:pk>/results/', views.ResultsView.as_view(), name='results'),
+    path('<int:pk>/results/history/', views.results_history,
+         name='results_history'),
+    path('<int:pk>/results/export/', views.results_export,
+         name='results_export'),
+    path('<int:pk>/results/stream/', views.results_stream,
+         name='results_stream'),
     path('<int:question_id>/vote/', views.vote, name='vote'),
+    path('api/', api.poll_list, name='api_poll_list'),
+    path('api/<int:pk>/', api.poll_detail, name='api_poll'),
+    path('api/<int:pk>/vote/', api.poll_vote, name='api_vote'),
 ]
@@ -1,37 +1,123 @@
 """Views of polls app."""
+import json
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.utils import timezone
-from django.http import HttpResponseRedirect, Http404
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Trunc
+from django.http import (HttpResponse, HttpResponseRedirect, Http404,
+                         JsonResponse, StreamingHttpResponse)
 from django.urls import reverse
+from django.utils.http import quote_etag
 from django.views import generic
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, get_object_or_404, redirect
-from .models import Choice, Question, Vote
+from django.utils.decorators import method_decorator
+from mysite.ratelimit import rate_limit
+from .models import Choice, Question, Vote, VoteRollup
+from .cache import question_choices, schedule, tally_version
+from .exports import FORMATS, KINDS, async_chunks, export, parse_moment
+from .http import cache_policy
+from .ingest import VoteFailed, submit_vote
+from .listing import question_page, question_summary
+from .live import current_tallies, publisher
+from .routers import (STICKY_COOKIE, read_alias, read_from_replica,
+                      stick_to_primary)
+from .shards import previous_choice_id, shard_alias
+from .snapshots import current_snapshot, results_snapshot
 
 
-def get_queryset(self):
-    """Get queryset function.
+def index_version(request):
+    """:return the version of every index page, for its ETag.
 
-    :return the last five published questions.
-    (not including those set to be published in the future).
+    That is None unless conditional GETs are on: a per-process version
+    would miss the question edits made through other workers.
     """
-    return Question.objects.filter(
-        pub_date__lte=timezone.now()
-    ).order_by('-pub_date')[:5]
+    if not settings.POLLS_CONDITIONAL_GET:
+        return None
+    return schedule.state_key()
 
 
+def index_max_age(request):
+    """:return how long a shared cache may keep an index page."""
+    return schedule.timeout(settings.POLLS_INDEX_MAX_AGE)
+
+
+def results_version(request, pk):
+    """:return the version of the results page of question `pk`.
+
+    That is the version of the snapshot the page would be built from, or
+    None when the snapshot is due, so the view runs and rebuilds it.
+    """
+    if STICKY_COOKIE in request.COOKIES:
+        return tally_version(pk)
+    snapshot = current_snapshot(pk)
+    return snapshot and snapshot['version']
+
+
+@method_decorator(read_from_replica, name='dispatch')
+@method_decorator(cache_policy(index_version, index_max_age, per_user=True),
+                  name='dispatch')
 class IndexView(generic.ListView):
-    """Question index page that display the latest question."""
+    """Question index page, newest first, one keyset page at a time.
+
+    ``?after=`` takes the cursor of the previous page, ``?state=open`` or
+    ``?state=closed`` and ``?q=`` narrow the list, and ``?format=json``
+    returns the page as JSON.
+    """
 
     template_name = 'polls/index.html'
     context_object_name = 'latest_question_list'
 
+    def get(self, request, *args, **kwargs):
+        """Load the requested page, or explain why it cannot be found."""
+        as_json = request.GET.get('format') == 'json'
+        try:
+            self.page, self.next_cursor = question_page(
+                after=request.GET.get('after'),
+                state=request.GET.get('state'),
+                search=request.GET.get('q', '').strip())
+        except ValueError as error:
+            if as_json:
+                return JsonResponse({'error': str(error)}, status=400)
+            messages.error(request, str(error))
+            return redirect('polls:index')
+        if as_json:
+            return JsonResponse({
+                'questions': [question_summary(question)
+                              for question in self.page],
+                'next': self.next_url('json'),
+            })
+        return super().get(request, *args, **kwargs)
+
     def get_queryset(self):
-        """:return the last five published questions."""
-        return Question.objects.filter(pub_date__lte=timezone.now()
-                                       ).order_by('-pub_date')[:5]
+        """:return the questions of the requested page."""
+        return self.page
+
+    def next_url(self, output_format=None):
+        """:return the URL of the following page with the same filters."""
+        if self.next_cursor is None:
+            return None
+        params = self.request.GET.copy()
+        params['after'] = self.next_cursor
+        if output_format:
+            params['format'] = output_format
+        return f"{reverse('polls:index')}?{params.urlencode()}"
 
+    def get_context_data(self, **kwargs):
+        """Add the filters and the link to the next page."""
+        context = super().get_context_data(**kwargs)
+        context['state'] = self.request.GET.get('state', '')
+        context['search'] = self.request.GET.get('q', '')
+        context['next_url'] = self.next_url()
+        return context
 
+
+@method_decorator(read_from_replica, name='dispatch')
 class DetailView(generic.DetailView):
     """Detail view class."""
     model = Question
@@ -42,56 +128,243 @@ class DetailView(generic.DetailView):
         return Question.objects.filter(pub_date__lte=timezone.now())
 
     def get(self, request, question_id):
-        """Question detail page that can vote the question."""
-        try:
-            question = get_object_or_404(Question, pk=question_id)
-        except Http404:
+        """Question detail page that can vote the question.
+
+        The question and the current user's previous choice are read in
+        one query, or two when the votes are sharded; the choices come
+        from the cache.
+        """
+        questions = Question.objects.filter(pk=question_id)
+        sharded = shard_alias(question_id) != 'default'
+        if request.user.is_authenticated and not sharded:
+            questions = questions.annotate(previous_choice_id=Subquery(
+                Vote.objects.filter(question=OuterRef('pk'),
+                                    user=request.user)
+                .values('choice_id')[:1]))
+        question = questions.first()
+        if question is None:
             messages.error(request, "Poll does not exists.")
             return redirect('polls:index')
         if not question.can_vote():
             messages.error(request, 'Voting is not allowed!')
             return redirect('polls:index')
-        try:
-            prev_choice = question.vote_set.get(user=request.user,
-                                                question=question).choice
-        except (KeyError, Vote.DoesNotExist):
-            return render(request, 'polls/detail.html', {'question': question})
-        return render(request, 'polls/detail.html',
-                      {'question': question, 'previous_choice': prev_choice})
+        previous = getattr(question, 'previous_choice_id', None)
+        if request.user.is_authenticated and sharded:
+            previous = previous_choice_id(request.user, question.id)
+        return render(request, 'polls/detail.html', {
+            'question': question,
+            'choices': question_choices(question.id),
+            'previous_choice_id': previous,
+        })
 
 
+@method_decorator(read_from_replica, name='dispatch')
+@method_decorator(cache_policy(results_version,
+                               settings.POLLS_RESULTS_MAX_AGE),
+                  name='dispatch')
 class ResultsView(generic.DetailView):
     """Question results page that display the score vote of the question."""
 
     model = Question
     template_name = 'polls/results.html'
 
+    def get(self, request, *args, **kwargs):
+        """Render the results from the shared snapshot of the question.
+
+        A client that just voted gets a freshly built snapshot instead.
+        """
+        self.snapshot = results_snapshot(
+            kwargs['pk'], fresh=STICKY_COOKIE in request.COOKIES)
+        if self.snapshot is None:
+            raise Http404("Poll does not exists.")
+        self.object = self.snapshot['question']
+        response = self.render_to_response(
+            self.get_context_data(object=self.object))
+        response['ETag'] = quote_etag(str(self.snapshot['version']))
+        return response
+
+    def get_context_data(self, **kwargs):
+        """Add the total votes, per-choice percentage and the leader.
+
+        `live` asks the page to follow the results stream, which only
+        streams under ASGI and never changes for a frozen question.
+        """
+        context = super().get_context_data(**kwargs)
+        context.update(choices=self.snapshot['choices'],
+                       total_votes=self.snapshot['total_votes'],
+                       leader=self.snapshot['leader'],
+                       live=(isinstance(self.request, ASGIRequest)
+                             and not self.snapshot.get('frozen')))
+        return context
+
+
+def results_history(request, pk):
+    """Return the tallies of a question over time as JSON.
+
+    The series is read from the per-minute rollups; ``?interval=hour`` or
+    ``?interval=day`` merges them into coarser buckets.
+    """
+    question = get_object_or_404(Question, pk=pk)
+    interval = request.GET.get('interval', 'minute')
+    if interval not in ('minute', 'hour', 'day'):
+        return JsonResponse({'error': "interval must be minute, hour or day."},
+                            status=400)
+    rows = (VoteRollup.objects.filter(question=question)
+            .annotate(period=Trunc('bucket', interval))
+            .values('period', 'choice_id')
+            .annotate(change=Sum('count'))
+            .order_by('period', 'choice_id'))
+    tallies = {}
+    points = []
+    for row in rows:
+        if not points or points[-1]['time'] != row['period'].isoformat():
+            points.append({'time': row['period'].isoformat(), 'changes': {}})
+        points[-1]['changes'][row['choice_id']] = row['change']
+        tallies[row['choice_id']] = (tallies.get(row['choice_id'], 0)
+                                     + row['change'])
+        points[-1]['tallies'] = dict(tallies)
+    return JsonResponse({
+        'question': question.id,
+        'interval': interval,
+        'choices': list(question.choice_set.order_by('pk')
+                        .values('id', 'choice_text')),
+        'points': points,
+    })
+
+
+@staff_member_required
+def results_export(request, pk):
+    """Stream the results or raw votes of a question as CSV or JSON Lines.
+
+    ``?kind=results|votes`` picks the rows and ``?format=csv|jsonl`` the
+    encoding; ``since``, ``until`` and repeated ``choice`` narrow them.
+    """
+    question = get_object_or_404(Question, pk=pk)
+    kind = request.GET.get('kind', 'results')
+    output_format = request.GET.get('format', 'csv')
+    if kind not in KINDS or output_format not in FORMATS:
+        return JsonResponse({'error': "kind must be results or votes and "
+                                      "format must be csv or jsonl."},
+                            status=400)
+    try:
+        filters = {
+            'questions': [question.id],
+            'choices': [int(value) for value
+                        in request.GET.getlist('choice')],
+            'since': parse_moment(request.GET.get('since')),
+            'until': parse_moment(request.GET.get('until'), end=True),
+        }
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    # The rows are read after the view returns, so pick the alias now.
+    rows = export(kind, output_format, using=read_alias(request), **filters)
+    if isinstance(request, ASGIRequest):
+        rows = async_chunks(rows)
+    response = StreamingHttpResponse(rows,
+                                     content_type=FORMATS[output_format])
+    response['Content-Disposition'] = (
+        f'attachment; filename="question-{question.id}-{kind}.'
+        f'{output_format}"')
+    return response
+
+
+def server_sent_event(event, data):
+    """:return `data` encoded as one server-sent event."""
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+async def results_stream(request, pk):
+    """Stream the tallies of a question as server-sent events.
+
+    The first event carries every choice; later events only carry the
+    choices whose tally changed.
+    """
+    if not await Question.objects.filter(pk=pk).aexists():
+        raise Http404("Poll does not exists.")
+    if not isinstance(request, ASGIRequest):
+        # A WSGI server would buffer an endless stream, so send a single
+        # snapshot and let the browser reconnect.
+        tallies = await sync_to_async(current_tallies)(pk)
+        retry = settings.POLLS_LIVE_KEEPALIVE_SECONDS * 1000
+        response = HttpResponse(f'retry: {retry}\n'
+                                + server_sent_event('tallies', tallies),
+                                content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        return response
+    subscription = publisher.subscribe(pk)
+    try:
+        tallies = await sync_to_async(current_tallies)(pk)
+    except BaseException:
+        publisher.unsubscribe(subscription)
+        raise
+    subscription.prime(tallies)
+    keepalive = settings.POLLS_LIVE_KEEPALIVE_SECONDS
+    # Django 4.2 keeps running a stream after its client has gone, so
+    # every stream ends after a while and EventSource reconnects.
+    deadline = time.monotonic() + settings.POLLS_LIVE_STREAM_SECONDS
+
+    async def events():
+        try:
+            yield server_sent_event('tallies', tallies)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                changes = await subscription.changes(
+                    timeout=min(keepalive, remaining))
+                if changes is None:
+                    yield ': keep-alive\n\n'
+                elif changes:
+                    yield server_sent_event('tallies', changes)
+        finally:
+            publisher.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(events(),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def vote_error(request, question, message, status=200):
+    """:return the voting form of `question` showing `message`."""
+    return render(request, 'polls/detail.html', {
+        'question': question,
+        'choices': question_choices(question.id),
+        'error_message': message,
+    }, status=status)
+
 
 @login_required(login_url='/accounts/login/')
+@rate_limit('vote')
 def vote(request, question_id):
     """Vote function that increase a value of vote and save to vote result."""
     user = request.user
-    print("current user is", user.id, 'login', user.username)
-    print("Real name:", user.first_name, user.last_name)
     if not user.is_authenticated:
         return redirect('login')
     question = get_object_or_404(Question, pk=question_id)
+    if not question.can_vote():
+        # Closed questions may already have their votes archived.
+        messages.error(request, 'Voting is not allowed!')
+        return redirect('polls:index')
     try:
         selected_choice = question.choice_set.get(pk=request.POST['choice'])
     except (KeyError, Choice.DoesNotExist):
         # Redisplay the question voting form.
-        return render(request, 'polls/detail.html', {
-            'question': question,
-            'error_message': "You didn't select a choice.",
-        })
+        return vote_error(request, question, "You didn't select a choice.")
     try:
-        vote_object = Vote.objects.get(user=user, question=question)
-        vote_object.choice = selected_choice
-        vote_object.save()
-    except Vote.DoesNotExist:
-        Vote.objects.create(user=user,
-                            choice=selected_choice, question=question).save()
-        # Always return an HttpResponseRedirect after successfully dealing
-        # with POST data. This prevents data from being posted twice if a
-        # user hits the Back button.
-    return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
+        committed = submit_vote(user, question, selected_choice)
+    except VoteFailed:
+        return vote_error(request, question,
+                          "Your vote could not be recorded, please try "
+                          "again.", status=503)
+    if not committed and settings.POLLS_VOTE_INGESTION['WAIT_FOR_FLUSH']:
+        # Promised but not confirmed: it may still land, or not.
+        return vote_error(request, question,
+                          "Your vote is taking long to record, please "
+                          "check the results in a moment.", status=503)
+    # Always return an HttpResponseRedirect after successfully dealing
+    # with POST data. This prevents data from being posted twice if a
+    # user hits the Back button.
+    return stick_to_primary(
+        HttpResponseRedirect(reverse('polls:results', args=(question.id,))))